@@ -0,0 +1,110 @@
+from pathlib import Path
+from typing import IO, List, Optional
+import tempfile
+import socket
+import errno
+import fcntl
+import time
+import os
+
+from lib.node_config import cfg_template
+
+# Leases of loopback address blocks, so that many tests can run on one host at the same time.
+# Block `i` is the /24 network 127.{i // 256}.{i % 256} (block 0 is 127.0.0, the addresses used before leases existed)
+# together with a range of `PORTS_PER_LEASE` TCP ports for host-wide services.
+# A lease is an exclusive `flock` on `<lock dir>/block-<i>.lock`: the kernel releases it when the holder
+# exits or crashes. Nodes outlive the process that started them, so a block is only leased
+# if none of its addresses has a Scylla port in use.
+
+MAX_BLOCKS = 256
+PORTS_PER_LEASE = 100
+PORTS_START = 20000
+
+DEFAULT_LOCK_DIR = Path(os.environ.get('SCYLLA_TEST_LEASE_DIR', Path(tempfile.gettempdir()) / 'scylla-test-leases'))
+
+# Ports Scylla binds on each node address
+def node_ports() -> List[int]:
+    return [
+        int(cfg_template.get('storage_port', 7000)),
+        int(cfg_template.get('native_transport_port', 9042)),
+        int(cfg_template.get('api_port', 10000)),
+        int(cfg_template.get('prometheus_port', 9180)),
+    ]
+
+def block_net(i: int) -> str:
+    return f'127.{i // 256}.{i % 256}'
+
+class AddressLease:
+    def __init__(self, index: int, lock_file: IO[str]):
+        self.index = index
+        # e.g. '127.0.3'; node addresses are f'{net}.{host}' with 1 <= host <= 254
+        self.net = block_net(index)
+        self.ports = range(PORTS_START + index * PORTS_PER_LEASE, PORTS_START + (index + 1) * PORTS_PER_LEASE)
+        self.__lock_file: Optional[IO[str]] = lock_file
+
+    def ip(self, host: int) -> str:
+        assert 1 <= host <= 254
+        return f'{self.net}.{host}'
+
+    def release(self) -> None:
+        if self.__lock_file:
+            self.__lock_file.close()
+            self.__lock_file = None
+
+    def __enter__(self) -> 'AddressLease':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.release()
+
+    def __repr__(self) -> str:
+        return f'AddressLease({self.net}.0/24, ports {self.ports.start}-{self.ports.stop - 1})'
+
+def _port_in_use(ip: str, port: int) -> bool:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            s.bind((ip, port))
+        except OSError as e:
+            if e.errno == errno.EADDRINUSE:
+                return True
+            raise
+    return False
+
+# Whether any of the first `num_hosts` addresses of the block has a Scylla port in use
+def block_in_use(i: int, num_hosts: int = 254) -> bool:
+    ports = node_ports()
+    return any(_port_in_use(f'{block_net(i)}.{h}', p) for h in range(1, num_hosts + 1) for p in ports)
+
+# Whether block `i` is leased by some process or used by running nodes
+def is_block_live(i: int, lock_dir: Path = DEFAULT_LOCK_DIR) -> bool:
+    path = lock_dir / f'block-{i}.lock'
+    if path.exists():
+        with open(path, 'a+') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+    return block_in_use(i)
+
+# Leases the first free block. `owner` (e.g. the run directory) is written to the lock file for diagnostics.
+# The lease is held until `release` is called, the lease is garbage collected or the process exits;
+# keep a reference to it for as long as the addresses are used.
+def lease_addresses(owner: str = '', lock_dir: Path = DEFAULT_LOCK_DIR) -> AddressLease:
+    lock_dir.mkdir(parents = True, exist_ok = True)
+    for i in range(MAX_BLOCKS):
+        f = open(lock_dir / f'block-{i}.lock', 'a+')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            continue
+        if block_in_use(i):
+            f.close()
+            continue
+        f.seek(0)
+        f.truncate()
+        f.write(f'pid {os.getpid()} since {time.ctime()}: {owner}\n')
+        f.flush()
+        return AddressLease(i, f)
+    raise RuntimeError(f'All {MAX_BLOCKS} address blocks are leased or in use (lock files in {lock_dir})')
@@ -0,0 +1,59 @@
+from typing import Awaitable, Optional, TypeVar
+from concurrent.futures import Future
+from threading import Thread
+import asyncio
+
+T = TypeVar('T')
+
+# Runs an asyncio event loop in a background thread, so that synchronous code (e.g. run.py) can schedule
+# coroutines on it: operations of many `AsyncNode`s, nemeses and probes then share a single thread.
+class EventLoopThread:
+    def __init__(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.__thread: Optional[Thread] = None
+
+    def start(self) -> None:
+        if self.__thread:
+            return
+        self.__thread = Thread(target = self.loop.run_forever, daemon = True)
+        self.__thread.start()
+
+    # Cancels the coroutines which are still running and stops the loop
+    def stop(self) -> None:
+        if not self.__thread:
+            return
+        async def cancel_all() -> None:
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions = True)
+        self.run(cancel_all())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.__thread.join()
+        self.__thread = None
+        self.loop.close()
+
+    # Schedules the coroutine; cancelling the returned future cancels the coroutine
+    def submit(self, coro: Awaitable[T]) -> 'Future[T]':
+        return asyncio.run_coroutine_threadsafe(coro, self.loop) # type: ignore
+
+    # Runs the coroutine and waits for its result; on timeout, the coroutine is cancelled and TimeoutError raised
+    def run(self, coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+        return self.submit(asyncio.wait_for(coro, timeout)).result()
+
+    # An event for coroutines of this loop which can be set from any thread with `set`
+    def event(self) -> asyncio.Event:
+        async def mk() -> asyncio.Event:
+            return asyncio.Event()
+        return self.run(mk())
+
+    def set(self, e: asyncio.Event) -> None:
+        self.loop.call_soon_threadsafe(e.set)
+
+# Sleeps for `seconds` or until `e` is set; returns whether it was set
+async def sleep_unless(e: asyncio.Event, seconds: float) -> bool:
+    try:
+        await asyncio.wait_for(e.wait(), seconds)
+        return True
+    except asyncio.TimeoutError:
+        return False
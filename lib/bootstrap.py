@@ -0,0 +1,118 @@
+from pathlib import Path
+from typing import Optional, List, Sequence, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from threading import Lock
+import subprocess
+import logging
+import json
+import time
+import re
+
+from lib.node import Node, StartupFailed
+
+@dataclass(frozen=True)
+class BootTiming:
+    ip: str
+    # Wall-clock time (seconds since the epoch) at which the (last) start attempt began
+    started_at: float
+    # Duration of the successful start attempt in seconds
+    duration: float
+    attempts: int
+    # Whether the node joined concurrently with other nodes
+    concurrent: bool
+
+# Returns the (major, minor) version of the given Scylla binary, or None if it cannot be determined,
+# e.g. for development builds ("666.development-...").
+def scylla_version(scylla_path: Path) -> Optional[Tuple[int, int]]:
+    try:
+        out = subprocess.run([scylla_path, '--version'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                universal_newlines=True, timeout=30).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    m = re.match(r"\s*(\d+)\.(\d+)", out)
+    if not m:
+        return None
+    return (int(m.group(1)), int(m.group(2)))
+
+# How many nodes can join the cluster at the same time.
+# Nodes can bootstrap concurrently only with Raft-based topology changes
+# (enabled by default in Scylla 6.0/Enterprise 2024.2, experimental in 5.4/2024.1);
+# with gossip-based topology, the cluster rejects a bootstrap while another one is in progress.
+def max_concurrent_joins(scylla_path: Path, experimental: Sequence[str]) -> Optional[int]:
+    """
+    Returns None if any number of nodes may join concurrently.
+    """
+    if 'consistent-topology-changes' in experimental:
+        return None
+    v = scylla_version(scylla_path)
+    if v is None:
+        return 1
+    if v >= (2024, 2) or (6, 0) <= v < (2000, 0):
+        return None
+    return 1
+
+__timings_lock = Lock()
+
+# Appends the timing as a JSON line to `run_path/boot_times.jsonl`.
+# Safe to call from multiple threads.
+def record_boot_timing(run_path: Path, timing: BootTiming) -> None:
+    with __timings_lock:
+        with open(run_path / 'boot_times.jsonl', 'a') as f:
+            f.write(json.dumps(asdict(timing)) + '\n')
+
+# Start the node, retrying up to `max_attempts` times if it fails to initialize.
+def start_node(logger: logging.Logger, n: Node, max_attempts: int, concurrent: bool) -> BootTiming:
+    attempt = 1
+    while True:
+        started_at = time.time()
+        try:
+            n.start()
+        except StartupFailed as e:
+            if attempt >= max_attempts:
+                raise
+            logger.warning(f'Start attempt {attempt} of node {n.ip()} failed: {e}')
+            attempt += 1
+            continue
+        return BootTiming(ip = n.ip(), started_at = started_at, duration = time.time() - started_at,
+                attempts = attempt, concurrent = concurrent)
+
+# Start the first node (the seed), then join the remaining nodes, at most `join_concurrency` at a time
+# (None means no limit). Nodes whose join was rejected are then started again one by one.
+# Per-node timings are appended to `run_path/boot_times.jsonl`.
+def boot_cluster(
+        logger: logging.Logger, run_path: Path, nodes: Sequence[Node],
+        join_concurrency: Optional[int] = 1, max_attempts: int = 3) -> List[BootTiming]:
+    assert nodes
+    assert join_concurrency is None or join_concurrency > 0
+
+    boot_start = time.time()
+    timings: List[BootTiming] = []
+    def record(t: BootTiming) -> None:
+        timings.append(t)
+        record_boot_timing(run_path, t)
+
+    seed, joining = nodes[0], nodes[1:]
+    record(start_node(logger, seed, max_attempts, False))
+
+    workers = len(joining) if join_concurrency is None else min(join_concurrency, len(joining))
+    rejected: List[Node] = []
+    if workers > 1:
+        logger.info(f'Joining {len(joining)} nodes to {seed.ip()}, {workers} at a time...')
+        with ThreadPoolExecutor(max_workers = workers) as ex:
+            futs = [(n, ex.submit(start_node, logger, n, 1, True)) for n in joining]
+            for n, f in futs:
+                try:
+                    record(f.result())
+                except StartupFailed as e:
+                    logger.warning(f'Concurrent join of node {n.ip()} rejected, will retry serially: {e}')
+                    rejected.append(n)
+    else:
+        rejected = list(joining)
+
+    for n in rejected:
+        record(start_node(logger, n, max_attempts, False))
+
+    logger.info('Cluster {} booted in {:.1f}s; node start times: {}'.format(
+        seed.ip(), time.time() - boot_start, ', '.join(f'{t.ip}: {t.duration:.1f}s' for t in timings)))
+    return timings
@@ -0,0 +1,134 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from dataclasses import dataclass
+from enum import IntEnum
+from uuid import UUID
+import datetime
+
+from cassandra import ConsistencyLevel # type: ignore
+from cassandra.metadata import protect_name # type: ignore
+from cassandra.query import SimpleStatement # type: ignore
+
+CDC_LOG_SUFFIX = '_scylla_cdc_log'
+
+def cdc_log_table(table: str) -> str:
+    return table + CDC_LOG_SUFFIX
+
+def is_cdc_log_table(table: str) -> bool:
+    return table.endswith(CDC_LOG_SUFFIX)
+
+# Values of the `cdc$operation` column
+class Operation(IntEnum):
+    PRE_IMAGE = 0
+    UPDATE = 1
+    INSERT = 2
+    ROW_DELETE = 3
+    PARTITION_DELETE = 4
+    ROW_RANGE_DELETE_INCLUSIVE_LEFT_BOUND = 5
+    ROW_RANGE_DELETE_EXCLUSIVE_LEFT_BOUND = 6
+    ROW_RANGE_DELETE_INCLUSIVE_RIGHT_BOUND = 7
+    ROW_RANGE_DELETE_EXCLUSIVE_RIGHT_BOUND = 8
+    POST_IMAGE = 9
+
+def is_image(op: int) -> bool:
+    return op in (Operation.PRE_IMAGE, Operation.POST_IMAGE)
+
+# Operations which affect a single row; the others (partition and range deletes) may affect the whole partition
+def is_row_operation(op: int) -> bool:
+    return op in (Operation.UPDATE, Operation.INSERT, Operation.ROW_DELETE, Operation.PRE_IMAGE, Operation.POST_IMAGE)
+
+# Number of 100ns intervals between the UUID epoch (1582-10-15) and the Unix epoch
+UUID_EPOCH_OFFSET = 0x01b21dd213814000
+
+# Microseconds since the Unix epoch encoded in a timeuuid (such as `cdc$time`)
+def timeuuid_to_micros(u: UUID) -> int:
+    return (u.time - UUID_EPOCH_OFFSET) // 10
+
+# Builds `SELECT * FROM ks.table WHERE k1 = ? AND k2 = ? ...` for the given key columns
+def select_by_key(keyspace: str, table: str, key_columns: Sequence[str]) -> str:
+    return 'SELECT * FROM {}.{} WHERE {}'.format(protect_name(keyspace), protect_name(table),
+            ' AND '.join(f'{protect_name(c)} = ?' for c in key_columns))
+
+# Zips a row returned by the driver with the result's column names.
+# Works regardless of the session's row factory, as long as rows are tuples.
+def row_dict(column_names: Sequence[str], row: Any) -> Dict[str, Any]:
+    return dict(zip(column_names, row))
+
+def primary_key_columns(table_meta: Any) -> List[str]:
+    return [c.name for c in table_meta.partition_key] + [c.name for c in table_meta.clustering_key]
+
+def partition_key_columns(table_meta: Any) -> List[str]:
+    return [c.name for c in table_meta.partition_key]
+
+# Timestamps of CDC generations (oldest first), from `system_distributed.cdc_streams`.
+# Returned as naive UTC datetimes, like all timestamps returned by the driver.
+def generation_timestamps(session: Any) -> List[datetime.datetime]:
+    res = session.execute(SimpleStatement('SELECT time FROM system_distributed.cdc_streams',
+            consistency_level = ConsistencyLevel.QUORUM))
+    return sorted(r[0] for r in res)
+
+@dataclass(frozen=True)
+class Change:
+    table: str
+    stream_id: bytes
+    # `cdc$time` in microseconds since the epoch
+    time_us: int
+    # Values of the primary key columns for row operations,
+    # of the partition key columns for partition and range deletes
+    key: Tuple[Any, ...]
+    row_op: bool
+
+# How many newest CDC log rows to fetch per stream when looking for the newest change;
+# pre- and postimage rows share `cdc$time` with the change they describe and are skipped
+NEWEST_ROWS_LIMIT = 16
+
+# Prepared statements for reading the changes of a table from the master's CDC log
+# and the data affected by them from the master and replica clusters.
+class ChangeReader:
+    # `master`'s cluster metadata must contain the schema of `table`
+    def __init__(self, master: Any, replica: Any, keyspace: str, table: str):
+        meta = master.cluster.metadata.keyspaces[keyspace].tables[table]
+        self.table = table
+        self.pk = partition_key_columns(meta)
+        self.key = primary_key_columns(meta)
+        log = f'{protect_name(keyspace)}.{protect_name(cdc_log_table(table))}'
+
+        self.streams = SimpleStatement(f'SELECT DISTINCT "cdc$stream_id" FROM {log}',
+                consistency_level = ConsistencyLevel.QUORUM)
+        self.newest = master.prepare(
+                f'SELECT * FROM {log} WHERE "cdc$stream_id" = ? ORDER BY "cdc$time" DESC LIMIT {NEWEST_ROWS_LIMIT}')
+        self.newest.consistency_level = ConsistencyLevel.QUORUM
+
+        def prep(s: Any, cols: List[str]):
+            p = s.prepare(select_by_key(keyspace, table, cols))
+            p.consistency_level = ConsistencyLevel.QUORUM
+            return p
+        self.master_row, self.replica_row = prep(master, self.key), prep(replica, self.key)
+        self.master_partition, self.replica_partition = prep(master, self.pk), prep(replica, self.pk)
+
+    # The newest change among the result of `self.newest` for stream `sid`, or None if there is none
+    def newest_change(self, sid: bytes, rs: Any) -> Optional[Change]:
+        rows = (row_dict(rs.column_names, r) for r in rs)
+        r = next((r for r in rows if not is_image(r['cdc$operation'])), None)
+        if r is None:
+            return None
+        row_op = is_row_operation(r['cdc$operation'])
+        return Change(table = self.table, stream_id = sid, time_us = timeuuid_to_micros(r['cdc$time']),
+                key = tuple(r[c] for c in (self.key if row_op else self.pk)), row_op = row_op)
+
+    # Statement reading the row (or partition) affected by the change; bind it with `c.key`
+    def affected(self, c: Change, replica: bool) -> Any:
+        if c.row_op:
+            return self.replica_row if replica else self.master_row
+        return self.replica_partition if replica else self.master_partition
+
+# Whether two query results contain the same rows.
+# Rows returned by different clusters are compared as tuples (e.g. UDT values are instances of different classes).
+def same_rows(a: Any, b: Any) -> bool:
+    return [tuple(r) for r in a] == [tuple(r) for r in b]
+
+# Stream IDs of the generation with the given timestamp
+def generation_streams(session: Any, gen_time: datetime.datetime) -> List[bytes]:
+    res = session.execute(SimpleStatement('SELECT streams FROM system_distributed.cdc_streams WHERE time = %s',
+            consistency_level = ConsistencyLevel.QUORUM), (gen_time,))
+    row = res.one()
+    return sorted(row[0]) if row and row[0] else []
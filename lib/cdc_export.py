@@ -0,0 +1,200 @@
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from concurrent.futures import ProcessPoolExecutor, Future
+from dataclasses import dataclass, field, asdict
+from array import array
+import multiprocessing
+import bisect
+import datetime
+import logging
+import struct
+import json
+import os
+
+from cassandra import ConsistencyLevel # type: ignore
+from cassandra.cluster import Cluster, Session # type: ignore
+from cassandra.metadata import protect_name # type: ignore
+
+from lib.cdc import UUID_EPOCH_OFFSET, cdc_log_table, is_image
+from lib.columnar import ColumnarWriter
+from lib.histogram import Histogram
+from lib.tokens import TokenRange, ring_ranges
+
+# Exports the CDC log of a table for analysis: the ring is split into token ranges which are read in parallel
+# by a pool of worker processes (each with its own driver connection) using paged reads.
+# Each worker decodes the `cdc$time`s of a page at once and computes, for every stream of its ranges
+# (a stream's rows are in one range, ordered by time), the number of changes, the first and last change
+# and the gaps between consecutive changes. Changes are the delta rows; pre- and post-image rows are only
+# counted separately. The main process merges the results and writes:
+# - `cdc_log.col` (see lib/columnar.py): one row per log row (images included) with its `cdc$time`
+#   (seconds since the epoch), the stream (an index into the streams of `cdc_export.json`) and `cdc$operation`,
+# - `cdc_export.json`: per-stream and per-generation change counts and rates, and histograms of the gaps
+#   between consecutive changes of a stream and of the streams' rates.
+
+@dataclass(frozen=True)
+class ExportConfig:
+    address: str
+    keyspace: str
+    # The base table
+    table: str
+    out: Path
+    workers: int = max(1, os.cpu_count() or 1)
+    # Number of token ranges read separately
+    splits: int = 256
+    page_size: int = 5000
+
+@dataclass
+class StreamStats:
+    count: int = 0
+    first_us: int = 0
+    last_us: int = 0
+
+# What a worker read from one token range
+@dataclass
+class RangeResult:
+    streams: List[bytes] = field(default_factory=list)
+    # Per row: index into `streams`, time and operation
+    stream_idx: array = field(default_factory=lambda: array('l'))
+    time_us: array = field(default_factory=lambda: array('q'))
+    ops: array = field(default_factory=lambda: array('b'))
+    stats: List[StreamStats] = field(default_factory=list)
+    # Microseconds between consecutive distinct `cdc$time`s of a stream
+    gaps: Histogram = field(default_factory=Histogram)
+    # Pre- and post-image rows
+    images: int = 0
+
+_UUID_TIME = struct.Struct('>IHH8x')
+
+# Microseconds since the epoch of the timeuuids given as their concatenated 16-byte representations
+def timeuuids_to_micros(raw: bytes) -> array:
+    return array('q', ((((hi & 0x0fff) << 48 | mid << 32 | low) - UUID_EPOCH_OFFSET) // 10
+                       for low, mid, hi in _UUID_TIME.iter_unpack(raw)))
+
+def scan_query(keyspace: str, table: str) -> str:
+    log = f'{protect_name(keyspace)}.{protect_name(cdc_log_table(table))}'
+    return (f'SELECT "cdc$stream_id", "cdc$time", "cdc$operation" FROM {log}'
+            ' WHERE token("cdc$stream_id") > ? AND token("cdc$stream_id") <= ?')
+
+# Per-process state of pool workers
+_session: Optional[Session] = None
+_prepared: Dict[str, Any] = {}
+
+def _init_worker(address: str, page_size: int) -> None:
+    global _session
+    _session = Cluster([address], protocol_version = 4).connect()
+    _session.default_timeout = 60
+    _session.default_fetch_size = page_size
+
+def _add_page(res: RangeResult, sids: List[bytes], times: array, ops: List[int]) -> None:
+    for sid, t, op in zip(sids, times, ops):
+        if not res.streams or res.streams[-1] != sid:
+            res.streams.append(sid)
+            res.stats.append(StreamStats(first_us = t, last_us = t))
+        res.stream_idx.append(len(res.streams) - 1)
+        if is_image(op):
+            res.images += 1
+            continue
+        s = res.stats[-1]
+        if s.count and t != s.last_us:
+            res.gaps.record(max(0, t - s.last_us))
+        elif not s.count:
+            s.first_us = t
+        s.count += 1
+        s.last_us = t
+    res.time_us.extend(times)
+    res.ops.extend(ops)
+
+def _scan_range(query: str, r: TokenRange) -> RangeResult:
+    assert _session
+    if query not in _prepared:
+        p = _session.prepare(query)
+        p.consistency_level = ConsistencyLevel.QUORUM
+        _prepared[query] = p
+    res = RangeResult()
+    rs = _session.execute(_prepared[query], r)
+    while True:
+        rows = rs.current_rows
+        if rows:
+            _add_page(res, [bytes(row[0]) for row in rows], timeuuids_to_micros(b''.join(row[1].bytes for row in rows)),
+                      [row[2] for row in rows])
+        if not rs.has_more_pages:
+            return res
+        rs.fetch_next_page()
+
+def _rate(count: int, first_us: int, last_us: int) -> Optional[float]:
+    return count / ((last_us - first_us) / 1e6) if last_us > first_us else None
+
+# `generations`: timestamps of the CDC generations of the cluster (naive UTC datetimes, e.g. from lib/stream_index.py)
+def export_cdc_log(logger: logging.Logger, cfg: ExportConfig, generations: Sequence[datetime.datetime]) -> dict:
+    cfg.out.mkdir(parents = True, exist_ok = True)
+    query = scan_query(cfg.keyspace, cfg.table)
+    epoch = datetime.datetime(1970, 1, 1)
+    gens = sorted((g - epoch) // datetime.timedelta(microseconds = 1) for g in generations)
+    gen_counts = [0] * len(gens)
+    streams: List[Tuple[bytes, StreamStats]] = []
+    gaps = Histogram()
+    images = 0
+
+    logger.info(f'Exporting the CDC log of {cfg.keyspace}.{cfg.table}: {cfg.splits} ranges, {cfg.workers} workers')
+    # Spawn rather than fork: the parent may have driver threads running
+    with ProcessPoolExecutor(max_workers = cfg.workers, mp_context = multiprocessing.get_context('spawn'),
+            initializer = _init_worker, initargs = (cfg.address, cfg.page_size)) as ex, \
+            ColumnarWriter(cfg.out / 'cdc_log.col') as w:
+        fs: List[Future] = [ex.submit(_scan_range, query, r) for r in ring_ranges(cfg.splits)]
+        for i, fut in enumerate(fs):
+            res: RangeResult = fut.result()
+            base = len(streams)
+            streams.extend(zip(res.streams, res.stats))
+            gaps.merge(res.gaps)
+            images += res.images
+            for t, op in zip(res.time_us, res.ops):
+                if is_image(op):
+                    continue
+                # The generation active at `t`
+                g = bisect.bisect_right(gens, t) - 1
+                if g >= 0:
+                    gen_counts[g] += 1
+            w.append_columns(array('d', (t / 1e6 for t in res.time_us)),
+                    {'stream': array('d', (base + s for s in res.stream_idx)), 'op': array('d', res.ops)})
+            if (i + 1) % max(1, len(fs) // 10) == 0:
+                logger.info(f'Read {i + 1}/{len(fs)} ranges, {sum(s.count for _, s in streams)} changes so far')
+
+    rates = Histogram()
+    for _, s in streams:
+        r = _rate(s.count, s.first_us, s.last_us)
+        if r is not None:
+            # Changes per minute, so that slow streams aren't rounded to 0
+            rates.record(round(r * 60))
+    first = min((s.first_us for _, s in streams), default = 0)
+    last = max((s.last_us for _, s in streams), default = 0)
+    summary = {
+        'config': dict(asdict(cfg), out = str(cfg.out)),
+        'changes': sum(s.count for _, s in streams),
+        'images': images,
+        'first_us': first,
+        'last_us': last,
+        'rate': _rate(sum(s.count for _, s in streams), first, last),
+        'streams': [dict(stream_id = sid.hex(), count = s.count, first_us = s.first_us, last_us = s.last_us,
+                         rate = _rate(s.count, s.first_us, s.last_us)) for sid, s in streams],
+        'generations': [dict(time = str(epoch + datetime.timedelta(microseconds = g)), changes = c,
+                             rate = _rate(c, max(g, first), min(gens[i + 1] if i + 1 < len(gens) else last, last)))
+                        for i, (g, c) in enumerate(zip(gens, gen_counts))],
+        'gaps_us': gaps.to_dict(),
+        'stream_changes_per_minute': rates.to_dict(),
+    }
+    with open(cfg.out / 'cdc_export.json', 'w') as f:
+        json.dump(summary, f, indent = 1)
+    return summary
+
+def format_summary(summary: dict) -> str:
+    gaps = Histogram.from_dict(summary['gaps_us'])
+    rates = Histogram.from_dict(summary['stream_changes_per_minute'])
+    fmt = lambda v: '-' if v is None else f'{v:.1f}'
+    lines = [f'{summary["changes"]} changes in {len(summary["streams"])} streams, {fmt(summary["rate"])}/s overall'
+             f' ({summary["images"]} pre-/post-image rows not counted)']
+    lines.extend(f'generation {g["time"]}: {g["changes"]} changes, {fmt(g["rate"])}/s' for g in summary['generations'])
+    lines.append('gaps between changes of a stream (ms): p50 {:.1f} p90 {:.1f} p99 {:.1f} max {:.1f}'.format(
+        *(gaps.percentile(p) / 1000 for p in (50, 90, 99)), (gaps.max or 0) / 1000))
+    lines.append('changes per minute of a stream: p10 {} p50 {} p90 {} max {}'.format(
+        rates.percentile(10), rates.percentile(50), rates.percentile(90), rates.max or 0))
+    return '\n'.join(lines)
@@ -0,0 +1,117 @@
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Sequence, Tuple
+from array import array
+import struct
+import json
+import math
+import zlib
+
+# A compact append-only columnar file of float time series.
+# The file is a sequence of chunks; each chunk holds a block of rows:
+#   u32 header length, header (JSON: {"columns": [...], "rows": n}),
+#   then for every column: u32 length, zlib-compressed float64 values (native byte order).
+# Timestamps are stored in the `TS` column, delta-encoded so that they compress well.
+# Columns may appear in later chunks only; rows of chunks without a column read as NaN.
+# A partially written last chunk (e.g. after a crash) is ignored by the reader.
+
+TS = 'ts'
+
+_U32 = struct.Struct('<I')
+
+def _encode(name: str, values: Sequence[float]) -> bytes:
+    a = array('d', values)
+    if name == TS and len(a) > 1:
+        a = array('d', [a[0]] + [a[i] - a[i - 1] for i in range(1, len(a))])
+    return zlib.compress(a.tobytes(), 6)
+
+def _decode(name: str, data: bytes) -> List[float]:
+    a = array('d')
+    a.frombytes(zlib.decompress(data))
+    vals = a.tolist()
+    if name == TS:
+        for i in range(1, len(vals)):
+            vals[i] += vals[i - 1]
+    return vals
+
+class ColumnarWriter:
+    # Rows are buffered in memory and written as a chunk every `chunk_rows` rows, and on `flush`/`close`
+    def __init__(self, path: Path, chunk_rows: int = 120):
+        self.__f: BinaryIO = open(path, 'ab')
+        self.__chunk_rows = chunk_rows
+        self.__rows: List[Tuple[float, Dict[str, float]]] = []
+
+    def append(self, ts: float, values: Dict[str, float]) -> None:
+        assert TS not in values
+        self.__rows.append((ts, values))
+        if len(self.__rows) >= self.__chunk_rows:
+            self.flush()
+
+    # Writes a chunk of rows given as columns (all of the same length as `ts`), after the buffered rows
+    def append_columns(self, ts: Sequence[float], columns: Dict[str, Sequence[float]]) -> None:
+        assert TS not in columns and all(len(vs) == len(ts) for vs in columns.values())
+        self.flush()
+        if len(ts):
+            self.__write_chunk(dict(columns, **{TS: ts}), len(ts))
+
+    def flush(self) -> None:
+        if not self.__rows:
+            return
+        cols = sorted({c for _, vs in self.__rows for c in vs})
+        data: Dict[str, Sequence[float]] = {TS: [ts for ts, _ in self.__rows]}
+        for c in cols:
+            data[c] = [vs.get(c, math.nan) for _, vs in self.__rows]
+        self.__write_chunk(data, len(self.__rows))
+        self.__rows = []
+
+    def __write_chunk(self, data: Dict[str, Sequence[float]], rows: int) -> None:
+        cols = [TS] + sorted(c for c in data if c != TS)
+        header = json.dumps({'columns': cols, 'rows': rows}).encode()
+        buf = [_U32.pack(len(header)), header]
+        for c in cols:
+            enc = _encode(c, data[c])
+            buf += [_U32.pack(len(enc)), enc]
+        self.__f.write(b''.join(buf))
+        self.__f.flush()
+
+    def close(self) -> None:
+        self.flush()
+        self.__f.close()
+
+    def __enter__(self) -> 'ColumnarWriter':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+def _read_exact(f: BinaryIO, n: int) -> bytes:
+    b = f.read(n)
+    if len(b) != n:
+        raise EOFError
+    return b
+
+def read_chunks(path: Path) -> Iterator[Dict[str, List[float]]]:
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                header = json.loads(_read_exact(f, _U32.unpack(_read_exact(f, 4))[0]))
+                chunk = {}
+                for c in header['columns']:
+                    chunk[c] = _decode(c, _read_exact(f, _U32.unpack(_read_exact(f, 4))[0]))
+            except EOFError:
+                return
+            yield chunk
+
+# Reads the whole file: column name -> values, all columns of the same length
+def read_columns(path: Path) -> Dict[str, List[float]]:
+    res: Dict[str, List[float]] = {TS: []}
+    for chunk in read_chunks(path):
+        n = len(chunk[TS])
+        before = len(res[TS])
+        for c, vals in chunk.items():
+            if c not in res:
+                res[c] = [math.nan] * before
+            res[c].extend(vals)
+        for c, vals in res.items():
+            if len(vals) < before + n:
+                vals.extend([math.nan] * (before + n - len(vals)))
+    return res
@@ -1,42 +1,62 @@
-from typing import Generator, Tuple, Optional
+from typing import Callable, Optional
 from pathlib import Path
-from contextlib import closing
+import asyncio
 import stat
-import datetime
-import subprocess
-import re
+import time
 import errno
 import os
 
-# Returns an iterator to the file's lines.
-# If not able to retrieve a next line for 1 second, yields ''.
-# Remember to close it after usage, since it keeps the file opened.
-# For example, use "with contextlib.closing(tail(...)) as t: ..."
-def tail(path: str) -> Generator[str, None, None]:
-    with subprocess.Popen(['tail', '-F', path, '-n', '+1'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT) as f:
-        out = f.stdout
-        if out is None:
-            return
+# Calls `pred` with exponential backoff (starting at `initial_delay`, up to `max_delay` seconds between calls)
+# until it returns True. Raises `TimeoutError` mentioning `what` if `timeout` seconds pass first.
+def wait_until(pred: Callable[[], bool], timeout: Optional[float], what: str,
+        initial_delay: float = 0.05, max_delay: float = 1.0) -> None:
+    deadline = None if timeout is None else time.monotonic() + timeout
+    delay = initial_delay
+    while not pred():
+        if deadline is None:
+            time.sleep(delay)
+        else:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f'Timed out after {timeout}s waiting for {what}')
+            time.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
 
-        #p = select.poll()
-        #p.register(out)
-        #while True:
-        #    if p.poll(1000):
-        #        yield out.readline().decode('utf-8')
-        #    else:
-        #        yield ''
-        while True:
-            yield out.readline().decode('utf-8')
+# `wait_until` for coroutines: the event loop isn't blocked between calls of `pred` (which must be quick)
+async def wait_until_async(pred: Callable[[], bool], timeout: Optional[float], what: str,
+        initial_delay: float = 0.05, max_delay: float = 1.0) -> None:
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+    delay = initial_delay
+    while not pred():
+        if deadline is None:
+            await asyncio.sleep(delay)
+        else:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise TimeoutError(f'Timed out after {timeout}s waiting for {what}')
+            await asyncio.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
 
-def wait_for_init(scylla_log_lines: Generator[str, None, None]) -> None:
-    for l in scylla_log_lines:
-        ms = re.match(r".*Scylla.*initialization completed.*", l)
-        if ms:
-            return
+# Scylla reports a startup failure at the end of its output, so only this many last bytes of the log are scanned
+STARTUP_FAILURE_WINDOW = 2**20
 
-def wait_for_init_path(scylla_log: Path) -> None:
-    with closing(tail(str(scylla_log.resolve()))) as t:
-        wait_for_init(t)
+# Returns the last line in which Scylla reported that it failed to start, if any.
+def find_startup_failure(scylla_log: Path, window: int = STARTUP_FAILURE_WINDOW) -> Optional[str]:
+    failure = None
+    try:
+        with open(scylla_log, 'rb') as f:
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(0, size - window))
+            if size > window:
+                # Skip the partial line
+                f.readline()
+            for l in f:
+                if b'Startup failed' in l:
+                    failure = l.decode(errors='replace').strip()
+    except FileNotFoundError:
+        pass
+    return failure
 
 def is_running(pid: int) -> bool:
     try:
@@ -0,0 +1,56 @@
+from typing import List, Optional, Sequence
+import datetime
+import subprocess
+
+from cassandra import DriverException # type: ignore
+from cassandra.cluster import Cluster, Session, NoHostAvailable # type: ignore
+from cassandra.metadata import protect_name # type: ignore
+
+from lib.common import wait_until
+from lib.cdc import generation_timestamps
+
+# Waits for conditions which let the test move on to its next phase.
+# All functions raise `TimeoutError` if the condition isn't met in `timeout` seconds.
+
+# Waits until the newest CDC generation starts operating (its timestamp passes) and returns its timestamp.
+def wait_for_cdc_generation(session: Session, timeout: Optional[float]) -> datetime.datetime:
+    latest: List[datetime.datetime] = []
+    def started() -> bool:
+        try:
+            gens = generation_timestamps(session)
+        except (DriverException, NoHostAvailable):
+            return False
+        if not gens:
+            return False
+        latest[:] = gens[-1:]
+        return gens[-1] <= datetime.datetime.utcnow()
+    wait_until(started, timeout, 'the latest CDC generation to start')
+    return latest[0]
+
+# Waits until the keyspace and all the tables appear in the schema metadata of `cluster` and the nodes agree on the schema.
+# `cluster` must be connected.
+def wait_for_schema(cluster: Cluster, keyspace: str, tables: Sequence[str], timeout: Optional[float]) -> None:
+    def ready() -> bool:
+        try:
+            if not cluster.control_connection.wait_for_schema_agreement(wait_time = 5):
+                return False
+            cluster.refresh_schema_metadata(max_schema_agreement_wait = 0)
+        except (DriverException, NoHostAvailable):
+            return False
+        ks = cluster.metadata.keyspaces.get(keyspace)
+        return ks is not None and all(t in ks.tables for t in tables)
+    wait_until(ready, timeout, f'schema of {keyspace} ({", ".join(tables)}) to be created and agreed upon')
+
+# Waits until the replicator starts applying changes, i.e. any of the tables on the replica cluster contains a row.
+# Raises `RuntimeError` if the replicator process exits first.
+def wait_for_replicated_data(replica: Session, keyspace: str, tables: Sequence[str],
+        replicator: subprocess.Popen, timeout: Optional[float]) -> None:
+    queries = [f'SELECT * FROM {protect_name(keyspace)}.{protect_name(t)} LIMIT 1' for t in tables]
+    def consuming() -> bool:
+        if replicator.poll() is not None:
+            raise RuntimeError(f'Replicator exited with code {replicator.returncode}')
+        try:
+            return any(replica.execute(q).one() is not None for q in queries)
+        except (DriverException, NoHostAvailable):
+            return False
+    wait_until(consuming, timeout, 'the replicator to start applying changes')
@@ -0,0 +1,184 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from concurrent.futures import ProcessPoolExecutor, Future
+from dataclasses import dataclass, field
+import multiprocessing
+import hashlib
+import logging
+import os
+
+from cassandra import ConsistencyLevel # type: ignore
+from cassandra.cluster import Cluster, Session # type: ignore
+from cassandra.metadata import protect_name # type: ignore
+
+from lib.cdc import partition_key_columns
+from lib.tokens import TokenRange, ring_ranges, split_range
+
+# Compares table contents of the master and replica clusters.
+# The token ring is split into ranges; each range is hashed on both clusters concurrently by a pool of
+# worker processes (each with its own driver connections) using paged reads. Ranges whose hashes differ
+# are split further until they are small enough, and then the rows of both clusters are compared
+# to find the exact divergent partitions.
+
+MASTER = 'master'
+REPLICA = 'replica'
+
+@dataclass(frozen=True)
+class Divergence:
+    table: str
+    # repr of the partition key values
+    partition_key: str
+    # 'missing on replica', 'extra on replica' or 'different'
+    kind: str
+
+@dataclass
+class TableResult:
+    table: str
+    rows: int = 0
+    ranges_hashed: int = 0
+    ranges_compared: int = 0
+    divergences: List[Divergence] = field(default_factory=list)
+
+@dataclass(frozen=True)
+class CheckConfig:
+    master_address: str
+    replica_address: str
+    keyspace: str
+    tables: List[str]
+    # Don't compare cell write timestamps (the replicator doesn't preserve them in postimage mode)
+    no_writetime: bool = False
+    workers: int = max(1, os.cpu_count() or 1)
+    # Number of ranges the ring is initially split into
+    splits: int = 1024
+    # Each range whose hashes differ is split into this many subranges
+    fanout: int = 16
+    # Ranges with at most this many rows (on both clusters) are compared row by row instead of being split
+    leaf_rows: int = 5000
+    page_size: int = 1000
+
+# Per-process state of pool workers
+_sessions: Dict[str, Session] = {}
+_prepared: Dict[Tuple[str, str], Any] = {}
+
+def _init_worker(master_address: str, replica_address: str, page_size: int) -> None:
+    for side, addr in ((MASTER, master_address), (REPLICA, replica_address)):
+        s = Cluster([addr], protocol_version = 4).connect()
+        s.default_timeout = 60
+        s.default_fetch_size = page_size
+        _sessions[side] = s
+
+def _scan(side: str, query: str, r: TokenRange):
+    key = (side, query)
+    if key not in _prepared:
+        p = _sessions[side].prepare(query)
+        p.consistency_level = ConsistencyLevel.QUORUM
+        _prepared[key] = p
+    return _sessions[side].execute(_prepared[key], r)
+
+# Returns the hash and the number of rows of the given range
+def _hash_range(side: str, query: str, r: TokenRange) -> Tuple[str, int]:
+    h = hashlib.blake2b(digest_size = 16)
+    n = 0
+    for row in _scan(side, query, r):
+        h.update(repr(tuple(row)).encode())
+        n += 1
+    return (h.hexdigest(), n)
+
+# Rows of the range grouped by partition: repr of the partition key -> reprs of the rows
+def _partitions(side: str, query: str, r: TokenRange, pk_len: int) -> Dict[str, List[str]]:
+    ps: Dict[str, List[str]] = {}
+    for row in _scan(side, query, r):
+        t = tuple(row)
+        # the first column is the token
+        ps.setdefault(repr(t[1:1 + pk_len]), []).append(repr(t))
+    return ps
+
+# Returns (partition key, kind) of every partition in the range which differs between the clusters
+def _diff_range(query: str, r: TokenRange, pk_len: int) -> List[Tuple[str, str]]:
+    m = _partitions(MASTER, query, r, pk_len)
+    rp = _partitions(REPLICA, query, r, pk_len)
+    res = []
+    for k, rows in m.items():
+        if k not in rp:
+            res.append((k, 'missing on replica'))
+        elif rp[k] != rows:
+            res.append((k, 'different'))
+    res.extend((k, 'extra on replica') for k in rp if k not in m)
+    return res
+
+def _supports_writetime(cql_type: str, udt_names: Sequence[str]) -> bool:
+    if cql_type.startswith('frozen<'):
+        return True
+    if cql_type.startswith(('list<', 'set<', 'map<')) or cql_type == 'counter':
+        return False
+    # non-frozen UDT
+    return cql_type not in udt_names
+
+# Query selecting the token, all columns and (unless `no_writetime`) the write timestamps of the columns
+# which have them, for the range (?, ?]
+def scan_query(keyspace: str, ks_meta: Any, table: str, no_writetime: bool) -> str:
+    meta = ks_meta.tables[table]
+    key = {c.name for c in meta.partition_key} | {c.name for c in meta.clustering_key}
+    cols = list(meta.columns.keys())
+    wt = [] if no_writetime else [c for c in cols
+            if c not in key and _supports_writetime(meta.columns[c].cql_type, list(ks_meta.user_types.keys()))]
+    token = 'token({})'.format(', '.join(protect_name(c) for c in partition_key_columns(meta)))
+    return 'SELECT {} FROM {}.{} WHERE {} > ? AND {} <= ?'.format(
+            ', '.join([token] + [protect_name(c) for c in cols] + [f'writetime({protect_name(c)})' for c in wt]),
+            protect_name(keyspace), protect_name(table), token, token)
+
+def check_consistency(logger: logging.Logger, cfg: CheckConfig) -> List[TableResult]:
+    with Cluster([cfg.master_address], protocol_version = 4) as c:
+        c.connect()
+        ks_meta = c.metadata.keyspaces[cfg.keyspace]
+        queries = {t: scan_query(cfg.keyspace, ks_meta, t, cfg.no_writetime) for t in cfg.tables}
+        pk_lens = {t: len(ks_meta.tables[t].partition_key) for t in cfg.tables}
+
+    results = {t: TableResult(table = t) for t in cfg.tables}
+    # Spawn rather than fork: the parent may have driver threads running
+    with ProcessPoolExecutor(max_workers = cfg.workers, mp_context = multiprocessing.get_context('spawn'),
+            initializer = _init_worker, initargs = (cfg.master_address, cfg.replica_address, cfg.page_size)) as ex:
+        level = [(t, r) for t in cfg.tables for r in ring_ranges(cfg.splits)]
+        depth = 0
+        while level:
+            logger.info(f'Consistency check: hashing {len(level)} ranges (depth {depth})...')
+            hashes: List[Tuple[str, TokenRange, Future, Future]] = [
+                    (t, r, ex.submit(_hash_range, MASTER, queries[t], r), ex.submit(_hash_range, REPLICA, queries[t], r))
+                    for t, r in level]
+
+            level = []
+            diffs: List[Tuple[str, TokenRange, Future]] = []
+            for t, r, mf, rf in hashes:
+                (mh, mn), (rh, rn) = mf.result(), rf.result()
+                res = results[t]
+                res.ranges_hashed += 1
+                if depth == 0:
+                    res.rows += mn
+                if mh == rh:
+                    continue
+                if max(mn, rn) <= cfg.leaf_rows or r[1] - r[0] <= cfg.fanout:
+                    diffs.append((t, r, ex.submit(_diff_range, queries[t], r, pk_lens[t])))
+                else:
+                    level.extend((t, sr) for sr in split_range(r, cfg.fanout))
+
+            for t, r, df in diffs:
+                res = results[t]
+                res.ranges_compared += 1
+                res.divergences.extend(Divergence(table = t, partition_key = k, kind = kind) for k, kind in df.result())
+            depth += 1
+
+    return [results[t] for t in cfg.tables]
+
+def format_report(keyspace: str, results: Sequence[TableResult], max_partitions: Optional[int] = None) -> str:
+    lines = []
+    for res in results:
+        lines.append('{}.{}: {} rows on master, {} ranges hashed, {} compared row by row, {} divergent partitions'.format(
+            keyspace, res.table, res.rows, res.ranges_hashed, res.ranges_compared, len(res.divergences)))
+        ds = res.divergences if max_partitions is None else res.divergences[:max_partitions]
+        lines.extend(f'  {d.kind}: {d.partition_key}' for d in ds)
+        if len(ds) < len(res.divergences):
+            lines.append(f'  ... and {len(res.divergences) - len(ds)} more')
+    if all(not res.divergences for res in results):
+        lines.append('Consistency check OK.')
+    else:
+        lines.append('Consistency check FAILED.')
+    return '\n'.join(lines)
@@ -0,0 +1,120 @@
+from typing import List, Sequence
+from dataclasses import dataclass
+import datetime
+import logging
+import time
+
+from cassandra.cluster import Session # type: ignore
+from cassandra.concurrent import execute_concurrent_with_args # type: ignore
+
+from lib.cdc import Change, ChangeReader, same_rows
+
+@dataclass(frozen=True)
+class StreamLag:
+    table: str
+    stream_id: bytes
+    # `cdc$time` of the newest change in the stream which is not yet visible on the replica,
+    # in microseconds since the epoch
+    newest_change_us: int
+
+@dataclass(frozen=True)
+class LagReport:
+    # When the report was taken, in seconds since the epoch
+    taken_at: float
+    streams: int
+    # Streams which could not be checked (e.g. because a query failed)
+    unchecked: int
+    lagging: List[StreamLag]
+
+    @property
+    def converged(self) -> bool:
+        return not self.lagging and self.unchecked == 0
+
+    # Age of the oldest change not yet visible on the replica, in seconds
+    def max_lag(self) -> float:
+        if not self.lagging:
+            return 0
+        return max(0, self.taken_at - min(l.newest_change_us for l in self.lagging) / 1e6)
+
+    def summary(self) -> str:
+        return '{}/{} streams lagging (max lag {:.1f}s), {} unchecked'.format(
+                len(self.lagging), self.streams, self.max_lag(), self.unchecked)
+
+    def __str__(self) -> str:
+        ls = sorted(self.lagging, key = lambda l: l.newest_change_us)
+        lines = [self.summary()] + ['  {} 0x{} newest change at {}'.format(
+                l.table, l.stream_id.hex(), datetime.datetime.utcfromtimestamp(l.newest_change_us / 1e6))
+            for l in ls[:20]]
+        if len(ls) > 20:
+            lines.append(f'  ... and {len(ls) - 20} more')
+        return '\n'.join(lines)
+
+class ConvergenceTimeout(Exception):
+    def __init__(self, report: LagReport):
+        super().__init__(f'Replication did not converge: {report.summary()}')
+        self.report = report
+
+# Checks whether the replica has caught up with the changes made to the master cluster.
+# For every CDC stream of the given tables, takes the newest change from the master's CDC log
+# and checks whether the row (or, for partition and range deletes, the partition) it modified
+# has the same contents on both clusters. The replicator applies changes of a stream in order,
+# so if the newest change is visible on the replica, so are all the previous ones.
+# Meant to be used after the workload stops; rows which are still being modified may appear to lag.
+class ConvergenceMonitor:
+    # `master`'s cluster metadata must contain the schema of `tables`
+    def __init__(self, logger: logging.Logger, master: Session, replica: Session,
+            keyspace: str, tables: Sequence[str], concurrency: int = 64):
+        self.__logger = logger
+        self.__master = master
+        self.__replica = replica
+        self.__concurrency = concurrency
+        self.__tables = [ChangeReader(master, replica, keyspace, t) for t in tables]
+
+    def lag_report(self) -> LagReport:
+        taken_at = time.time()
+        streams = 0
+        unchecked = 0
+        lagging: List[StreamLag] = []
+        for t in self.__tables:
+            sids = [r[0] for r in self.__master.execute(t.streams)]
+            streams += len(sids)
+
+            changes: List[Change] = []
+            res = execute_concurrent_with_args(self.__master, t.newest, [(s,) for s in sids],
+                    concurrency = self.__concurrency, raise_on_first_error = False)
+            for sid, (ok, rs) in zip(sids, res):
+                c = t.newest_change(sid, rs) if ok else None
+                if c is None:
+                    unchecked += 1
+                else:
+                    changes.append(c)
+
+            for row_op in (True, False):
+                cs = [c for c in changes if c.row_op == row_op]
+                args = [c.key for c in cs]
+                ms = execute_concurrent_with_args(self.__master, t.master_row if row_op else t.master_partition, args,
+                        concurrency = self.__concurrency, raise_on_first_error = False)
+                rs = execute_concurrent_with_args(self.__replica, t.replica_row if row_op else t.replica_partition, args,
+                        concurrency = self.__concurrency, raise_on_first_error = False)
+                for c, (mok, mres), (rok, rres) in zip(cs, ms, rs):
+                    if not mok or not rok:
+                        unchecked += 1
+                    elif not same_rows(mres, rres):
+                        lagging.append(StreamLag(table = t.table, stream_id = c.stream_id, newest_change_us = c.time_us))
+
+        return LagReport(taken_at = taken_at, streams = streams, unchecked = unchecked, lagging = lagging)
+
+    # Waits until the replica catches up with the master, checking every `interval` seconds.
+    # Returns the final report; raises `ConvergenceTimeout` with the latest report if `timeout` seconds pass first.
+    def wait(self, timeout: float, interval: float = 5) -> LagReport:
+        deadline = time.monotonic() + timeout
+        while True:
+            r = self.lag_report()
+            if r.converged:
+                self.__logger.info(f'Replica converged: {r.summary()}')
+                return r
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ConvergenceTimeout(r)
+            self.__logger.info(f'Waiting for replica to converge: {r.summary()}')
+            time.sleep(min(interval, remaining))
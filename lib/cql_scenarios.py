@@ -0,0 +1,112 @@
+from pathlib import Path
+from typing import List, TextIO
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import threading
+import time
+
+from cassandra.cluster import Session # type: ignore
+
+# Runs the scenarios of the `cql/` directory: every file is a sequence of statements executed in order,
+# and the files run concurrently over one session. With `repeat` > 1 the statements of each file are run
+# that many times, schema statements (CREATE, ALTER, DROP) only the first time.
+
+# The keyspace the scenarios' statements use (it's part of their table names)
+KEYSPACE = 'ks1'
+
+SCHEMA_KEYWORDS = ('CREATE', 'ALTER', 'DROP')
+
+@dataclass(frozen=True)
+class Scenario:
+    name: str
+    statements: List[str]
+
+@dataclass
+class ScenarioResult:
+    name: str
+    executed: int = 0
+    errors: List[str] = field(default_factory=list)
+    started_at: float = 0
+    duration: float = 0
+
+# Splits a CQL script into statements, dropping comments (`--`, `//` and `/* */`).
+# Semicolons and comment markers inside string literals ('...', "...", $$...$$) don't count.
+def split_statements(text: str) -> List[str]:
+    res: List[str] = []
+    cur: List[str] = []
+    i, n = 0, len(text)
+    while i < n:
+        c = text[i]
+        if text.startswith(('--', '//'), i):
+            end = text.find('\n', i)
+            i = n if end < 0 else end
+        elif text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            i = n if end < 0 else end + 2
+        elif c in '\'"' or text.startswith('$$', i):
+            quote = '$$' if c == '$' else c
+            end = i + len(quote)
+            while True:
+                end = text.find(quote, end)
+                if end < 0:
+                    end = n
+                    break
+                # A quote is escaped by doubling it
+                if quote != '$$' and text.startswith(quote * 2, end):
+                    end += 2
+                    continue
+                end += len(quote)
+                break
+            cur.append(text[i:end])
+            i = end
+        elif c == ';':
+            res.append(''.join(cur).strip())
+            cur = []
+            i += 1
+        else:
+            cur.append(c)
+            i += 1
+    res.append(''.join(cur).strip())
+    return [s for s in res if s]
+
+def load_scenarios(cql_dir: Path) -> List[Scenario]:
+    return [Scenario(name = p.stem, statements = split_statements(p.read_text()))
+            for p in sorted(cql_dir.glob('*.cql'))]
+
+def is_schema_statement(stmt: str) -> bool:
+    return stmt.lstrip().upper().startswith(SCHEMA_KEYWORDS)
+
+def format_result(r: ScenarioResult) -> str:
+    return '[scenario] {} statements={} errors={} duration={:.3f}'.format(r.name, r.executed, len(r.errors), r.duration)
+
+# Runs the scenarios and returns their results (in the order of `scenarios`); every finished scenario
+# and errors (up to `max_errors_printed` per scenario) are printed to `out`
+def run_scenarios(session: Session, scenarios: List[Scenario], out: TextIO, repeat: int = 1,
+        max_errors_printed: int = 3) -> List[ScenarioResult]:
+    lock = threading.Lock()
+    def log(line: str) -> None:
+        with lock:
+            print(line, file = out, flush = True)
+
+    def run(s: Scenario) -> ScenarioResult:
+        r = ScenarioResult(name = s.name, started_at = time.time())
+        start = time.monotonic()
+        for i in range(repeat):
+            for stmt in s.statements:
+                if i > 0 and is_schema_statement(stmt):
+                    continue
+                try:
+                    session.execute(stmt)
+                except Exception as e:
+                    r.errors.append(f'{type(e).__name__}: {e}')
+                    if len(r.errors) <= max_errors_printed:
+                        log(f'Error in {s.name}: {stmt}: {e}')
+                r.executed += 1
+        r.duration = time.monotonic() - start
+        log(format_result(r))
+        return r
+
+    if not scenarios:
+        return []
+    with ThreadPoolExecutor(max_workers = len(scenarios)) as ex:
+        return list(ex.map(run, scenarios))
@@ -0,0 +1,166 @@
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+from threading import Thread, Event
+import logging
+import json
+import time
+
+from lib.convergence import ConvergenceMonitor, LagReport
+from lib.metrics import MetricsScraper, column
+from lib.nemesis import NemesisEngine
+from lib.node import Node
+from lib.readiness import accepts_connections, node_endpoints
+
+# Live state of a run, written as a JSON line per second to `run_path/dashboard.jsonl` and shown by
+# `python3 -m scripts.dashboard run_path` (in the first tmux window of scripts/run.py):
+# - the master's write rate (CDC operations) and the replica's write rate, from the latest scrape
+#   of the `MetricsScraper`,
+# - the replication lag: the age of the oldest change not yet visible on the replica and the number of lagging
+#   streams, from a `ConvergenceMonitor` report taken every `lag_interval` seconds (in a separate thread, as
+#   a report takes a while) once `watch_lag` is called. While the workload runs, rows modified again before
+#   the check appear to lag, so this overestimates the lag,
+# - the state of every node: 'up' (serving CQL), 'starting', 'paused' or 'down', from its process
+#   (`run_path/<ip>/scylla.pid`, written by TmuxNode's run.sh) and a connection to its CQL port,
+# - the faults being injected by the nemeses.
+
+MASTER_RATE_METRIC = ('master', 'cdc_operations')
+REPLICA_RATE_METRIC = ('replica', 'writes')
+
+def process_state(pid_file: Path) -> Optional[str]:
+    try:
+        pid = int(pid_file.read_text())
+        with open(f'/proc/{pid}/stat') as f:
+            # `pid (comm) state ...`; comm may contain spaces
+            return f.read().rsplit(')', 1)[1].split()[0]
+    except (FileNotFoundError, ValueError, IndexError, ProcessLookupError):
+        return None
+
+def node_state(pid_file: Path, host: str, cql_port: int) -> str:
+    s = process_state(pid_file)
+    if s is None or s in ('Z', 'X'):
+        return 'down'
+    if s in ('T', 't'):
+        return 'paused'
+    return 'up' if accepts_connections(host, cql_port) else 'starting'
+
+class Dashboard:
+    # `clusters`: cluster name (e.g. 'master') -> nodes; their directories are `run_path/<ip>`
+    def __init__(self, logger: logging.Logger, run_path: Path, clusters: Dict[str, Sequence[Node]],
+            metrics: Optional[MetricsScraper], nemeses: Optional[NemesisEngine], interval: float = 1,
+            lag_interval: float = 10):
+        self.__logger = logger
+        self.__path = run_path / 'dashboard.jsonl'
+        self.__nodes = [(c, n.ip(), run_path / n.ip() / 'scylla.pid', node_endpoints(n.get_node_config()))
+                for c, ns in clusters.items() for n in ns]
+        self.__metrics = metrics
+        self.__nemeses = nemeses
+        self.__interval = interval
+        self.__lag_interval = lag_interval
+        self.__stop = Event()
+        self.__thread: Optional[Thread] = None
+        self.__lag_thread: Optional[Thread] = None
+        self.__last_scrape: Optional[Tuple[float, Dict[str, float]]] = None
+        self.__rates: Dict[str, Optional[float]] = {'master': None, 'replica': None}
+        self.__lag: Optional[LagReport] = None
+
+    def start(self) -> None:
+        if self.__thread:
+            return
+        self.__stop.clear()
+        self.__thread = Thread(target = self.__run, daemon = True)
+        self.__thread.start()
+
+    def stop(self) -> None:
+        if not self.__thread:
+            return
+        self.__stop.set()
+        self.__thread.join()
+        self.__thread = None
+        if self.__lag_thread:
+            self.__lag_thread.join()
+            self.__lag_thread = None
+
+    # Starts measuring the replication lag with `monitor` (once the schema exists on both clusters)
+    def watch_lag(self, monitor: ConvergenceMonitor) -> None:
+        if self.__lag_thread or not self.__thread:
+            return
+        self.__lag_thread = Thread(target = self.__watch_lag, args = (monitor,), daemon = True)
+        self.__lag_thread.start()
+
+    def __watch_lag(self, monitor: ConvergenceMonitor) -> None:
+        while True:
+            try:
+                self.__lag = monitor.lag_report()
+            except Exception:
+                self.__logger.exception('Dashboard: failed to measure the replication lag')
+            if self.__stop.wait(self.__lag_interval):
+                return
+
+    # Updates the rates when there was a new scrape. Counters which decreased (the node restarted)
+    # and nodes missing from either scrape don't count.
+    def __update_rates(self) -> None:
+        latest = self.__metrics.latest if self.__metrics else None
+        if latest is None or latest is self.__last_scrape:
+            return
+        prev, self.__last_scrape = self.__last_scrape, latest
+        if prev is None:
+            return
+        dt = latest[0] - prev[0]
+        for cluster, metric in (MASTER_RATE_METRIC, REPLICA_RATE_METRIC):
+            cols = [column(c, ip, metric) for c, ip, _, _ in self.__nodes if c == cluster]
+            deltas = [latest[1][k] - prev[1][k] for k in cols if k in latest[1] and k in prev[1]]
+            inc = sum(d for d in deltas if d >= 0)
+            self.__rates[cluster] = inc / dt if deltas and dt > 0 else None
+
+    def __snapshot(self) -> dict:
+        self.__update_rates()
+        active = dict(self.__nemeses.active) if self.__nemeses else {}
+        lag = self.__lag
+        return {
+            'ts': time.time(),
+            'master_write_rate': self.__rates['master'],
+            'replica_write_rate': self.__rates['replica'],
+            'lag_s': lag.max_lag() if lag else None,
+            'lagging_streams': len(lag.lagging) if lag else None,
+            'streams': lag.streams if lag else None,
+            'lag_measured_at': lag.taken_at if lag else None,
+            'nodes': [{'cluster': c, 'ip': ip, 'state': node_state(pid_file, ep.cql_host, ep.cql_port),
+                       'nemesis': active.get(ip)} for c, ip, pid_file, ep in self.__nodes],
+            'nemesis_events': len(self.__nemeses.events) if self.__nemeses else 0,
+        }
+
+    def __run(self) -> None:
+        with open(self.__path, 'a') as f:
+            next_round = time.monotonic()
+            while not self.__stop.is_set():
+                try:
+                    f.write(json.dumps(self.__snapshot()) + '\n')
+                    f.flush()
+                except Exception:
+                    self.__logger.exception('Dashboard: failed to take a snapshot')
+                next_round += self.__interval
+                self.__stop.wait(max(0, next_round - time.monotonic()))
+
+def format_snapshot(s: dict) -> str:
+    fmt = lambda v, f: '-' if v is None else format(v, f)
+    lines = [
+        time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(s['ts'])),
+        '',
+        f'master writes:   {fmt(s["master_write_rate"], ".0f"):>10} /s',
+        f'replica writes:  {fmt(s["replica_write_rate"], ".0f"):>10} /s',
+        f'replication lag: {fmt(s["lag_s"], ".1f"):>10} s (overestimated while the workload runs)',
+        f'lagging streams: {fmt(s["lagging_streams"], "d"):>10} of {fmt(s["streams"], "d")}',
+        '',
+        '{:<8} {:<16} {:<9} {}'.format('cluster', 'node', 'state', 'nemesis'),
+    ]
+    lines.extend('{:<8} {:<16} {:<9} {}'.format(n['cluster'], n['ip'], n['state'], n['nemesis'] or '') for n in s['nodes'])
+    lines.append('')
+    lines.append(f'faults injected: {s["nemesis_events"]}')
+    return '\n'.join(lines)
+
+def read_snapshots(run_path: Path) -> List[dict]:
+    try:
+        with open(run_path / 'dashboard.jsonl') as f:
+            return [json.loads(l) for l in f if l.strip()]
+    except FileNotFoundError:
+        return []
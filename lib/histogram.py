@@ -0,0 +1,80 @@
+from typing import Dict, Optional
+
+# HDR-style latency histogram with log-linear buckets: values below 2 * SUB_BUCKETS are recorded exactly,
+# larger values are recorded with a relative error below 1 / SUB_BUCKETS (about 1.6%).
+# Values are non-negative integers, e.g. latencies in microseconds.
+# Only non-empty buckets are stored, so a histogram is small enough to be dumped per interval.
+
+SUB_BUCKETS = 64
+
+def bucket_of(v: int) -> int:
+    if v < 2 * SUB_BUCKETS:
+        return v
+    shift = v.bit_length() - SUB_BUCKETS.bit_length()
+    return shift * SUB_BUCKETS + (v >> shift)
+
+# The highest value which falls into the given bucket
+def bucket_max(b: int) -> int:
+    if b < 2 * SUB_BUCKETS:
+        return b
+    shift = b // SUB_BUCKETS - 1
+    return ((b - shift * SUB_BUCKETS + 1) << shift) - 1
+
+class Histogram:
+    def __init__(self) -> None:
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.min: Optional[int] = None
+        self.max: Optional[int] = None
+
+    def record(self, v: int) -> None:
+        assert v >= 0
+        b = bucket_of(v)
+        self.counts[b] = self.counts.get(b, 0) + 1
+        self.count += 1
+        self.total += v
+        if self.min is None or v < self.min:
+            self.min = v
+        if self.max is None or v > self.max:
+            self.max = v
+
+    def merge(self, other: 'Histogram') -> None:
+        for b, c in other.counts.items():
+            self.counts[b] = self.counts.get(b, 0) + c
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0
+
+    # The value below which `p` percent of the recorded values fall (up to the bucket precision)
+    def percentile(self, p: float) -> int:
+        if not self.count:
+            return 0
+        assert self.max is not None
+        rank = max(1, round(self.count * p / 100))
+        seen = 0
+        for b in sorted(self.counts):
+            seen += self.counts[b]
+            if seen >= rank:
+                return min(bucket_max(b), self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {'count': self.count, 'total': self.total, 'min': self.min, 'max': self.max,
+                'buckets': {str(b): c for b, c in sorted(self.counts.items())}}
+
+    @staticmethod
+    def from_dict(d: dict) -> 'Histogram':
+        h = Histogram()
+        h.counts = {int(b): c for b, c in d['buckets'].items()}
+        h.count = d['count']
+        h.total = d['total']
+        h.min = d['min']
+        h.max = d['max']
+        return h
@@ -0,0 +1,240 @@
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+from dataclasses import dataclass, field, asdict, replace
+import logging
+import fcntl
+import json
+import os
+import re
+
+from lib.local_node import LocalNodeEnv
+from lib.addresses import AddressLease, DEFAULT_LOCK_DIR, is_block_live
+
+# Plans the host's CPUs and memory for the nodes of a run: every node gets a disjoint `--cpuset`
+# (whole physical cores and a single NUMA node where possible) and a `--memory` budget.
+# A few CPUs and some memory are kept for the harness, stressors and the replicator.
+# CPUs and memory given to the nodes of other live runs (see lib/addresses.py) are not used, and a node's
+# memory is capped by its share of the host's CPUs; the plan of a run is recorded next to its address lease.
+
+# Below this, Scylla shards run out of memory under load
+MIN_MEMORY_PER_SHARD_MB = 512
+
+class Oversubscribed(Exception):
+    pass
+
+@dataclass(frozen=True)
+class Cpu:
+    id: int
+    # (package, core ID): CPUs with the same core are hyperthreads of one physical core
+    core: Tuple[int, int]
+    numa_node: int
+
+def _read(path: Path) -> Optional[str]:
+    try:
+        return path.read_text().strip()
+    except OSError:
+        return None
+
+# Parses lists such as '0-3,8,10-11'
+def parse_cpu_list(s: str) -> List[int]:
+    res: List[int] = []
+    for part in s.split(','):
+        if not part:
+            continue
+        if '-' in part:
+            a, b = part.split('-')
+            res.extend(range(int(a), int(b) + 1))
+        else:
+            res.append(int(part))
+    return res
+
+def format_cpu_list(cpus: Sequence[int]) -> str:
+    parts: List[str] = []
+    s = sorted(set(cpus))
+    i = 0
+    while i < len(s):
+        j = i
+        while j + 1 < len(s) and s[j + 1] == s[j] + 1:
+            j += 1
+        parts.append(str(s[i]) if i == j else f'{s[i]}-{s[j]}')
+        i = j + 1
+    return ','.join(parts)
+
+# The CPUs this process may run on, with their topology (from sysfs)
+def host_cpus() -> List[Cpu]:
+    sys_cpu = Path('/sys/devices/system/cpu')
+    numa: Dict[int, int] = {}
+    for n in Path('/sys/devices/system/node').glob('node[0-9]*'):
+        l = _read(n / 'cpulist')
+        if l:
+            for c in parse_cpu_list(l):
+                numa[c] = int(n.name[len('node'):])
+    res = []
+    for c in sorted(os.sched_getaffinity(0)):
+        topo = sys_cpu / f'cpu{c}' / 'topology'
+        package = _read(topo / 'physical_package_id')
+        core = _read(topo / 'core_id')
+        res.append(Cpu(id = c,
+            core = (int(package) if package else 0, int(core) if core else c),
+            numa_node = numa.get(c, 0)))
+    return res
+
+def host_memory_mb() -> int:
+    with open('/proc/meminfo') as f:
+        for l in f:
+            m = re.match(r'MemTotal:\s+(\d+) kB', l)
+            if m:
+                return int(m.group(1)) // 1024
+    raise RuntimeError('MemTotal not found in /proc/meminfo')
+
+@dataclass(frozen=True)
+class NodeResources:
+    # The node's IP
+    name: str
+    cpus: List[int]
+    memory_mb: int
+
+    @property
+    def cpuset(self) -> str:
+        return format_cpu_list(self.cpus)
+
+@dataclass(frozen=True)
+class ResourcePlan:
+    nodes: List[NodeResources]
+    # CPUs kept for the harness and tools
+    reserved_cpus: List[int]
+    # CPUs and memory used by other live runs
+    taken_cpus: List[int]
+    taken_memory_mb: int
+    host_memory_mb: int
+    # Some CPUs are shared by nodes or the nodes' memory budgets are below MIN_MEMORY_PER_SHARD_MB
+    oversubscribed: bool = False
+    warnings: List[str] = field(default_factory=list)
+
+    def summary(self) -> str:
+        lines = [f'{n.name}: cpuset {n.cpuset}, memory {n.memory_mb}M' for n in self.nodes]
+        lines.append('reserved CPUs: {}; taken by other runs: {} CPUs, {}M'.format(
+            format_cpu_list(self.reserved_cpus) or 'none', len(self.taken_cpus), self.taken_memory_mb))
+        lines.extend(f'WARNING: {w}' for w in self.warnings)
+        return '\n'.join(lines)
+
+# Assigns CPUs to nodes; `demands` are (name, number of shards).
+# Each node gets CPUs of one NUMA node if possible, hyperthreads of the same core together.
+# If there are not enough CPUs, raises `Oversubscribed` unless `allow_oversubscription`, in which case
+# the CPUs are shared round-robin.
+def plan_resources(demands: Sequence[Tuple[str, int]], cpus: Sequence[Cpu], memory_mb: int,
+        reserve_cpus: int = 1, reserve_memory_mb: int = 2048,
+        taken_cpus: Set[int] = set(), taken_memory_mb: int = 0,
+        allow_oversubscription: bool = False) -> ResourcePlan:
+    ordered = sorted(cpus, key = lambda c: (c.numa_node, c.core, c.id))
+    reserved = [c.id for c in ordered[:reserve_cpus]]
+    free = [c for c in ordered[reserve_cpus:] if c.id not in taken_cpus]
+    warnings: List[str] = []
+    oversubscribed = False
+
+    need = sum(n for _, n in demands)
+    assigned: Dict[str, List[int]] = {}
+    if need > len(free):
+        msg = f'{need} shards need {need} CPUs, but only {len(free)} are free' \
+              f' ({len(ordered)} usable, {len(reserved)} reserved, {len(taken_cpus)} used by other runs)'
+        if not allow_oversubscription:
+            raise Oversubscribed(msg)
+        warnings.append(msg + '; nodes will share CPUs')
+        oversubscribed = True
+        pool = [c.id for c in free] or [c.id for c in ordered]
+        i = 0
+        for name, n in demands:
+            assigned[name] = sorted({pool[(i + k) % len(pool)] for k in range(n)})
+            i += n
+    else:
+        by_numa: Dict[int, List[Cpu]] = {}
+        for c in free:
+            by_numa.setdefault(c.numa_node, []).append(c)
+        # The largest nodes first, so that they're more likely to fit into a single NUMA node
+        for name, n in sorted(demands, key = lambda d: -d[1]):
+            fitting = [k for k, cs in by_numa.items() if len(cs) >= n]
+            if fitting:
+                # the NUMA node with the least free CPUs which fits, to keep large holes for later nodes
+                k = min(fitting, key = lambda k: len(by_numa[k]))
+                assigned[name] = [c.id for c in by_numa[k][:n]]
+                by_numa[k] = by_numa[k][n:]
+            else:
+                warnings.append(f'{name} spans NUMA nodes')
+                ids: List[int] = []
+                for k in sorted(by_numa, key = lambda k: -len(by_numa[k])):
+                    take = by_numa[k][:n - len(ids)]
+                    ids.extend(c.id for c in take)
+                    by_numa[k] = by_numa[k][len(take):]
+                assigned[name] = ids
+
+    budget = memory_mb - reserve_memory_mb - taken_memory_mb
+    per_shard = budget // need if need else 0
+    # A shard gets at most its CPU's share of the host's memory, so that runs started later still get theirs
+    usable = len(ordered) - len(reserved)
+    if usable > 0:
+        per_shard = min(per_shard, (memory_mb - reserve_memory_mb) // usable)
+    if per_shard < MIN_MEMORY_PER_SHARD_MB:
+        msg = f'{max(budget, 0)}M of memory for {need} shards is less than {MIN_MEMORY_PER_SHARD_MB}M per shard'
+        if not allow_oversubscription:
+            raise Oversubscribed(msg)
+        warnings.append(msg)
+        oversubscribed = True
+        per_shard = MIN_MEMORY_PER_SHARD_MB
+
+    return ResourcePlan(
+        nodes = [NodeResources(name = name, cpus = sorted(assigned[name]), memory_mb = n * per_shard)
+                 for name, n in demands],
+        reserved_cpus = reserved, taken_cpus = sorted(taken_cpus), taken_memory_mb = taken_memory_mb,
+        host_memory_mb = memory_mb, oversubscribed = oversubscribed, warnings = warnings)
+
+# Sets the cpuset and memory of the nodes' run options according to the plan
+def apply_plan(envs: Sequence[LocalNodeEnv], plan: ResourcePlan) -> List[LocalNodeEnv]:
+    res = {r.name: r for r in plan.nodes}
+    return [replace(e, opts = replace(e.opts,
+                cpuset = res[e.cfg.ip_addr].cpuset, memory = f'{res[e.cfg.ip_addr].memory_mb}M'))
+            for e in envs]
+
+def _claim_path(lock_dir: Path, block: int) -> Path:
+    return lock_dir / f'block-{block}.resources.json'
+
+# CPUs and memory claimed by the live runs other than the one holding `lease`
+def _other_claims(lease: AddressLease, lock_dir: Path) -> Tuple[Set[int], int]:
+    cpus: Set[int] = set()
+    memory = 0
+    for p in lock_dir.glob('block-*.resources.json'):
+        block = int(p.name[len('block-'):].split('.')[0])
+        if block == lease.index or not is_block_live(block, lock_dir):
+            continue
+        try:
+            claim = json.loads(p.read_text())
+        except (OSError, ValueError):
+            continue
+        for n in claim['nodes']:
+            cpus.update(n['cpus'])
+            memory += n['memory_mb']
+    return cpus, memory
+
+# Plans the resources of the nodes of `envs`, taking into account the other runs on the host,
+# and records the plan for the run holding `lease`. Logs the plan and saves it to `run_path/resources.json`.
+def plan_run_resources(logger: logging.Logger, run_path: Path, lease: AddressLease, envs: Sequence[LocalNodeEnv],
+        allow_oversubscription: bool, reserve_cpus: int = 1, reserve_memory_mb: int = 2048,
+        lock_dir: Path = DEFAULT_LOCK_DIR) -> List[LocalNodeEnv]:
+    lock_dir.mkdir(parents = True, exist_ok = True)
+    # Serializes planning of concurrent runs so that they don't pick the same CPUs
+    with open(lock_dir / 'resources.lock', 'a+') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        taken_cpus, taken_memory = _other_claims(lease, lock_dir)
+        plan = plan_resources([(e.cfg.ip_addr, e.opts.smp) for e in envs], host_cpus(), host_memory_mb(),
+                reserve_cpus = reserve_cpus, reserve_memory_mb = reserve_memory_mb,
+                taken_cpus = taken_cpus, taken_memory_mb = taken_memory,
+                allow_oversubscription = allow_oversubscription)
+        tmp = _claim_path(lock_dir, lease.index).with_suffix('.tmp')
+        tmp.write_text(json.dumps(asdict(plan)))
+        tmp.replace(_claim_path(lock_dir, lease.index))
+
+    with open(run_path / 'resources.json', 'w') as f:
+        json.dump(asdict(plan), f, indent = 1)
+    for w in plan.warnings:
+        logger.warning(f'Resource plan: {w}')
+    logger.info(f'Resource plan:\n{plan.summary()}')
+    return apply_plan(envs, plan)
@@ -0,0 +1,317 @@
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+from dataclasses import dataclass, asdict, replace
+import statistics
+import json
+import re
+
+from lib.nemesis import read_events
+from lib.histogram import Histogram
+
+# Impact of faults on the workload: the stressor's interval reports are parsed into a time series and aligned
+# with the events of the run (nemesis faults from `nemesis.jsonl`, nodes bootstrapped during the workload
+# from `boot_times.jsonl`). For every event, the throughput and p99 latency during the event are compared
+# with a baseline taken just before it.
+# A rolling upgrade under load (scripts/upgrade.py) is analyzed the same way: every upgraded node is an event,
+# and the throughput, latency percentiles and errors of every upgrade step are taken from the native stressor's
+# histograms (`stressor_hist.json`).
+
+# Seconds before an event used as its baseline
+BASELINE_WINDOW = 30
+# Throughput is considered recovered when it gets back to this fraction of the baseline
+RECOVERED_FRACTION = 0.9
+
+@dataclass(frozen=True)
+class Sample:
+    # End of the interval (seconds since the epoch) and its length
+    ts: float
+    length: float
+    ops_per_s: float
+    p99_ms: float
+    errors: int
+
+@dataclass(frozen=True)
+class Event:
+    kind: str
+    node: str
+    started_at: float
+    # When the node was serving again (or the fault healed, if it never recovered)
+    ended_at: float
+
+@dataclass(frozen=True)
+class EventImpact:
+    kind: str
+    node: str
+    started_at: float
+    duration: float
+    baseline_ops_per_s: float
+    baseline_p99_ms: float
+    min_ops_per_s: float
+    max_p99_ms: float
+    # 1 - min_ops_per_s / baseline_ops_per_s
+    throughput_drop: float
+    # max_p99_ms / baseline_p99_ms
+    p99_spike: float
+    errors: int
+    # Seconds from the start of the event until throughput got back to RECOVERED_FRACTION of the baseline;
+    # None if it didn't before the end of the workload
+    recovery_s: Optional[float]
+
+@dataclass(frozen=True)
+class WindowStats:
+    started_at: float
+    duration: float
+    ops: int
+    ops_per_s: float
+    errors: int
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    p999_ms: float
+    max_ms: float
+
+# `[interval] ts=... elapsed=... ops=... rate=... errors=... ... p99_ms=...` (lib/stressor.py)
+_NATIVE_RE = re.compile(r'\[interval\] ts=(\S+) elapsed=\S+ ops=\d+ rate=(\S+) errors=(\d+) .*p99_ms=(\S+)')
+
+def parse_native(lines: Sequence[str]) -> List[Sample]:
+    res: List[Sample] = []
+    for l in lines:
+        m = _NATIVE_RE.match(l)
+        if not m:
+            continue
+        ts = float(m[1])
+        res.append(Sample(ts = ts, length = ts - res[-1].ts if res else 0,
+            ops_per_s = float(m[2]), p99_ms = float(m[4]), errors = int(m[3])))
+    # The length of the first interval is unknown: assume it's like the second
+    if len(res) > 1:
+        res[0] = Sample(res[0].ts, res[1].length, res[0].ops_per_s, res[0].p99_ms, res[0].errors)
+    return res
+
+# cassandra-stress with `-log interval=N`: a header (`type, total ops, op/s, ..., .99, ..., time, stderr, errors, ...`)
+# followed by a row per operation type and interval; times are relative to `start`, when the workload started
+def parse_cassandra_stress(lines: Sequence[str], start: float) -> List[Sample]:
+    cols: Optional[Dict[str, int]] = None
+    rows: Dict[str, List[List[str]]] = {}
+    for l in lines:
+        fields = [f.strip() for f in l.split(',')]
+        if fields[0].startswith('type') and 'op/s' in fields:
+            # The first two names are separated by spaces only: `type       total ops,    op/s, ...`
+            cols = {f: i for i, f in enumerate(fields[0].split(None, 1) + fields[1:])}
+            continue
+        if cols is None or len(fields) < len(cols):
+            continue
+        try:
+            float(fields[cols['time']])
+        except ValueError:
+            continue
+        rows.setdefault(fields[0], []).append(fields)
+    if cols is None or not rows:
+        return []
+    # Prefer the rows aggregating all operation types
+    rs = rows.get('total') or next(iter(rows.values()))
+    res: List[Sample] = []
+    last = 0.0
+    for r in rs:
+        t = float(r[cols['time']])
+        res.append(Sample(ts = start + t, length = t - last, ops_per_s = float(r[cols['op/s']]),
+            p99_ms = float(r[cols['.99']]), errors = int(float(r[cols['errors']])) if 'errors' in cols else 0))
+        last = t
+    return res
+
+def _phase_start(run_path: Path, name: str) -> Optional[float]:
+    try:
+        with open(run_path / 'phases.jsonl') as f:
+            for l in f:
+                p = json.loads(l)
+                if p['name'] == name:
+                    return p['started_at']
+    except FileNotFoundError:
+        pass
+    return None
+
+# The stressor's throughput and latency over time; empty if its output has no interval reports (e.g. gemini).
+# cassandra-stress' times start when its workload does, after the JVM started, connected and created the schema
+# (usually 5-15s after the process started). Its series is anchored to its end instead: the last row was
+# written about when `stressor.log` was last modified (followed only by the final summary), so samples
+# are placed within about a second. The series never starts before the stressor was started.
+def stressor_samples(run_path: Path) -> List[Sample]:
+    path = run_path / 'stressor.log'
+    try:
+        with open(path, errors = 'replace') as f:
+            lines = f.readlines()
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        return []
+    res = parse_native(lines)
+    if res:
+        return res
+    relative = parse_cassandra_stress(lines, 0)
+    if not relative:
+        return []
+    start = mtime - relative[-1].ts
+    started = _phase_start(run_path, 'start stressor')
+    if started is not None:
+        start = max(start, started)
+    return [replace(s, ts = s.ts + start) for s in relative]
+
+def run_events(run_path: Path, since: float) -> List[Event]:
+    res = [Event(kind = e.kind, node = e.node, started_at = e.started_at,
+                 ended_at = e.recovered_at if e.recovered_at is not None else e.ended_at)
+           for e in read_events(run_path)]
+    try:
+        with open(run_path / 'boot_times.jsonl') as f:
+            for l in f:
+                b = json.loads(l)
+                # Nodes booted with the clusters aren't events of the workload
+                if b['started_at'] >= since:
+                    res.append(Event(kind = 'bootstrap', node = b['ip'], started_at = b['started_at'],
+                        ended_at = b['started_at'] + b['duration']))
+    except FileNotFoundError:
+        pass
+    return sorted(res, key = lambda e: e.started_at)
+
+def event_impact(e: Event, samples: Sequence[Sample]) -> Optional[EventImpact]:
+    before = [s for s in samples if e.started_at - BASELINE_WINDOW <= s.ts - s.length and s.ts <= e.started_at]
+    # Intervals overlapping the event
+    during = [s for s in samples if s.ts > e.started_at and s.ts - s.length < e.ended_at]
+    if not before or not during:
+        return None
+    base_ops = statistics.median(s.ops_per_s for s in before)
+    base_p99 = statistics.median(s.p99_ms for s in before)
+    min_ops = min(s.ops_per_s for s in during)
+    max_p99 = max(s.p99_ms for s in during)
+    recovery = next((s.ts - e.started_at for s in samples
+                     if s.ts > e.started_at and s.ts - s.length >= e.ended_at
+                     and s.ops_per_s >= RECOVERED_FRACTION * base_ops), None)
+    return EventImpact(kind = e.kind, node = e.node, started_at = e.started_at, duration = e.ended_at - e.started_at,
+        baseline_ops_per_s = base_ops, baseline_p99_ms = base_p99, min_ops_per_s = min_ops, max_p99_ms = max_p99,
+        throughput_drop = 1 - min_ops / base_ops if base_ops > 0 else 0,
+        p99_spike = max_p99 / base_p99 if base_p99 > 0 else 0,
+        errors = sum(s.errors for s in during), recovery_s = recovery)
+
+# Impact of every event of the run which happened while the stressor was reporting
+def analyze_run(run_path: Path) -> List[EventImpact]:
+    samples = stressor_samples(run_path)
+    if not samples:
+        return []
+    res = []
+    for e in run_events(run_path, samples[0].ts - samples[0].length):
+        i = event_impact(e, samples)
+        if i:
+            res.append(i)
+    return res
+
+# Per event kind: number of events, mean and max throughput drop and p99 spike, mean and max recovery time
+def aggregate(impacts: Sequence[EventImpact]) -> Dict[str, Dict[str, Optional[float]]]:
+    res: Dict[str, Dict[str, Optional[float]]] = {}
+    for kind in sorted({i.kind for i in impacts}):
+        ks = [i for i in impacts if i.kind == kind]
+        rec = [i.recovery_s for i in ks if i.recovery_s is not None]
+        res[kind] = {
+            'events': len(ks),
+            'throughput_drop_mean': statistics.mean(i.throughput_drop for i in ks),
+            'throughput_drop_max': max(i.throughput_drop for i in ks),
+            'p99_spike_mean': statistics.mean(i.p99_spike for i in ks),
+            'p99_spike_max': max(i.p99_spike for i in ks),
+            'recovery_s_mean': statistics.mean(rec) if rec else None,
+            'recovery_s_max': max(rec) if rec else None,
+            'not_recovered': len(ks) - len(rec),
+        }
+    return res
+
+def format_aggregate(agg: Dict[str, Dict[str, Optional[float]]]) -> str:
+    fmt = lambda v, f: '-' if v is None else format(v, f)
+    lines = ['{:<14} {:>6} {:>10} {:>10} {:>9} {:>9} {:>10} {:>10} {:>7}'.format(
+        'event', 'count', 'drop mean', 'drop max', 'p99x mean', 'p99x max', 'recov mean', 'recov max', 'no recov')]
+    for kind, a in agg.items():
+        lines.append('{:<14} {:>6} {:>10} {:>10} {:>9} {:>9} {:>10} {:>10} {:>7}'.format(kind, a['events'],
+            fmt(a['throughput_drop_mean'], '.0%'), fmt(a['throughput_drop_max'], '.0%'),
+            fmt(a['p99_spike_mean'], '.1f'), fmt(a['p99_spike_max'], '.1f'),
+            fmt(a['recovery_s_mean'], '.1f'), fmt(a['recovery_s_max'], '.1f'), a['not_recovered']))
+    return '\n'.join(lines)
+
+# The per-interval histograms of the native stressor, with their lengths (`length`) added
+def hist_intervals(run_path: Path) -> List[dict]:
+    try:
+        with open(run_path / 'stressor_hist.json') as f:
+            intervals = json.load(f)['intervals']
+    except FileNotFoundError:
+        return []
+    last = 0.0
+    for i in intervals:
+        i['length'] = i['elapsed'] - last
+        last = i['elapsed']
+    return intervals
+
+# Throughput, latency percentiles and errors of the intervals overlapping [start, end]
+def window_stats(intervals: Sequence[dict], start: float, end: float) -> Optional[WindowStats]:
+    ws = [i for i in intervals if i['ts'] > start and i['ts'] - i['length'] < end]
+    if not ws:
+        return None
+    h = Histogram()
+    for i in ws:
+        h.merge(Histogram.from_dict(i['latencies']))
+    length = sum(i['length'] for i in ws)
+    ms = lambda p: h.percentile(p) / 1000
+    return WindowStats(started_at = start, duration = end - start, ops = h.count,
+        ops_per_s = h.count / length if length > 0 else 0, errors = sum(i['errors'] for i in ws),
+        p50_ms = ms(50), p95_ms = ms(95), p99_ms = ms(99), p999_ms = ms(99.9), max_ms = (h.max or 0) / 1000)
+
+# The workload during a rolling upgrade (`run_path/upgrade.jsonl`, see lib/rolling_upgrade.py): statistics
+# before, during every step of and after the upgrade, and the impact of every upgraded node, from being
+# stopped until it served CQL again. Saved to `run_path/upgrade_impact.json`.
+def save_upgrade_impact(run_path: Path) -> dict:
+    with open(run_path / 'upgrade.jsonl') as f:
+        records = [json.loads(l) for l in f if l.strip()]
+    steps = [r for r in records if r['type'] == 'step']
+    nodes = [r for r in records if r['type'] == 'node']
+    intervals = hist_intervals(run_path)
+    samples = stressor_samples(run_path)
+
+    def stats(start: float, end: float) -> Optional[dict]:
+        w = window_stats(intervals, start, end)
+        return asdict(w) if w else None
+
+    upgrade_start = min((s['started_at'] for s in steps), default = 0)
+    upgrade_end = max((s['started_at'] + s['duration'] for s in steps), default = 0)
+    res: Dict[str, Any] = {
+        'before': stats(upgrade_start - BASELINE_WINDOW, upgrade_start) if steps else None,
+        'during': stats(upgrade_start, upgrade_end) if steps else None,
+        'after': stats(upgrade_end, intervals[-1]['ts']) if steps and intervals else None,
+        'steps': [dict(step = s['step'], ips = s['ips'], stats = stats(s['started_at'], s['started_at'] + s['duration']))
+                  for s in steps],
+        'nodes': [],
+    }
+    for n in nodes:
+        i = event_impact(Event(kind = 'upgrade', node = n['ip'], started_at = n['stopped_at'], ended_at = n['serving_at']),
+                samples)
+        res['nodes'].append(dict(ip = n['ip'], step = n['step'], downtime = n['downtime'],
+            impact = asdict(i) if i else None))
+    with open(run_path / 'upgrade_impact.json', 'w') as f:
+        json.dump(res, f, indent = 1)
+    return res
+
+def format_upgrade_impact(res: dict) -> str:
+    fmt = lambda v, f: '-' if v is None else format(v, f)
+    row = '{:<10} {:>9} {:>7} {:>8} {:>8} {:>8} {:>9} {:>8}'
+    lines = [row.format('window', 'ops/s', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'p999 ms', 'max ms')]
+    windows = [('before', res['before']), ('during', res['during'])] \
+            + [(f'step {s["step"]}', s['stats']) for s in res['steps']] + [('after', res['after'])]
+    for name, w in windows:
+        if w:
+            lines.append(row.format(name, format(w['ops_per_s'], '.1f'), w['errors'], format(w['p50_ms'], '.2f'),
+                format(w['p95_ms'], '.2f'), format(w['p99_ms'], '.2f'), format(w['p999_ms'], '.2f'), format(w['max_ms'], '.2f')))
+    row = '{:<16} {:>5} {:>9} {:>7} {:>6} {:>8}'
+    lines.append(row.format('node', 'step', 'downtime', 'dip', 'p99x', 'recovery'))
+    for n in res['nodes']:
+        i = n['impact']
+        lines.append(row.format(n['ip'], n['step'], format(n['downtime'], '.1f'),
+            fmt(i and i['throughput_drop'], '.0%'), fmt(i and i['p99_spike'], '.1f'), fmt(i and i['recovery_s'], '.1f')))
+    return '\n'.join(lines)
+
+# Analyzes the run and saves the result to `run_path/impact.json`
+def save_run_impact(run_path: Path) -> List[EventImpact]:
+    impacts = analyze_run(run_path)
+    with open(run_path / 'impact.json', 'w') as f:
+        json.dump({'events': [asdict(i) for i in impacts], 'aggregate': aggregate(impacts)}, f, indent = 1)
+    return impacts
@@ -11,12 +11,13 @@ class LocalNodeEnv:
     opts: RunOpts
 
 # TODO: this is test specific?
-# IPs start from 127.0.0.{start}
-def mk_cluster_env(start: int, num_nodes: int, opts: RunOpts, cluster_cfg: ClusterConfig) -> List[LocalNodeEnv]:
+# IPs start from {net}.{start}, e.g. 127.0.0.{start}; see lib/addresses.py for leasing `net`
+def mk_cluster_env(start: int, num_nodes: int, opts: RunOpts, cluster_cfg: ClusterConfig,
+        net: str = '127.0.0') -> List[LocalNodeEnv]:
     assert start + num_nodes <= 256
     assert num_nodes > 0
 
-    ips = [f'127.0.0.{i}' for i in range(start, num_nodes + start)]
+    ips = [f'{net}.{i}' for i in range(start, num_nodes + start)]
     envs = [LocalNodeEnv(
                 cfg = NodeConfig(
                     ip_addr = i,
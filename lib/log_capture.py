@@ -0,0 +1,258 @@
+from pathlib import Path
+from typing import Any, Dict, IO, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from threading import Thread, Event
+import subprocess
+import logging
+import ctypes
+import shutil
+import errno
+import gzip
+import sys
+import os
+import re
+
+# Capture of the output of a node's process into its log file. Modes:
+# - 'readline': a thread reads the output line by line, appends it to the log and prints it.
+#   Simple, but every line goes through Python, which takes a core when Scylla logs a lot.
+# - 'splice': a thread moves the output from the pipe to the log with splice(2), in the kernel;
+#   with `echo`, tee(2) duplicates it to the harness' stdout. Linux only.
+# - 'direct': the process writes to the log file itself; there's no thread and no echo.
+# The log can be rotated when it grows over `max_bytes`: the rotated part is renamed to `<log>.<seq>`
+# and gzipped in the background, and only the last `keep` rotated parts are kept. In the 'direct' mode
+# the harness can't know where the process is writing, so the log is copied and truncated instead
+# (lines written in between are lost, like with logrotate's copytruncate).
+
+MODES = ['readline', 'splice', 'direct']
+
+@dataclass(frozen=True)
+class LogCaptureConfig:
+    mode: str = 'readline'
+    # Copy the output to the harness' stdout ('readline' and 'splice' only)
+    echo: bool = True
+    # Rotate the log when it grows over this many bytes; None: never
+    max_bytes: Optional[int] = None
+    keep: int = 5
+    # How often the size of the log is checked in the 'direct' mode (seconds)
+    check_interval: float = 1
+
+# The most a single splice/tee call moves
+CHUNK = 2**20
+
+_libc = ctypes.CDLL(None, use_errno = True)
+
+def _tee(fd_in: int, fd_out: int, n: int) -> int:
+    f = _libc.tee
+    f.restype = ctypes.c_ssize_t
+    f.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_size_t, ctypes.c_uint]
+    res = f(fd_in, fd_out, n, 0)
+    if res < 0:
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+    return res
+
+def splice_supported() -> bool:
+    return hasattr(os, 'splice') and hasattr(_libc, 'tee')
+
+class _Rotator:
+    def __init__(self, logger: logging.Logger, path: Path, keep: int):
+        self.__logger = logger
+        self.__path = path
+        self.__keep = keep
+        self.__seq = max(self.__rotated(), default = 0)
+        # Compresses rotated logs one at a time, not delaying the capture
+        self.__compressor = ThreadPoolExecutor(max_workers = 1)
+
+    # Sequence numbers of the rotated logs (compressed or not)
+    def __rotated(self) -> List[int]:
+        res = set()
+        for p in self.__path.parent.glob(self.__path.name + '.*'):
+            m = re.fullmatch(re.escape(self.__path.name) + r'\.(\d+)(\.gz)?', p.name)
+            if m:
+                res.add(int(m.group(1)))
+        return sorted(res)
+
+    def __next(self) -> Path:
+        self.__seq += 1
+        return self.__path.with_name(f'{self.__path.name}.{self.__seq}')
+
+    # Moves the log aside; it must not be open for writing anymore
+    def rotate(self) -> None:
+        dst = self.__next()
+        self.__path.rename(dst)
+        self.__compressor.submit(self.__compress, dst)
+
+    # Copies the log aside and truncates it, for logs which are still being written to (with O_APPEND)
+    def copy_truncate(self) -> None:
+        dst = self.__next()
+        shutil.copyfile(self.__path, dst)
+        os.truncate(self.__path, 0)
+        self.__compressor.submit(self.__compress, dst)
+
+    def __compress(self, src: Path) -> None:
+        try:
+            with open(src, 'rb') as i, gzip.open(src.with_name(src.name + '.gz.tmp'), 'wb', compresslevel = 1) as o:
+                shutil.copyfileobj(i, o, CHUNK)
+            src.with_name(src.name + '.gz.tmp').rename(src.with_name(src.name + '.gz'))
+            src.unlink()
+            for seq in self.__rotated()[:-self.__keep or None]:
+                for p in (self.__path.with_name(f'{self.__path.name}.{seq}.gz'),
+                          self.__path.with_name(f'{self.__path.name}.{seq}')):
+                    p.unlink(missing_ok = True)
+        except Exception:
+            self.__logger.exception(f'Failed to compress {src}')
+
+    # Pending compressions still finish (at the latest when the harness exits)
+    def close(self) -> None:
+        self.__compressor.shutdown(wait = False)
+
+class LogCapture:
+    def __init__(self, logger: logging.Logger, path: Path, cfg: LogCaptureConfig = LogCaptureConfig()):
+        assert cfg.mode in MODES
+        self.__logger = logger
+        self.__path = path
+        self.__cfg = cfg
+        self.__mode = cfg.mode
+        if self.__mode == 'splice' and not splice_supported():
+            logger.warning('splice(2) is not supported here, capturing logs line by line')
+            self.__mode = 'readline'
+        self.__rotator = _Rotator(logger, path, cfg.keep) if cfg.max_bytes else None
+        self.__file_fd: Optional[int] = None
+        self.__pipe: Optional[IO[Any]] = None
+        self.__thread: Optional[Thread] = None
+        self.__stopping = Event()
+        self.__splice_to_file = True
+
+    # Arguments of `subprocess.Popen` for the process whose output is captured
+    def popen_args(self) -> Dict[str, Any]:
+        if self.__mode == 'direct':
+            self.__file_fd = os.open(self.__path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            return {'stdout': self.__file_fd, 'stderr': subprocess.STDOUT}
+        if self.__mode == 'readline':
+            return {'stdout': subprocess.PIPE, 'stderr': subprocess.STDOUT}
+        return {'stdout': subprocess.PIPE, 'stderr': subprocess.STDOUT, 'bufsize': 0}
+
+    def attach(self, p: subprocess.Popen) -> None:
+        if self.__mode == 'direct':
+            # The process has its own copy
+            assert self.__file_fd is not None
+            os.close(self.__file_fd)
+            self.__file_fd = None
+            if self.__rotator:
+                self.__thread = Thread(target = self.__watch_size, daemon = True)
+                self.__thread.start()
+            return
+        assert p.stdout
+        self.__pipe = p.stdout
+        target = self.__readline if self.__mode == 'readline' else self.__splice
+        self.__thread = Thread(target = target, args = [p.stdout], daemon = True)
+        self.__thread.start()
+
+    # Whether the output is still being captured (the process may have exited, but its output not consumed yet)
+    def capturing(self) -> bool:
+        return self.__mode != 'direct' and self.__thread is not None and self.__thread.is_alive()
+
+    # Waits until the whole output is captured; the process must have exited or be exiting
+    def close(self) -> None:
+        self.__stopping.set()
+        if self.__thread:
+            self.__thread.join()
+            self.__thread = None
+        if self.__pipe:
+            self.__pipe.close()
+            self.__pipe = None
+        if self.__rotator:
+            self.__rotator.close()
+
+    def __over_limit(self, size: int) -> bool:
+        return self.__cfg.max_bytes is not None and size >= self.__cfg.max_bytes
+
+    # Bytes rather than text, so that sizes are counted like in the other modes
+    def __readline(self, pipe: IO[bytes]) -> None:
+        f = open(self.__path, 'ab', buffering = 0)
+        size = f.tell()
+        try:
+            for l in iter(pipe.readline, b''):
+                f.write(l)
+                if self.__cfg.echo:
+                    print(l.decode(errors = 'replace'), end='', flush=True)
+                size += len(l)
+                if self.__rotator and self.__over_limit(size):
+                    f.close()
+                    self.__rotator.rotate()
+                    f = open(self.__path, 'ab', buffering = 0)
+                    size = 0
+        finally:
+            f.close()
+
+    def __splice(self, pipe: IO[bytes]) -> None:
+        fd_in = pipe.fileno()
+        echo_r, echo_w = os.pipe() if self.__cfg.echo else (-1, -1)
+        out, size = self.__open_for_splice()
+        # splice to a terminal fails, then the echo is copied through userspace
+        echo_splice = True
+        try:
+            while True:
+                if self.__cfg.echo:
+                    # Blocks until there's output; the data stays in the pipe for the splice below
+                    n = _tee(fd_in, echo_w, CHUNK)
+                    if n == 0:
+                        break
+                    left = n
+                    while left:
+                        left -= self.__move(fd_in, out, left)
+                    left = n
+                    while left:
+                        if echo_splice:
+                            try:
+                                left -= os.splice(echo_r, sys.stdout.fileno(), left)
+                                continue
+                            except OSError as e:
+                                if e.errno not in (errno.EINVAL, errno.EBADF):
+                                    raise
+                                echo_splice = False
+                        left -= os.write(sys.stdout.fileno(), os.read(echo_r, left))
+                else:
+                    n = self.__move(fd_in, out, CHUNK)
+                    if n == 0:
+                        break
+                size += n
+                if self.__rotator and self.__over_limit(size):
+                    os.close(out)
+                    self.__rotator.rotate()
+                    out, size = self.__open_for_splice()
+        finally:
+            os.close(out)
+            if self.__cfg.echo:
+                os.close(echo_r)
+                os.close(echo_w)
+
+    # splice(2) doesn't write to files opened with O_APPEND
+    def __open_for_splice(self) -> Tuple[int, int]:
+        fd = os.open(self.__path, os.O_WRONLY | os.O_CREAT, 0o644)
+        return fd, os.lseek(fd, 0, os.SEEK_END)
+
+    # Moves at most `n` bytes from the pipe to the log; falls back to copying through userspace
+    # on filesystems which don't support splice
+    def __move(self, fd_in: int, out: int, n: int) -> int:
+        if self.__splice_to_file:
+            try:
+                return os.splice(fd_in, out, n)
+            except OSError as e:
+                if e.errno != errno.EINVAL:
+                    raise
+                self.__logger.warning(f'splice(2) to {self.__path} is not supported, copying the output instead')
+                self.__splice_to_file = False
+        data = os.read(fd_in, n)
+        os.write(out, data)
+        return len(data)
+
+    def __watch_size(self) -> None:
+        assert self.__rotator
+        while not self.__stopping.wait(self.__cfg.check_interval):
+            try:
+                if self.__over_limit(self.__path.stat().st_size):
+                    self.__rotator.copy_truncate()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,314 @@
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from dataclasses import dataclass
+from functools import lru_cache
+from threading import Thread, Event
+import datetime
+import logging
+import sqlite3
+import gzip
+import time
+import re
+
+# Index of the logs of a run: the nodes' `scyllalog`s (including rotated parts, see lib/log_capture.py)
+# and the tools' logs in the run directory (`run.log`, `stressor.log`, `replicator.log`, ...).
+# Lines are parsed into timestamp, node, shard, level, logger and message and stored in an SQLite database
+# (`run_path/logs.db`), ordered by time, with levels and loggers interned. Indexing is incremental:
+# for every file the offset of the last indexed line is recorded, so the index can be updated during the run.
+# Lines without a timestamp (backtraces, multi-line messages, tools' output) get the timestamp, shard, level
+# and logger of the preceding line of the same file, or the file's modification time when indexed if no line
+# of the file had a timestamp yet. Concurrent updates (e.g. the run's `LogIndexer` and `scripts/logs.py`)
+# are serialized by the database.
+
+INDEX_FILE = 'logs.db'
+
+LEVELS = ['TRACE', 'DEBUG', 'INFO', 'WARN', 'ERROR']
+_LEVEL_ALIASES = {'WARNING': 'WARN', 'FATAL': 'ERROR', 'CRITICAL': 'ERROR', 'SEVERE': 'ERROR'}
+
+_TS = r'\d{4}-\d\d-\d\d[ T]\d\d:\d\d:\d\d(?:[,.]\d+)?'
+# `INFO  2023-01-01 12:00:00,123 [shard 0] storage_service - message` (newer versions: `[shard 0:main]`)
+_SCYLLA_RE = re.compile(
+    r'(?P<level>TRACE|DEBUG|INFO|WARN|ERROR)\s+(?P<ts>' + _TS + r')\s+\[shard\s+(?P<shard>\d+)(?::[^\]]*)?\]\s+'
+    r'(?P<logger>\S+) - (?P<msg>.*)')
+# The harness' format: `2023-01-01 12:00:00,123 [INFO] message`
+_HARNESS_RE = re.compile(r'(?P<ts>' + _TS + r') \[(?P<level>[A-Z]+)\] (?P<msg>.*)')
+# Other tools: a timestamp at the start of the line, maybe followed by a level
+_GENERIC_RE = re.compile(
+    r'(?P<ts>' + _TS + r')\S*\s+(?:\[?(?P<level>TRACE|DEBUG|INFO|WARN|WARNING|ERROR|FATAL|SEVERE)\]?\s+)?(?P<msg>.*)')
+
+@dataclass(frozen=True)
+class Entry:
+    ts: float
+    # The node's IP for Scylla logs, the tool's name (e.g. 'replicator') otherwise
+    node: str
+    shard: Optional[int]
+    level: Optional[str]
+    logger: Optional[str]
+    message: str
+
+    def format(self) -> str:
+        return '{} {:<15} {:<8} {:<5} {}{}'.format(
+            format_time(self.ts), self.node, '' if self.shard is None else f'shard {self.shard}',
+            self.level or '', f'{self.logger}: ' if self.logger else '', self.message)
+
+@lru_cache(maxsize = 4096)
+def _parse_seconds(s: str) -> float:
+    return time.mktime(time.strptime(s, '%Y-%m-%d %H:%M:%S'))
+
+# Parses timestamps of the logs (local time) into seconds since the epoch
+def parse_log_time(s: str) -> float:
+    s = s.replace('T', ' ')
+    frac = 0.0
+    if len(s) > 19:
+        frac = float('0.' + s[20:])
+    return _parse_seconds(s[:19]) + frac
+
+def format_time(ts: float) -> str:
+    return datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+def _level(s: Optional[str]) -> Optional[int]:
+    if not s:
+        return None
+    s = _LEVEL_ALIASES.get(s, s)
+    return LEVELS.index(s) if s in LEVELS else None
+
+# Returns (timestamp, shard, level, logger, message); the timestamp is None if the line doesn't have one
+def parse_line(line: str) -> Tuple[Optional[float], Optional[int], Optional[int], Optional[str], str]:
+    m = _SCYLLA_RE.match(line)
+    if m:
+        return parse_log_time(m['ts']), int(m['shard']), _level(m['level']), m['logger'], m['msg']
+    m = _HARNESS_RE.match(line) or _GENERIC_RE.match(line)
+    if m:
+        return parse_log_time(m['ts']), None, _level(m['level']), None, m['msg']
+    return None, None, None, None, line
+
+# Log files of a run: (source name, node, path). Rotated parts are named like the uncompressed file,
+# so that a part keeps its source when it gets compressed.
+def _log_files(run_path: Path) -> List[Tuple[str, str, Path]]:
+    res = []
+    for p in sorted(run_path.rglob('scyllalog*')):
+        m = re.fullmatch(r'scyllalog(\.\d+)?(\.gz)?', p.name)
+        if not m or p.is_dir():
+            continue
+        rel = p.relative_to(run_path)
+        res.append((str(rel.with_name('scyllalog' + (m[1] or ''))), str(rel.parent), p))
+    for p in sorted(run_path.glob('*.log')):
+        res.append((p.name, p.stem, p))
+    return res
+
+def _rotation_seq(source: str) -> int:
+    m = re.search(r'\.(\d+)$', source)
+    return int(m[1]) if m else 0
+
+class LogIndex:
+    def __init__(self, run_path: Path, path: Optional[Path] = None):
+        self.__run_path = run_path
+        # Waits for a concurrent update to finish
+        self.__db = sqlite3.connect(path or run_path / INDEX_FILE, timeout = 600)
+        self.__db.execute('pragma journal_mode = wal')
+        self.__db.executescript('''
+            create table if not exists sources (
+                id integer primary key, name text unique, node text, inode integer, offset integer, last_ts real,
+                complete integer);
+            create table if not exists loggers (id integer primary key, name text unique);
+            create table if not exists entries (
+                ts real, source integer, shard integer, level integer, logger integer, message text);
+            create index if not exists entries_ts on entries (ts);
+        ''')
+        self.__loggers: Dict[str, int] = {n: i for i, n in self.__db.execute('select id, name from loggers')}
+
+    def close(self) -> None:
+        self.__db.close()
+
+    def __enter__(self) -> 'LogIndex':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def __logger_id(self, name: Optional[str]) -> Optional[int]:
+        if name is None:
+            return None
+        i = self.__loggers.get(name)
+        if i is None:
+            i = self.__db.execute('insert into loggers (name) values (?)', (name,)).lastrowid
+            assert i is not None
+            self.__loggers[name] = i
+        return i
+
+    # Indexes the lines added to the run's logs since the last update; returns the number of new entries
+    def update(self) -> int:
+        # Holds the write lock from reading the offsets until the new ones are committed
+        self.__db.execute('begin immediate')
+        try:
+            added = self.__update()
+        except BaseException:
+            self.__db.rollback()
+            self.__loggers = {n: i for i, n in self.__db.execute('select id, name from loggers')}
+            raise
+        self.__db.commit()
+        return added
+
+    def __update(self) -> int:
+        # Another process may have added loggers
+        self.__loggers = {n: i for i, n in self.__db.execute('select id, name from loggers')}
+        files = _log_files(self.__run_path)
+        sources = {name: (sid, inode, offset)
+                   for sid, name, inode, offset in self.__db.execute('select id, name, inode, offset from sources')}
+        added = 0
+        for name, node, path in files:
+            # A log may have been rotated since the last update: the lines indexed from it so far
+            # now belong to its oldest part which isn't indexed yet
+            if _rotation_seq(name) or name not in sources:
+                continue
+            sid, inode, offset = sources[name]
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            if st.st_ino != inode or st.st_size < offset:
+                parts = sorted((n for n, _, _ in files if _rotation_seq(n) and n.startswith(name + '.')
+                                and n not in sources), key = _rotation_seq)
+                if parts:
+                    self.__db.execute('update sources set name = ?, inode = null where id = ?', (parts[0], sid))
+                else:
+                    # Replaced by a new file (or the part was already removed); keep the indexed lines
+                    self.__db.execute('update sources set name = ?, complete = 1 where id = ?', (f'{name}@{sid}', sid))
+        sources = {name: (sid, inode, offset)
+                   for sid, name, inode, offset in self.__db.execute('select id, name, inode, offset from sources')}
+        done = {name for name, in self.__db.execute('select name from sources where complete')}
+        for name, node, path in files:
+            if name not in done:
+                added += self.__index_file(name, node, path, sources.get(name))
+                if _rotation_seq(name):
+                    done.add(name)
+        return added
+
+    def __index_file(self, name: str, node: str, path: Path, source: Optional[Tuple[int, Optional[int], int]]) -> int:
+        compressed = path.suffix == '.gz'
+        # Rotated parts are complete; a partial last line of the current log is left for the next update
+        complete = bool(_rotation_seq(name))
+        try:
+            st = path.stat()
+            inode = None if compressed else st.st_ino
+            f = gzip.open(path, 'rb') if compressed else open(path, 'rb')
+        except FileNotFoundError:
+            return 0
+        if source is None:
+            sid = self.__db.execute('insert into sources (name, node, inode, offset, last_ts, complete) values (?, ?, ?, 0, 0, 0)',
+                    (name, node, inode)).lastrowid
+            assert sid is not None
+            offset = 0
+        else:
+            sid, _, offset = source
+        last_ts = self.__db.execute('select last_ts from sources where id = ?', (sid,)).fetchone()[0]
+
+        rows = []
+        added = 0
+        prev: Tuple[Optional[int], Optional[int], Optional[int]] = (None, None, None)
+        with f:
+            f.seek(offset)
+            for raw in f:
+                if not raw.endswith(b'\n') and not complete:
+                    break
+                offset += len(raw)
+                ts, shard, level, logger, msg = parse_line(raw.decode(errors = 'replace').rstrip('\r\n'))
+                if ts is None:
+                    # A continuation of the previous line (e.g. a backtrace): keep it in the same filtered views
+                    ts, shard, level, logger_id = last_ts or st.st_mtime, prev[0], prev[1], prev[2]
+                else:
+                    logger_id = self.__logger_id(logger)
+                    last_ts = ts
+                prev = (shard, level, logger_id)
+                rows.append((ts, sid, shard, level, logger_id, msg))
+                if len(rows) >= 10000:
+                    added += self.__flush(rows)
+        added += self.__flush(rows)
+        self.__db.execute('update sources set inode = ?, offset = ?, last_ts = ?, complete = ? where id = ?',
+                (inode, offset, last_ts, complete, sid))
+        return added
+
+    def __flush(self, rows: List[tuple]) -> int:
+        n = len(rows)
+        self.__db.executemany('insert into entries values (?, ?, ?, ?, ?, ?)', rows)
+        rows.clear()
+        return n
+
+    # Entries matching all the given filters, ordered by time (lines of one file keep their order).
+    # `level`: the minimum level; `grep`: a regex searched for in the message.
+    def query(self, since: Optional[float] = None, until: Optional[float] = None,
+            nodes: Sequence[str] = [], level: Optional[str] = None, loggers: Sequence[str] = [],
+            grep: Optional[str] = None, limit: Optional[int] = None) -> Iterator[Entry]:
+        conds = []
+        params: list = []
+        if since is not None:
+            conds.append('e.ts >= ?')
+            params.append(since)
+        if until is not None:
+            conds.append('e.ts <= ?')
+            params.append(until)
+        if nodes:
+            conds.append('s.node in ({})'.format(','.join('?' * len(nodes))))
+            params.extend(nodes)
+        if level:
+            conds.append('e.level >= ?')
+            params.append(_level(level.upper()))
+        if loggers:
+            conds.append('l.name in ({})'.format(','.join('?' * len(loggers))))
+            params.extend(loggers)
+        if grep:
+            r = re.compile(grep)
+            self.__db.create_function('regexp', 2, lambda p, s: s is not None and r.search(s) is not None,
+                    deterministic = True)
+            conds.append('e.message regexp ?')
+            params.append(grep)
+        sql = '''select e.ts, s.node, e.shard, e.level, l.name, e.message
+                 from entries e join sources s on e.source = s.id left join loggers l on e.logger = l.id'''
+        if conds:
+            sql += ' where ' + ' and '.join(conds)
+        sql += ' order by e.ts, e.rowid'
+        if limit is not None:
+            sql += f' limit {int(limit)}'
+        for ts, node, shard, lvl, logger, msg in self.__db.execute(sql, params):
+            yield Entry(ts, node, shard, None if lvl is None else LEVELS[lvl], logger, msg)
+
+    # The merged timeline of all nodes and tools from `before` seconds before `at` to `after` seconds after it
+    def timeline(self, at: float, before: float = 5, after: float = 5, **filters) -> Iterator[Entry]:
+        return self.query(since = at - before, until = at + after, **filters)
+
+# Updates the index of a run's logs every `interval` seconds, and once more when stopped
+class LogIndexer:
+    def __init__(self, logger: logging.Logger, run_path: Path, interval: float = 30):
+        self.__logger = logger
+        self.__run_path = run_path
+        self.__interval = interval
+        self.__stop = Event()
+        self.__thread: Optional[Thread] = None
+        self.entries = 0
+
+    def start(self) -> None:
+        if self.__thread:
+            return
+        self.__stop.clear()
+        self.__thread = Thread(target = self.__run, daemon = True)
+        self.__thread.start()
+
+    def stop(self) -> None:
+        if not self.__thread:
+            return
+        self.__stop.set()
+        self.__thread.join()
+        self.__thread = None
+        self.__logger.info(f'Indexed {self.entries} log lines into {self.__run_path / INDEX_FILE}')
+
+    def __run(self) -> None:
+        # SQLite connections can't be shared between threads
+        with LogIndex(self.__run_path) as idx:
+            while True:
+                stopping = self.__stop.wait(self.__interval)
+                try:
+                    self.entries += idx.update()
+                except Exception:
+                    self.__logger.exception('Failed to index logs')
+                if stopping:
+                    return
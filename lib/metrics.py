@@ -0,0 +1,214 @@
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from threading import Thread, Event
+import logging
+import math
+import json
+import time
+import re
+import requests
+
+from lib.columnar import TS, ColumnarWriter, read_columns
+from lib.node import Node
+from lib.readiness import node_endpoints
+
+@dataclass(frozen=True)
+class Metric:
+    # Name used in the store and the summary
+    name: str
+    # Prometheus metric name; all series of the metric (shards, label values) are aggregated
+    prom_name: str
+    # Counters are summarized as per-second rates, gauges as they are
+    counter: bool
+    # How the series of a node are aggregated: 'sum' or 'avg'
+    agg: str = 'sum'
+
+METRICS: List[Metric] = [
+    Metric('writes', 'scylla_database_total_writes', counter = True),
+    Metric('reads', 'scylla_database_total_reads', counter = True),
+    Metric('cdc_operations', 'scylla_cdc_operations_total', counter = True),
+    Metric('cdc_failed_operations', 'scylla_cdc_operations_failed', counter = True),
+    Metric('reactor_utilization', 'scylla_reactor_utilization', counter = False, agg = 'avg'),
+    Metric('cache_row_hits', 'scylla_cache_row_hits', counter = True),
+    Metric('cache_row_misses', 'scylla_cache_row_misses', counter = True),
+    Metric('pending_compactions', 'scylla_compaction_manager_pending_compactions', counter = False),
+    Metric('write_timeouts', 'scylla_storage_proxy_coordinator_write_timeouts', counter = True),
+]
+
+# Ratios derived from pairs of counters in the summary: name -> (numerator, denominator)
+# (the denominator is numerator + the second counter)
+RATIOS: Dict[str, Tuple[str, str]] = {
+    'cache_hit_rate': ('cache_row_hits', 'cache_row_misses'),
+}
+
+# `name{labels} value [timestamp]`
+_SAMPLE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{[^}]*\})?\s+(\S+)')
+
+# Aggregates the samples of the given metrics from a Prometheus text exposition: prom_name -> value
+def parse_metrics(text: str, metrics: Sequence[Metric]) -> Dict[str, float]:
+    wanted = {m.prom_name: m for m in metrics}
+    sums: Dict[str, float] = {}
+    counts: Dict[str, int] = {}
+    for line in text.splitlines():
+        if not line or line[0] == '#':
+            continue
+        m = _SAMPLE_RE.match(line)
+        if not m or m.group(1) not in wanted:
+            continue
+        try:
+            v = float(m.group(2))
+        except ValueError:
+            continue
+        if math.isnan(v):
+            continue
+        sums[m.group(1)] = sums.get(m.group(1), 0) + v
+        counts[m.group(1)] = counts.get(m.group(1), 0) + 1
+    return {p: (s / counts[p] if wanted[p].agg == 'avg' else s) for p, s in sums.items()}
+
+def column(cluster: str, node: str, metric: str) -> str:
+    return f'{cluster}/{node}/{metric}'
+
+# Periodically scrapes the Prometheus endpoints of the given nodes (concurrently) and appends
+# the aggregated metrics to `run_path/metrics.col` (see lib/columnar.py); one column per cluster, node and metric.
+# Nodes which don't respond (e.g. paused or restarting) have no values for the round.
+# On `stop`, a summary is written to `run_path/metrics_summary.json` and logged.
+class MetricsScraper:
+    # `clusters`: cluster name (e.g. 'master') -> nodes
+    def __init__(self, logger: logging.Logger, run_path: Path, clusters: Dict[str, Sequence[Node]],
+            interval: float = 5, metrics: Sequence[Metric] = METRICS):
+        self.__logger = logger
+        self.__path = run_path / 'metrics.col'
+        self.__summary_path = run_path / 'metrics_summary.json'
+        self.__interval = interval
+        self.__metrics = list(metrics)
+        self.__targets = [(c, n.ip(), node_endpoints(n.get_node_config()).metrics_url)
+                for c, ns in clusters.items() for n in ns]
+        self.__stop = Event()
+        self.__thread: Optional[Thread] = None
+        self.scrapes = 0
+        self.failures = 0
+        # The last round: its time and column -> value (e.g. for lib/dashboard.py)
+        self.latest: Optional[Tuple[float, Dict[str, float]]] = None
+
+    def start(self) -> None:
+        if self.__thread:
+            return
+        self.__stop.clear()
+        self.__thread = Thread(target = self.__run, daemon = True)
+        self.__thread.start()
+
+    def stop(self) -> None:
+        if not self.__thread:
+            return
+        self.__stop.set()
+        self.__thread.join()
+        self.__thread = None
+        if self.scrapes == 0:
+            return
+        summary = summarize(read_columns(self.__path), self.__metrics)
+        with open(self.__summary_path, 'w') as f:
+            json.dump(summary, f, indent = 1)
+        self.__logger.info('Metrics summary ({} scrapes, {} failed):\n{}'.format(
+            self.scrapes, self.failures, format_summary(summary)))
+
+    def __scrape(self, url: str) -> Optional[Dict[str, float]]:
+        try:
+            r = requests.get(url, timeout = min(self.__interval, 5))
+            if r.status_code != 200:
+                return None
+            return parse_metrics(r.text, self.__metrics)
+        except requests.RequestException:
+            return None
+
+    def __run(self) -> None:
+        with ColumnarWriter(self.__path) as w, ThreadPoolExecutor(max_workers = len(self.__targets)) as ex:
+            next_round = time.monotonic()
+            while not self.__stop.is_set():
+                ts = time.time()
+                results = list(ex.map(lambda t: self.__scrape(t[2]), self.__targets))
+                row: Dict[str, float] = {}
+                for (cluster, ip, _), vals in zip(self.__targets, results):
+                    self.scrapes += 1
+                    if vals is None:
+                        self.failures += 1
+                        continue
+                    for m in self.__metrics:
+                        if m.prom_name in vals:
+                            row[column(cluster, ip, m.name)] = vals[m.prom_name]
+                w.append(ts, row)
+                self.latest = (ts, row)
+                next_round += self.__interval
+                self.__stop.wait(max(0, next_round - time.monotonic()))
+
+# Per-second rate of a counter in each interval between consecutive scrapes; None where it's unknown
+# (a scrape failed or the counter decreased, i.e. the node restarted)
+def _rates(ts: List[float], vals: List[float]) -> List[Optional[float]]:
+    res: List[Optional[float]] = []
+    for i in range(1, len(ts)):
+        a, b = vals[i - 1], vals[i]
+        if math.isnan(a) or math.isnan(b) or b < a or ts[i] <= ts[i - 1]:
+            res.append(None)
+        else:
+            res.append((b - a) / (ts[i] - ts[i - 1]))
+    return res
+
+def _increase(vals: List[float]) -> float:
+    total = 0.0
+    prev: Optional[float] = None
+    for v in vals:
+        if math.isnan(v):
+            continue
+        if prev is not None:
+            total += v - prev if v >= prev else v
+        prev = v
+    return total
+
+def _stats(vals: List[float]) -> Dict[str, float]:
+    if not vals:
+        return {}
+    s = sorted(vals)
+    return {'mean': sum(s) / len(s), 'p50': s[len(s) // 2], 'max': s[-1]}
+
+# cluster -> metric -> statistics. Counters: per-second rates of the cluster (summed over nodes)
+# and the total increase; gauges: per-node values (pooled); ratios: over the whole run.
+def summarize(cols: Dict[str, List[float]], metrics: Sequence[Metric] = METRICS) -> Dict[str, Dict[str, Dict[str, float]]]:
+    ts = cols[TS]
+    by_cluster: Dict[str, Dict[str, Dict[str, List[float]]]] = {}
+    for c, vals in cols.items():
+        if c == TS:
+            continue
+        cluster, node, metric = c.split('/', 2)
+        by_cluster.setdefault(cluster, {}).setdefault(metric, {})[node] = vals
+
+    res: Dict[str, Dict[str, Dict[str, float]]] = {}
+    for cluster, ms in by_cluster.items():
+        out: Dict[str, Dict[str, float]] = {}
+        for m in metrics:
+            nodes = ms.get(m.name)
+            if not nodes:
+                continue
+            if m.counter:
+                per_node = [_rates(ts, vs) for vs in nodes.values()]
+                # rates of the cluster: sum over nodes of the rates of each interval
+                cluster_rates = [sum(r for r in rs if r is not None) for rs in zip(*per_node)
+                        if any(r is not None for r in rs)]
+                out[m.name] = dict(_stats(cluster_rates), total = sum(_increase(vs) for vs in nodes.values()))
+            else:
+                out[m.name] = _stats([v for vs in nodes.values() for v in vs if not math.isnan(v)])
+        for name, (num, other) in RATIOS.items():
+            if num in out and other in out:
+                n, o = out[num]['total'], out[other]['total']
+                if n + o > 0:
+                    out[name] = {'mean': n / (n + o)}
+        res[cluster] = out
+    return res
+
+def format_summary(summary: Dict[str, Dict[str, Dict[str, float]]]) -> str:
+    lines = []
+    for cluster, ms in summary.items():
+        lines.append(f'{cluster}:')
+        for name, st in ms.items():
+            lines.append('  {:24} {}'.format(name, '  '.join(f'{k}={v:.3f}' for k, v in st.items())))
+    return '\n'.join(lines)
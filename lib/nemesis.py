@@ -0,0 +1,171 @@
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+from concurrent.futures import Future
+from dataclasses import dataclass, asdict
+import logging
+import asyncio
+import random
+import json
+import time
+
+from lib.aio import EventLoopThread, sleep_unless
+from lib.node import AsyncNode
+from lib.readiness import Readiness, wait_ready_async
+
+# Nemeses inject faults into the nodes of a cluster. Each kind of nemesis runs as a coroutine on one
+# event loop thread, so different kinds can be active at the same time; a node suffers one fault at a time.
+# The schedule (delays, chosen nodes, pause durations) is drawn from a random generator seeded with
+# the engine's seed, one generator per kind, so a run can be reproduced with the same seed.
+# Every fault is recorded as a JSON line of `run_path/nemesis.jsonl` (see `NemesisEvent`).
+
+KINDS = ['pause', 'restart', 'hard_restart']
+
+@dataclass(frozen=True)
+class NemesisSpec:
+    kind: str
+    # Seconds between the end of one fault and the start of the next one of this kind
+    min_interval: float
+    max_interval: float
+    # How long a pause lasts (seconds)
+    min_duration: float = 0
+    max_duration: float = 0
+
+DEFAULT_SPECS: Dict[str, NemesisSpec] = {
+    'pause': NemesisSpec('pause', 5, 5, 3, 5),
+    'restart': NemesisSpec('restart', 8, 13),
+    'hard_restart': NemesisSpec('hard_restart', 8, 13),
+}
+
+@dataclass(frozen=True)
+class NemesisEvent:
+    kind: str
+    # Sequence number of the fault among the faults of its kind
+    seq: int
+    node: str
+    # Seconds since the epoch: the fault was injected, healed (the node unpaused or started again),
+    # and the node served CQL again (None if it didn't within the timeout)
+    started_at: float
+    ended_at: float
+    recovered_at: Optional[float]
+    # recovered_at - ended_at
+    time_to_recover: Optional[float]
+    # recovered_at - started_at
+    unavailable_for: Optional[float]
+    error: Optional[str] = None
+
+class NemesisEngine:
+    def __init__(self, logger: logging.Logger, run_path: Path, loop: EventLoopThread, nodes: Sequence[AsyncNode],
+            specs: Sequence[NemesisSpec], seed: int, recover_timeout: float = 300):
+        self.__logger = logger
+        self.__path = run_path / 'nemesis.jsonl'
+        self.__loop = loop
+        self.__nodes = nodes
+        self.__specs = specs
+        self.__seed = seed
+        self.__recover_timeout = recover_timeout
+        # The generators keep their state when the engine is stopped and started again
+        self.__rngs = {s.kind: random.Random(f'{seed}:{s.kind}') for s in specs}
+        self.__seqs = {s.kind: 0 for s in specs}
+        self.__stopping: Optional[asyncio.Event] = None
+        self.__locks: Dict[str, asyncio.Lock] = {}
+        self.__f: Optional[Future] = None
+        self.events: List[NemesisEvent] = []
+        # Node -> kind of the fault it's suffering (until it serves CQL again)
+        self.active: Dict[str, str] = {}
+
+    def start(self) -> None:
+        if self.__f:
+            return
+
+        self.__loop.start()
+        self.__logger.info('Nemeses: {} (seed {})'.format(', '.join(s.kind for s in self.__specs), self.__seed))
+        self.__stopping = self.__loop.event()
+        self.__f = self.__loop.submit(self.__run(self.__stopping))
+
+    # Waits until the faults being injected are healed
+    def stop(self) -> None:
+        if not self.__f:
+            return
+
+        assert self.__stopping
+        self.__loop.set(self.__stopping)
+        self.__f.result()
+        self.__stopping = None
+        self.__f = None
+
+    async def __run(self, stopping: asyncio.Event) -> None:
+        if not self.__locks:
+            self.__locks = {n.ip(): asyncio.Lock() for n in self.__nodes}
+        await asyncio.gather(*(self.__nemesis(s, stopping) for s in self.__specs))
+        self.__logger.info('Nemeses: asked to finish')
+
+    async def __nemesis(self, spec: NemesisSpec, stopping: asyncio.Event) -> None:
+        rng = self.__rngs[spec.kind]
+        while True:
+            # Drawn before waiting so that the schedule doesn't depend on when the engine is stopped
+            delay = rng.uniform(spec.min_interval, spec.max_interval)
+            n = rng.choice(self.__nodes)
+            duration = rng.uniform(spec.min_duration, spec.max_duration)
+            if await sleep_unless(stopping, delay):
+                return
+            async with self.__locks[n.ip()]:
+                if stopping.is_set():
+                    return
+                self.__seqs[spec.kind] += 1
+                self.__record(await self.__inject(spec.kind, self.__seqs[spec.kind], n, duration, stopping))
+
+    async def __inject(self, kind: str, seq: int, n: AsyncNode, duration: float, stopping: asyncio.Event) -> NemesisEvent:
+        self.__logger.info(f'Nemesis: {kind} #{seq} of {n.ip()}')
+        self.active[n.ip()] = kind
+        try:
+            return await self.__inject_fault(kind, seq, n, duration, stopping)
+        finally:
+            del self.active[n.ip()]
+
+    async def __inject_fault(self, kind: str, seq: int, n: AsyncNode, duration: float, stopping: asyncio.Event) -> NemesisEvent:
+        error = None
+        started_at = time.time()
+        try:
+            if kind == 'pause':
+                await n.apause()
+                try:
+                    await sleep_unless(stopping, duration)
+                finally:
+                    await n.aunpause()
+            else:
+                await (n.ahard_stop() if kind == 'hard_restart' else n.astop())
+                await n.astart(wait_for = Readiness.PROCESS_UP)
+        except Exception as e:
+            self.__logger.exception(f'Nemesis: {kind} #{seq} of {n.ip()} failed')
+            error = str(e)
+        ended_at = time.time()
+        recovered_at = None
+        if error is None:
+            try:
+                await wait_ready_async(n.get_node_config(), Readiness.CQL_SERVING, self.__recover_timeout)
+                recovered_at = time.time()
+            except TimeoutError:
+                pass
+        return NemesisEvent(kind = kind, seq = seq, node = n.ip(),
+                started_at = started_at, ended_at = ended_at, recovered_at = recovered_at,
+                time_to_recover = None if recovered_at is None else recovered_at - ended_at,
+                unavailable_for = None if recovered_at is None else recovered_at - started_at,
+                error = error)
+
+    def __record(self, e: NemesisEvent) -> None:
+        self.events.append(e)
+        with open(self.__path, 'a') as f:
+            f.write(json.dumps(asdict(e)) + '\n')
+        if e.recovered_at is None:
+            self.__logger.warning(f'Nemesis: {e.kind} #{e.seq} of {e.node}: the node did not recover'
+                    f' in {self.__recover_timeout}s')
+        else:
+            self.__logger.info(f'Nemesis: {e.kind} #{e.seq} of {e.node}: healed after {e.ended_at - e.started_at:.1f}s,'
+                    f' CQL ready {e.time_to_recover:.1f}s later')
+
+def read_events(run_path: Path) -> List[NemesisEvent]:
+    try:
+        with open(run_path / 'nemesis.jsonl') as f:
+            return [NemesisEvent(**json.loads(l)) for l in f if l.strip()]
+    except FileNotFoundError:
+        return []
@@ -1,16 +1,26 @@
-from typing import Protocol
+from typing import Protocol, Optional
 from abc import abstractmethod
 from pathlib import Path
 
 from lib.node_config import NodeConfig
+from lib.readiness import Readiness, DEFAULT_START_TIMEOUT
+
+class StartupFailed(Exception):
+    """
+    The node's server process exited before finishing initialization,
+    e.g. because the cluster rejected its bootstrap.
+    """
+    pass
 
 class Node(Protocol):
     # TODO: state which methods cannot be run in parallel
     # require the implementations to detect such parallel runs and throw errors
     @abstractmethod
-    def start(self) -> None:
+    def start(self, wait_for: Readiness = Readiness.CQL_SERVING, timeout: Optional[float] = DEFAULT_START_TIMEOUT) -> None:
         """
-        Start the node and wait for initialization.
+        Start the node and wait until it reaches the `wait_for` readiness level.
+        Raises `StartupFailed` if the server process exits before that,
+        `TimeoutError` if it doesn't happen in `timeout` seconds (None: wait indefinitely).
         """
         # TODO: does nothing if the node is already running
         raise NotImplementedError
@@ -88,3 +98,70 @@ class Node(Protocol):
         Ensure that the binary is compatible with the OS on which the node is running.
         """
         raise NotImplementedError
+
+class AsyncNode(Protocol):
+    """
+    Coroutine variants of the `Node` lifecycle operations (named after them with an `a` prefix),
+    so that many nodes can be managed from a single event loop.
+    They don't block the event loop while waiting for the node.
+    Cancelling an operation stops waiting but doesn't undo what was already done
+    (e.g. the server process started by a cancelled `astart` keeps running and can be stopped with `astop`).
+    """
+
+    @abstractmethod
+    async def astart(self, wait_for: Readiness = Readiness.CQL_SERVING, timeout: Optional[float] = DEFAULT_START_TIMEOUT) -> None:
+        """
+        See `Node.start`.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def astop(self) -> None:
+        """
+        See `Node.stop`.
+        """
+        raise NotImplementedError
+
+    async def arestart(self) -> None:
+        """
+        See `Node.restart`.
+        """
+        await self.astop()
+        await self.astart()
+
+    async def apause(self) -> None:
+        """
+        See `Node.pause`.
+        """
+        raise NotImplementedError
+
+    async def aunpause(self) -> None:
+        """
+        See `Node.unpause`.
+        """
+        raise NotImplementedError
+
+    async def ahard_stop(self) -> None:
+        """
+        See `Node.hard_stop`.
+        """
+        raise NotImplementedError
+
+    async def ahard_restart(self) -> None:
+        """
+        See `Node.hard_restart`.
+        """
+        await self.ahard_stop()
+        await self.astart()
+
+    def ip(self) -> str:
+        """
+        Return the node's public IP.
+        """
+        raise NotImplementedError
+
+    def get_node_config(self) -> NodeConfig:
+        """
+        See `Node.get_node_config`.
+        """
+        raise NotImplementedError
@@ -15,6 +15,10 @@ class NodeConfig:
 class SeastarOpts:
     smp: int = 3
     overprovisioned: bool = False
+    # CPUs the node may run on, e.g. '2-4,10'; None: any (see lib/host_resources.py)
+    cpuset: Optional[str] = None
+    # Memory given to the node, e.g. '2048M'; None: Seastar's default (almost all of the host's memory)
+    memory: Optional[str] = None
 
 @dataclass(frozen=True)
 class ScyllaOpts:
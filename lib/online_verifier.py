@@ -0,0 +1,198 @@
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from dataclasses import dataclass, asdict
+from threading import Thread, Event
+import datetime
+import logging
+import random
+import heapq
+import json
+import time
+
+from cassandra import DriverException # type: ignore
+from cassandra.cluster import Session, NoHostAvailable # type: ignore
+
+from lib.cdc import Change, ChangeReader, generation_timestamps, generation_streams
+
+@dataclass(frozen=True)
+class VerifierConfig:
+    # Seconds between sampling rounds
+    sample_interval: float = 5
+    # Number of changes sampled from the CDC log per round
+    samples_per_round: int = 10
+    # How long the replicator gets to apply a change before the replica is checked (seconds).
+    # Must be longer than the replication lag expected during the run, or mismatches will be reported.
+    grace: float = 30
+    # At most this many checks (each reads a row from both clusters) are done per second
+    max_checks_per_s: float = 10
+    # New samples are dropped while this many checks are pending
+    max_pending: int = 500
+    # A mismatching row is checked again after another grace period at most this many times
+    # if the master's row keeps changing in the meantime
+    max_attempts: int = 3
+    seed: Optional[int] = None
+
+@dataclass(frozen=True)
+class Mismatch:
+    table: str
+    stream_id: str
+    key: str
+    # `cdc$time` of the sampled change
+    change_time: str
+    # When the mismatch was confirmed (seconds since the epoch)
+    detected_at: float
+    master: str
+    replica: str
+
+@dataclass
+class _Check:
+    change: Change
+    attempts: int = 0
+    # The master's rows when the replica was first seen to differ
+    master_rows: Optional[List[Tuple[Any, ...]]] = None
+
+# Verifies replication while the test is running.
+# Periodically samples recent changes from the master's CDC log (newest changes of randomly chosen streams
+# of the current CDC generation) and, after a grace period, compares the affected rows on both clusters.
+# When the replica differs, the row is checked again after another grace period; if the master's row
+# didn't change in the meantime and the replica still differs, a mismatch is reported: logged,
+# appended to `run_path/online_verifier.jsonl`, and `diverged` is set.
+# The amount of work is bounded by the sampling rate, `max_checks_per_s` and `max_pending`.
+# Failed queries and unexpected errors of a check are counted in `stats['errors']`; if the verifier's thread
+# dies anyway, `crashed` is set when it's stopped, so that the run isn't considered verified.
+class OnlineVerifier:
+    # `master`'s cluster metadata must contain the schema of `tables`
+    def __init__(self, logger: logging.Logger, run_path: Path, master: Session, replica: Session,
+            keyspace: str, tables: Sequence[str], cfg: VerifierConfig = VerifierConfig()):
+        self.__logger = logger
+        self.__path = run_path / 'online_verifier.jsonl'
+        self.__master = master
+        self.__replica = replica
+        self.__cfg = cfg
+        self.__readers = [ChangeReader(master, replica, keyspace, t) for t in tables]
+        self.__rng = random.Random(cfg.seed)
+        self.__stop = Event()
+        self.__thread: Optional[Thread] = None
+
+        # (due time, sequence number, check)
+        self.__pending: List[Tuple[float, int, _Check]] = []
+        self.__seq = 0
+        self.__streams: List[bytes] = []
+        self.__streams_refreshed = 0.0
+        # (table, stream ID) -> time of the newest change sampled from the stream
+        self.__sampled: Dict[Tuple[str, bytes], int] = {}
+
+        self.diverged = Event()
+        self.crashed = False
+        self.mismatches: List[Mismatch] = []
+        self.stats: Dict[str, int] = {'sampled': 0, 'dropped': 0, 'checked': 0, 'inconclusive': 0, 'errors': 0}
+
+    def start(self) -> None:
+        if self.__thread:
+            return
+        self.__stop.clear()
+        self.__thread = Thread(target = self.__run, daemon = True)
+        self.__thread.start()
+
+    def stop(self) -> None:
+        if not self.__thread:
+            return
+        if not self.__thread.is_alive():
+            self.crashed = True
+        self.__stop.set()
+        self.__thread.join()
+        self.__thread = None
+        if self.crashed:
+            self.__logger.error(f'Online verifier: stopped working before the end of the run; {self.summary()}')
+        else:
+            self.__logger.info(f'Online verifier: {self.summary()}')
+
+    def summary(self) -> str:
+        return '{} mismatches; {}'.format(len(self.mismatches), ', '.join(f'{k}: {v}' for k, v in self.stats.items()))
+
+    def __run(self) -> None:
+        next_sample = time.time()
+        while not self.__stop.is_set():
+            now = time.time()
+            if now >= next_sample:
+                self.__guard(self.__sample)
+                next_sample = now + self.__cfg.sample_interval
+            if self.__pending and self.__pending[0][0] <= now:
+                _, _, c = heapq.heappop(self.__pending)
+                self.__guard(lambda: self.__check(c))
+                self.__stop.wait(1 / self.__cfg.max_checks_per_s)
+                continue
+            wake = min(next_sample, self.__pending[0][0]) if self.__pending else next_sample
+            self.__stop.wait(max(0, min(1, wake - time.time())))
+
+    def __guard(self, f) -> None:
+        try:
+            f()
+        except (DriverException, NoHostAvailable) as e:
+            self.stats['errors'] += 1
+            self.__logger.debug(f'Online verifier: query failed: {e}')
+        except Exception:
+            self.stats['errors'] += 1
+            self.__logger.exception('Online verifier: unexpected error')
+
+    def __push(self, due: float, c: _Check) -> None:
+        self.__seq += 1
+        heapq.heappush(self.__pending, (due, self.__seq, c))
+
+    def __refresh_streams(self) -> None:
+        now = datetime.datetime.utcnow()
+        started = [g for g in generation_timestamps(self.__master) if g <= now]
+        if started:
+            self.__streams = generation_streams(self.__master, started[-1])
+        self.__streams_refreshed = time.time()
+
+    def __sample(self) -> None:
+        if not self.__streams or time.time() - self.__streams_refreshed > 30:
+            self.__refresh_streams()
+        if not self.__streams:
+            return
+        for _ in range(self.__cfg.samples_per_round):
+            if len(self.__pending) >= self.__cfg.max_pending:
+                self.stats['dropped'] += 1
+                continue
+            t = self.__rng.choice(self.__readers)
+            sid = self.__rng.choice(self.__streams)
+            c = t.newest_change(sid, self.__master.execute(t.newest, (sid,)))
+            if c is None or c.time_us <= self.__sampled.get((t.table, sid), 0):
+                continue
+            self.__sampled[(t.table, sid)] = c.time_us
+            self.stats['sampled'] += 1
+            self.__push(c.time_us / 1e6 + self.__cfg.grace, _Check(change = c))
+
+    def __check(self, chk: _Check) -> None:
+        c = chk.change
+        t = next(r for r in self.__readers if r.table == c.table)
+        self.stats['checked'] += 1
+        master_rows = [tuple(r) for r in self.__master.execute(t.affected(c, replica = False), c.key)]
+        replica_rows = [tuple(r) for r in self.__replica.execute(t.affected(c, replica = True), c.key)]
+        if master_rows == replica_rows:
+            return
+
+        if chk.master_rows is not None and chk.master_rows == master_rows:
+            self.__report(c, master_rows, replica_rows)
+            return
+
+        # The master's row changed (or this is the first check): give the replicator another grace period
+        chk.attempts += 1
+        if chk.attempts > self.__cfg.max_attempts:
+            self.stats['inconclusive'] += 1
+            return
+        chk.master_rows = master_rows
+        self.__push(time.time() + self.__cfg.grace, chk)
+
+    def __report(self, c: Change, master_rows: List[Tuple[Any, ...]], replica_rows: List[Tuple[Any, ...]]) -> None:
+        m = Mismatch(
+            table = c.table, stream_id = '0x' + c.stream_id.hex(), key = repr(c.key),
+            change_time = datetime.datetime.utcfromtimestamp(c.time_us / 1e6).isoformat(),
+            detected_at = time.time(), master = repr(master_rows), replica = repr(replica_rows))
+        self.mismatches.append(m)
+        with open(self.__path, 'a') as f:
+            f.write(json.dumps(asdict(m)) + '\n')
+        self.__logger.error(f'Online verifier: replica differs from master for {m.table} {m.key}'
+                f' (stream {m.stream_id}, change at {m.change_time}):\n  master:  {m.master}\n  replica: {m.replica}')
+        self.diverged.set()
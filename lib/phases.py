@@ -0,0 +1,41 @@
+from pathlib import Path
+from typing import Iterator, List
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+import logging
+import json
+import time
+
+@dataclass(frozen=True)
+class Phase:
+    name: str
+    # Seconds since the epoch
+    started_at: float
+    duration: float
+
+# Measures how long the phases of a test take.
+# Each finished phase is logged and appended as a JSON line to `run_path/phases.jsonl`.
+class PhaseTimer:
+    def __init__(self, logger: logging.Logger, run_path: Path):
+        self.__logger = logger
+        self.__path = run_path / 'phases.jsonl'
+        self.phases: List[Phase] = []
+
+    # Use as `with timer.phase('...'): ...`.
+    # The phase is recorded even if the block raises.
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started_at = time.time()
+        start = time.monotonic()
+        self.__logger.info(f'Phase started: {name}')
+        try:
+            yield
+        finally:
+            p = Phase(name = name, started_at = started_at, duration = time.monotonic() - start)
+            self.phases.append(p)
+            with open(self.__path, 'a') as f:
+                f.write(json.dumps(asdict(p)) + '\n')
+            self.__logger.info(f'Phase finished: {name} ({p.duration:.1f}s)')
+
+    def summary(self) -> str:
+        return '\n'.join(f'{p.duration:8.1f}s  {p.name}' for p in self.phases)
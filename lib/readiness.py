@@ -0,0 +1,167 @@
+from typing import Callable, Optional, Sequence
+from dataclasses import dataclass
+from enum import IntEnum
+import asyncio
+import socket
+import json
+import time
+import requests
+
+from lib.node_config import NodeConfig, mk_node_cfg
+
+# Default time to wait for a node to become ready (booting may include waiting for gossip to settle,
+# streaming data and so on)
+DEFAULT_START_TIMEOUT: float = 600
+
+class Readiness(IntEnum):
+    # The node's REST API responds
+    PROCESS_UP = 1
+    # The node finished joining the ring (its operation mode is NORMAL)
+    GOSSIP_SETTLED = 2
+    # The CQL server is running and accepts connections
+    CQL_SERVING = 3
+
+@dataclass(frozen=True)
+class NodeEndpoints:
+    api_url: str
+    cql_host: str
+    cql_port: int
+    # Prometheus metrics (text exposition format)
+    metrics_url: str
+
+def node_endpoints(cfg: NodeConfig) -> NodeEndpoints:
+    c = mk_node_cfg(cfg)
+    return NodeEndpoints(
+        api_url = f"http://{c['api_address']}:{c.get('api_port', 10000)}",
+        cql_host = c['rpc_address'],
+        cql_port = int(c.get('native_transport_port', 9042)),
+        metrics_url = f"http://{c['prometheus_address']}:{c.get('prometheus_port', 9180)}/metrics")
+
+# Each probe must give an answer quickly: a node that doesn't answer within this time is considered not ready
+PROBE_TIMEOUT: float = 1
+
+def api_get(ep: NodeEndpoints, path: str) -> Optional[object]:
+    try:
+        r = requests.get(ep.api_url + path, timeout = PROBE_TIMEOUT)
+        if r.status_code != 200:
+            return None
+        return r.json()
+    except (requests.RequestException, ValueError):
+        return None
+
+def accepts_connections(host: str, port: int) -> bool:
+    try:
+        with socket.create_connection((host, port), timeout = PROBE_TIMEOUT):
+            return True
+    except OSError:
+        return False
+
+# Returns the highest readiness level reached by the node, or None if its REST API doesn't respond.
+def current_readiness(ep: NodeEndpoints) -> Optional[Readiness]:
+    mode = api_get(ep, '/storage_service/operation_mode')
+    if mode is None:
+        return None
+    if mode != 'NORMAL':
+        return Readiness.PROCESS_UP
+    if api_get(ep, '/storage_service/native_transport') is not True or not accepts_connections(ep.cql_host, ep.cql_port):
+        return Readiness.GOSSIP_SETTLED
+    return Readiness.CQL_SERVING
+
+# Waits until the node described by `cfg` reaches readiness `level` and returns True.
+# `alive` is checked between probes; if it returns False (the server process exited), returns False.
+# Raises `TimeoutError` if the node doesn't become ready in `timeout` seconds.
+def wait_ready(cfg: NodeConfig, level: Readiness = Readiness.CQL_SERVING,
+        timeout: Optional[float] = DEFAULT_START_TIMEOUT, alive: Optional[Callable[[], bool]] = None) -> bool:
+    ep = node_endpoints(cfg)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    delay = 0.05
+    while True:
+        r = current_readiness(ep)
+        if r is not None and r >= level:
+            return True
+        if alive is not None and not alive():
+            return False
+        if deadline is not None and time.monotonic() >= deadline:
+            raise TimeoutError('Node {} did not reach readiness level {} in {}s (current: {})'.format(
+                cfg.ip_addr, level.name, timeout, r.name if r is not None else 'not responding'))
+        time.sleep(delay if deadline is None else max(0, min(delay, deadline - time.monotonic())))
+        delay = min(delay * 2, 1.0)
+
+# Whether every node of the cluster sees all its nodes (`ips`) as alive in gossip
+def gossip_all_up(eps: Sequence[NodeEndpoints], ips: Sequence[str]) -> bool:
+    for ep in eps:
+        live = api_get(ep, '/gossiper/endpoint/live')
+        down = api_get(ep, '/gossiper/endpoint/down')
+        if not isinstance(live, list) or not isinstance(down, list) or down:
+            return False
+        if set(ips) - set(live) - {ep.cql_host}:
+            return False
+    return True
+
+# Whether all the nodes have the same schema version
+def schema_agreement(eps: Sequence[NodeEndpoints]) -> bool:
+    versions = [api_get(ep, '/storage_service/schema_version') for ep in eps]
+    return None not in versions and len(set(map(str, versions))) == 1
+
+# Async probes: a probe doesn't block the event loop, so many nodes can be probed from one thread
+
+async def api_get_async(ep: NodeEndpoints, path: str) -> Optional[object]:
+    host, port = ep.api_url[len('http://'):].rsplit(':', 1)
+    try:
+        async def get() -> bytes:
+            reader, writer = await asyncio.open_connection(host, int(port))
+            try:
+                writer.write(f'GET {path} HTTP/1.0\r\nHost: {host}\r\n\r\n'.encode())
+                await writer.drain()
+                return await reader.read()
+            finally:
+                writer.close()
+        resp = await asyncio.wait_for(get(), PROBE_TIMEOUT)
+    except (OSError, asyncio.TimeoutError):
+        return None
+    head, _, body = resp.partition(b'\r\n\r\n')
+    status = head.split(b'\r\n', 1)[0].split()
+    if len(status) < 2 or status[1] != b'200':
+        return None
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+async def accepts_connections_async(host: str, port: int) -> bool:
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), PROBE_TIMEOUT)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
+
+async def current_readiness_async(ep: NodeEndpoints) -> Optional[Readiness]:
+    mode = await api_get_async(ep, '/storage_service/operation_mode')
+    if mode is None:
+        return None
+    if mode != 'NORMAL':
+        return Readiness.PROCESS_UP
+    if (await api_get_async(ep, '/storage_service/native_transport') is not True
+            or not await accepts_connections_async(ep.cql_host, ep.cql_port)):
+        return Readiness.GOSSIP_SETTLED
+    return Readiness.CQL_SERVING
+
+# `wait_ready` for coroutines. Cancelling it only stops waiting.
+async def wait_ready_async(cfg: NodeConfig, level: Readiness = Readiness.CQL_SERVING,
+        timeout: Optional[float] = DEFAULT_START_TIMEOUT, alive: Optional[Callable[[], bool]] = None) -> bool:
+    ep = node_endpoints(cfg)
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+    delay = 0.05
+    while True:
+        r = await current_readiness_async(ep)
+        if r is not None and r >= level:
+            return True
+        if alive is not None and not alive():
+            return False
+        if deadline is not None and loop.time() >= deadline:
+            raise TimeoutError('Node {} did not reach readiness level {} in {}s (current: {})'.format(
+                cfg.ip_addr, level.name, timeout, r.name if r is not None else 'not responding'))
+        await asyncio.sleep(delay if deadline is None else max(0, min(delay, deadline - loop.time())))
+        delay = min(delay * 2, 1.0)
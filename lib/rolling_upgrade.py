@@ -0,0 +1,118 @@
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence, Union
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+import logging
+import json
+import time
+
+from lib.node import Node
+from lib.common import wait_until
+from lib.readiness import Readiness, node_endpoints, wait_ready, gossip_all_up, schema_agreement
+
+# Rolling upgrade of a cluster: nodes are upgraded in steps of `parallelism` nodes at a time (stopped,
+# changed by the given function, e.g. to use another Scylla binary, and started again). After each step
+# the cluster must pass the gates before the next step begins:
+# - 'cql': every node serves CQL,
+# - 'gossip': every node sees all the nodes as UP,
+# - 'schema': all the nodes agree on the schema version.
+# Each node's downtime (from being stopped until it serves CQL again) and every step are saved
+# as JSON lines in `run_path/upgrade.jsonl`.
+
+GATES = ['cql', 'gossip', 'schema']
+
+@dataclass(frozen=True)
+class NodeUpgrade:
+    ip: str
+    step: int
+    # Seconds since the epoch
+    stopped_at: float
+    serving_at: float
+    downtime: float
+
+@dataclass(frozen=True)
+class UpgradeStep:
+    step: int
+    ips: List[str]
+    started_at: float
+    # Until the gates passed
+    duration: float
+    # How long the gates took
+    gates_duration: float
+
+@dataclass(frozen=True)
+class UpgradeReport:
+    started_at: float
+    wall_time: float
+    parallelism: int
+    steps: List[UpgradeStep]
+    nodes: List[NodeUpgrade]
+
+    def summary(self) -> str:
+        lines = [f'step {s.step}: {", ".join(s.ips)} in {s.duration:.1f}s (gates {s.gates_duration:.1f}s)' for s in self.steps]
+        lines.extend(f'{n.ip}: down for {n.downtime:.1f}s' for n in self.nodes)
+        lines.append(f'total: {self.wall_time:.1f}s')
+        return '\n'.join(lines)
+
+def wait_gates(logger: logging.Logger, nodes: Sequence[Node], gates: Sequence[str], timeout: Optional[float]) -> None:
+    eps = [node_endpoints(n.get_node_config()) for n in nodes]
+    ips = [n.ip() for n in nodes]
+    deadline = None if timeout is None else time.monotonic() + timeout
+    remaining = lambda: None if deadline is None else max(0, deadline - time.monotonic())
+    if 'cql' in gates:
+        for n in nodes:
+            wait_ready(n.get_node_config(), Readiness.CQL_SERVING, remaining())
+    if 'gossip' in gates:
+        wait_until(lambda: gossip_all_up(eps, ips), remaining(), 'all nodes to see each other UP')
+    if 'schema' in gates:
+        wait_until(lambda: schema_agreement(eps), remaining(), 'schema agreement')
+    logger.info(f'Gates passed: {", ".join(gates)}')
+
+def _record(run_path: Path, kind: str, obj: Union[NodeUpgrade, UpgradeStep]) -> None:
+    with open(run_path / 'upgrade.jsonl', 'a') as f:
+        f.write(json.dumps(dict(asdict(obj), type = kind)) + '\n')
+
+# Upgrades `nodes` (all the nodes of the cluster) in the given order (indexes into `nodes`).
+# `upgrade` is called for every stopped node; `before_step` (if given) before every step with the step's nodes.
+def rolling_upgrade(logger: logging.Logger, run_path: Path, nodes: Sequence[Node], order: Sequence[int],
+        upgrade: Callable[[Node], None], parallelism: int = 1, gates: Sequence[str] = GATES,
+        gate_timeout: Optional[float] = 300,
+        before_step: Optional[Callable[[int, Sequence[Node]], None]] = None) -> UpgradeReport:
+    assert parallelism >= 1
+    started_at = time.time()
+    start = time.monotonic()
+    steps: List[UpgradeStep] = []
+    upgraded: List[NodeUpgrade] = []
+
+    def upgrade_node(n: Node, step: int) -> NodeUpgrade:
+        logger.info(f'Stopping node {n.ip()}...')
+        stopped_at = time.time()
+        n.stop()
+        upgrade(n)
+        logger.info(f'Restarting node {n.ip()}...')
+        n.start(wait_for = Readiness.CQL_SERVING)
+        serving_at = time.time()
+        logger.info(f'Node {n.ip()} upgraded, down for {serving_at - stopped_at:.1f}s.')
+        return NodeUpgrade(ip = n.ip(), step = step, stopped_at = stopped_at, serving_at = serving_at,
+                downtime = serving_at - stopped_at)
+
+    with ThreadPoolExecutor(max_workers = parallelism) as ex:
+        for step, i in enumerate(range(0, len(order), parallelism)):
+            batch = [nodes[j] for j in order[i:i + parallelism]]
+            if before_step:
+                before_step(step, batch)
+            logger.info(f'Upgrade step {step}: {[n.ip() for n in batch]}')
+            step_start = time.monotonic()
+            step_started_at = time.time()
+            for u in ex.map(lambda n: upgrade_node(n, step), batch):
+                upgraded.append(u)
+                _record(run_path, 'node', u)
+            gates_start = time.monotonic()
+            wait_gates(logger, nodes, gates, gate_timeout)
+            s = UpgradeStep(step = step, ips = [n.ip() for n in batch], started_at = step_started_at,
+                    duration = time.monotonic() - step_start, gates_duration = time.monotonic() - gates_start)
+            steps.append(s)
+            _record(run_path, 'step', s)
+
+    return UpgradeReport(started_at = started_at, wall_time = time.monotonic() - start, parallelism = parallelism,
+            steps = steps, nodes = upgraded)
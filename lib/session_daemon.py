@@ -0,0 +1,255 @@
+from pathlib import Path
+from typing import Any, List, Optional, Sequence
+from dataclasses import dataclass
+from decimal import Decimal
+import socketserver
+import threading
+import tempfile
+import datetime
+import logging
+import socket
+import struct
+import json
+import time
+import uuid
+import os
+
+from lib.sessions import SessionPool, consistency_level
+
+# A local daemon keeping a `SessionPool` warm for short-lived tools (e.g. the snippets): they send queries
+# over a Unix socket instead of bootstrapping the driver (connecting, fetching the topology and schema)
+# on every invocation. Without a running daemon, `execute` falls back to a session of the calling process.
+# Requests and responses are length-prefixed JSON (values the driver returns which JSON can't represent are
+# tagged, see `_encode`). The socket lives in a directory only accessible to its owner, and both sides
+# talk only to peers running as the same user.
+
+def _default_socket() -> Path:
+    if 'SCYLLA_TEST_SESSIOND_SOCKET' in os.environ:
+        return Path(os.environ['SCYLLA_TEST_SESSIOND_SOCKET'])
+    if 'XDG_RUNTIME_DIR' in os.environ:
+        return Path(os.environ['XDG_RUNTIME_DIR']) / 'scylla-test-sessiond.sock'
+    return Path(tempfile.gettempdir()) / f'scylla-test-{os.getuid()}' / 'sessiond.sock'
+
+DEFAULT_SOCKET = _default_socket()
+
+@dataclass(frozen=True)
+class Rows:
+    column_names: List[str]
+    rows: List[tuple]
+
+# JSON-compatible representation of query arguments and results
+def _encode(v: Any) -> Any:
+    if v is None or isinstance(v, (bool, int, float, str)):
+        return v
+    if isinstance(v, (bytes, bytearray, memoryview)):
+        return {'$bytes': bytes(v).hex()}
+    if isinstance(v, uuid.UUID):
+        return {'$uuid': str(v)}
+    if isinstance(v, datetime.datetime):
+        return {'$datetime': v.isoformat()}
+    if isinstance(v, datetime.date):
+        return {'$date': v.isoformat()}
+    if isinstance(v, datetime.time):
+        return {'$time': v.isoformat()}
+    if isinstance(v, Decimal):
+        return {'$decimal': str(v)}
+    if isinstance(v, list):
+        return [_encode(x) for x in v]
+    # Tuples, and UDT values (named tuples)
+    if isinstance(v, tuple):
+        return {'$tuple': [_encode(x) for x in v]}
+    if isinstance(v, (set, frozenset)) or type(v).__name__ == 'SortedSet':
+        return {'$set': [_encode(x) for x in v]}
+    if hasattr(v, 'items'):
+        return {'$map': [[_encode(k), _encode(x)] for k, x in v.items()]}
+    # e.g. cassandra.util.Duration
+    return str(v)
+
+def _decode(v: Any) -> Any:
+    if isinstance(v, list):
+        return [_decode(x) for x in v]
+    if not isinstance(v, dict):
+        return v
+    (tag, x), = v.items()
+    if tag == '$bytes':
+        return bytes.fromhex(x)
+    if tag == '$uuid':
+        return uuid.UUID(x)
+    if tag == '$datetime':
+        return datetime.datetime.fromisoformat(x)
+    if tag == '$date':
+        return datetime.date.fromisoformat(x)
+    if tag == '$time':
+        return datetime.time.fromisoformat(x)
+    if tag == '$decimal':
+        return Decimal(x)
+    if tag == '$tuple':
+        return tuple(_decode(y) for y in x)
+    if tag == '$set':
+        return {_decode(y) for y in x}
+    if tag == '$map':
+        return {_decode(k): _decode(y) for k, y in x}
+    raise ValueError(f'Unknown tag {tag}')
+
+# The user running the process at the other end of `sock`
+def _peer_uid(sock: socket.socket) -> int:
+    pid, uid, gid = struct.unpack('3i', sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i')))
+    return uid
+
+def _send(sock: socket.socket, obj: Any) -> None:
+    data = json.dumps(obj).encode()
+    sock.sendall(struct.pack('!I', len(data)) + data)
+
+def _recv_exactly(sock: socket.socket, n: int) -> Optional[bytes]:
+    buf = b''
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            return None
+        buf += chunk
+    return buf
+
+def _recv(sock: socket.socket) -> Any:
+    header = _recv_exactly(sock, 4)
+    if header is None:
+        return None
+    data = _recv_exactly(sock, struct.unpack('!I', header)[0])
+    return None if data is None else json.loads(data)
+
+def _rows(rs: Any) -> Rows:
+    return Rows(column_names = list(rs.column_names or []), rows = [tuple(r) for r in rs])
+
+def _encode_rows(r: Rows) -> dict:
+    return {'column_names': r.column_names, 'rows': [[_encode(v) for v in row] for row in r.rows]}
+
+def _decode_rows(d: dict) -> Rows:
+    return Rows(column_names = d['column_names'], rows = [tuple(_decode(v) for v in row) for row in d['rows']])
+
+def _execute(pool: SessionPool, hosts: Sequence[str], query: str, args: Sequence[Any], consistency: Optional[str]) -> Rows:
+    return _rows(pool.execute(hosts, query, args, consistency_level(consistency)))
+
+def _execute_many(pool: SessionPool, hosts: Sequence[str], query: str, args_list: Sequence[Sequence[Any]],
+        consistency: Optional[str], concurrency: int) -> List[Rows]:
+    return [_rows(rs) for rs in pool.execute_many(hosts, query, args_list, consistency_level(consistency), concurrency)]
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        server: SessionDaemon = self.server # type: ignore
+        if _peer_uid(self.connection) != os.getuid():
+            return
+        while True:
+            req = _recv(self.connection)
+            if req is None:
+                return
+            server.touch()
+            if req['op'] == 'stop':
+                _send(self.connection, {'ok': True})
+                threading.Thread(target = server.shutdown).start()
+                return
+            if req['op'] == 'ping':
+                _send(self.connection, {'ok': True})
+                continue
+            try:
+                if req['op'] == 'execute_many':
+                    rows: Any = [_encode_rows(r) for r in _execute_many(server.pool, req['hosts'], req['query'],
+                            _decode(req['args_list']), req['consistency'], req['concurrency'])]
+                else:
+                    rows = _encode_rows(_execute(server.pool, req['hosts'], req['query'], _decode(req['args']),
+                            req['consistency']))
+                res = {'ok': True, 'rows': rows}
+            except Exception as e:
+                server.logger.warning(f'{req["query"]} on {req["hosts"]} failed: {e}')
+                res = {'ok': False, 'error': f'{type(e).__name__}: {e}'}
+            _send(self.connection, res)
+
+class SessionDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    # Exits after `idle_timeout` seconds without requests (None: never)
+    def __init__(self, logger: logging.Logger, path: Path, idle_timeout: Optional[float]):
+        path.parent.mkdir(mode = 0o700, parents = True, exist_ok = True)
+        if path.exists():
+            if path.lstat().st_uid != os.getuid():
+                raise RuntimeError(f'{path} belongs to another user')
+            if ping(path):
+                raise RuntimeError(f'A session daemon is already listening on {path}')
+            path.unlink()
+        old = os.umask(0o077)
+        try:
+            super().__init__(str(path), _Handler)
+        finally:
+            os.umask(old)
+        self.logger = logger
+        self.pool = SessionPool()
+        self.__path = path
+        self.__idle_timeout = idle_timeout
+        self.__last = time.monotonic()
+
+    def touch(self) -> None:
+        self.__last = time.monotonic()
+
+    def service_actions(self) -> None:
+        if self.__idle_timeout is not None and time.monotonic() - self.__last > self.__idle_timeout:
+            self.logger.info(f'No requests for {self.__idle_timeout}s, exiting')
+            threading.Thread(target = self.shutdown).start()
+
+    def run(self) -> None:
+        self.logger.info(f'Listening on {self.__path}')
+        try:
+            self.serve_forever(poll_interval = 1)
+        finally:
+            self.server_close()
+            self.__path.unlink(missing_ok = True)
+            self.pool.close()
+
+# None if there's no daemon of this user listening on `path`
+def _request(path: Path, req: dict) -> Optional[dict]:
+    try:
+        if path.lstat().st_uid != os.getuid():
+            return None
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(str(path))
+            if _peer_uid(s) != os.getuid():
+                return None
+            _send(s, req)
+            return _recv(s)
+    except (FileNotFoundError, ConnectionRefusedError, PermissionError):
+        return None
+
+def ping(path: Path = DEFAULT_SOCKET) -> bool:
+    return _request(path, {'op': 'ping'}) is not None
+
+# Returns whether a daemon was running
+def stop(path: Path = DEFAULT_SOCKET) -> bool:
+    return _request(path, {'op': 'stop'}) is not None
+
+_local: Optional[SessionPool] = None
+
+def _local_pool() -> SessionPool:
+    global _local
+    if _local is None:
+        _local = SessionPool()
+    return _local
+
+# Runs `query` (prepared, with `args` bound) on the cluster of `hosts`: through the daemon listening
+# on `path` if there is one, otherwise on a session of this process. Raises `RuntimeError` if it fails on the daemon.
+def execute(hosts: Sequence[str], query: str, args: Sequence[Any] = (), consistency: Optional[str] = None,
+        path: Path = DEFAULT_SOCKET) -> Rows:
+    res = _request(path, {'op': 'execute', 'hosts': list(hosts), 'query': query, 'args': _encode(list(args)),
+                          'consistency': consistency})
+    if res is None:
+        return _execute(_local_pool(), hosts, query, args, consistency)
+    if not res['ok']:
+        raise RuntimeError(res['error'])
+    return _decode_rows(res['rows'])
+
+# Like `execute`, for every element of `args_list`, with up to `concurrency` requests in flight
+def execute_many(hosts: Sequence[str], query: str, args_list: Sequence[Sequence[Any]], consistency: Optional[str] = None,
+        concurrency: int = 64, path: Path = DEFAULT_SOCKET) -> List[Rows]:
+    res = _request(path, {'op': 'execute_many', 'hosts': list(hosts), 'query': query,
+                          'args_list': [_encode(list(a)) for a in args_list], 'consistency': consistency, 'concurrency': concurrency})
+    if res is None:
+        return _execute_many(_local_pool(), hosts, query, args_list, consistency, concurrency)
+    if not res['ok']:
+        raise RuntimeError(res['error'])
+    return [_decode_rows(r) for r in res['rows']]
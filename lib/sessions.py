@@ -0,0 +1,75 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import threading
+
+from cassandra.cluster import Cluster, Session, ExecutionProfile, EXEC_PROFILE_DEFAULT # type: ignore
+from cassandra.concurrent import execute_concurrent_with_args # type: ignore
+from cassandra import ConsistencyLevel, policies # type: ignore
+
+# Long-lived driver connections: one token-aware `Cluster` and `Session` per set of contact points, created
+# on first use and kept until the pool is closed, and a cache of statements prepared on them.
+# Sessions are thread-safe, so the whole harness can share them instead of connecting again for every phase.
+
+def _key(hosts: Sequence[str]) -> Tuple[str, ...]:
+    return tuple(sorted(set(hosts)))
+
+class SessionPool:
+    # `cluster_opts` are passed to every `Cluster` (e.g. `control_connection_timeout`)
+    def __init__(self, **cluster_opts: Any):
+        self.__opts = dict(protocol_version = 4, execution_profiles = {EXEC_PROFILE_DEFAULT: ExecutionProfile(
+            load_balancing_policy = policies.TokenAwarePolicy(policies.DCAwareRoundRobinPolicy()))})
+        self.__opts.update(cluster_opts)
+        self.__lock = threading.Lock()
+        self.__sessions: Dict[Tuple[str, ...], Session] = {}
+        self.__prepared: Dict[Tuple[Tuple[str, ...], str, Optional[int]], Any] = {}
+
+    def session(self, hosts: Sequence[str]) -> Session:
+        k = _key(hosts)
+        with self.__lock:
+            s = self.__sessions.get(k)
+            if s is None:
+                s = Cluster(list(k), **self.__opts).connect()
+                self.__sessions[k] = s
+            return s
+
+    # The (connected) cluster of `hosts`, e.g. for its schema metadata
+    def cluster(self, hosts: Sequence[str]) -> Cluster:
+        return self.session(hosts).cluster
+
+    # `query` prepared on the session of `hosts`; prepared once per query and consistency level
+    def prepare(self, hosts: Sequence[str], query: str, consistency_level: Optional[int] = None) -> Any:
+        k = (_key(hosts), query, consistency_level)
+        p = self.__prepared.get(k)
+        if p is None:
+            p = self.session(hosts).prepare(query)
+            if consistency_level is not None:
+                p.consistency_level = consistency_level
+            self.__prepared[k] = p
+        return p
+
+    def execute(self, hosts: Sequence[str], query: str, args: Sequence[Any] = (),
+            consistency_level: Optional[int] = None) -> Any:
+        return self.session(hosts).execute(self.prepare(hosts, query, consistency_level), args)
+
+    # Executes `query` once per element of `args_list` with up to `concurrency` requests in flight;
+    # returns the results in the order of `args_list` and raises the first error
+    def execute_many(self, hosts: Sequence[str], query: str, args_list: Sequence[Sequence[Any]],
+            consistency_level: Optional[int] = None, concurrency: int = 64) -> List[Any]:
+        return [r for _, r in execute_concurrent_with_args(self.session(hosts), self.prepare(hosts, query, consistency_level),
+                args_list, concurrency = concurrency)]
+
+    def close(self) -> None:
+        with self.__lock:
+            for s in self.__sessions.values():
+                s.cluster.shutdown()
+            self.__sessions.clear()
+            self.__prepared.clear()
+
+    def __enter__(self) -> 'SessionPool':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+# e.g. 'QUORUM' -> ConsistencyLevel.QUORUM
+def consistency_level(name: Optional[str]) -> Optional[int]:
+    return None if name is None else ConsistencyLevel.name_to_value[name.upper()]
@@ -0,0 +1,243 @@
+from pathlib import Path
+from typing import List, Optional, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+import logging
+import hashlib
+import shutil
+import subprocess
+import fcntl
+import errno
+import json
+import time
+import os
+
+from lib.node import Node
+from lib.local_node import LocalNodeEnv
+from lib.node_config import mk_node_cfg
+from lib.bootstrap import boot_cluster
+
+# Cache of the workdirs of freshly booted, empty clusters.
+# An entry is keyed by the hash of the Scylla binary and the configuration of every node of the cluster
+# (addresses, seeds, scylla.yaml, Seastar/Scylla options except CPU and memory assignment), so it's
+# never used with a different binary or configuration. Restoring an entry makes the nodes start as
+# already joined members of the cluster, which takes seconds instead of minutes.
+# Files are cloned with reflinks where the filesystem supports them; otherwise SSTables (which Scylla never
+# modifies in place) are hard-linked and the other files copied. The least recently used entries are
+# evicted when the cache exceeds its size limit.
+
+DEFAULT_CACHE_DIR = Path(os.environ.get('SCYLLA_TEST_SNAPSHOT_CACHE',
+    Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'scylla-test' / 'snapshots'))
+DEFAULT_MAX_BYTES = 20 * 2**30
+
+# ioctl cloning a whole file (copy-on-write), see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+# SHA-256 of a file, remembered in `memo_path` for as long as the file's path, inode, size and mtime stay the same
+# (debug builds are several GB; hashing them would cost seconds of every boot)
+def _file_digest(path: Path, memo_path: Path) -> str:
+    real = os.path.realpath(path)
+    st = os.stat(real)
+    stat_key = [st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns]
+    try:
+        memo = json.loads(memo_path.read_text())
+    except (OSError, ValueError):
+        memo = {}
+    entry = memo.get(real)
+    if entry and entry['stat'] == stat_key:
+        return entry['sha256']
+
+    h = hashlib.sha256()
+    with open(real, 'rb') as f:
+        for b in iter(lambda: f.read(2**20), b''):
+            h.update(b)
+    memo[real] = {'stat': stat_key, 'sha256': h.hexdigest()}
+    try:
+        memo_path.parent.mkdir(parents = True, exist_ok = True)
+        tmp = memo_path.with_name(f'{memo_path.name}.{os.getpid()}.tmp')
+        tmp.write_text(json.dumps(memo))
+        tmp.replace(memo_path)
+    except OSError:
+        pass
+    return h.hexdigest()
+
+# Identifies the Scylla build: the hash of the file and of its `--version` output
+# (the file may be a wrapper script of a relocatable package, which is the same for different builds)
+def scylla_fingerprint(scylla_path: Path, cache_dir: Path = DEFAULT_CACHE_DIR) -> str:
+    h = hashlib.sha256(_file_digest(scylla_path, cache_dir / '.fingerprints.json').encode())
+    h.update(subprocess.run([scylla_path, '--version'], stdout = subprocess.PIPE, stderr = subprocess.DEVNULL).stdout)
+    return h.hexdigest()
+
+def cache_key(fingerprint: str, envs: Sequence[LocalNodeEnv]) -> str:
+    nodes = [{
+        'cfg': mk_node_cfg(e.cfg),
+        # CPU and memory assignment doesn't affect what's on disk and differs between runs
+        'opts': {k: v for k, v in asdict(e.opts).items() if k not in ('cpuset', 'memory')},
+    } for e in envs]
+    return hashlib.sha256(json.dumps([fingerprint, nodes], sort_keys = True, default = str).encode()).hexdigest()[:32]
+
+def _reflink(src: Path, dst: Path) -> None:
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+def _tree_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob('*') if f.is_file() and not f.is_symlink())
+
+class _Cloner:
+    def __init__(self) -> None:
+        self.reflink: Optional[bool] = None
+        self.hardlink: Optional[bool] = None
+        self.files = 0
+
+    def clone_tree(self, src: Path, dst: Path) -> None:
+        dst.mkdir(parents = True, exist_ok = True)
+        for root, dirs, files in os.walk(src):
+            r = Path(root)
+            rel = r.relative_to(src)
+            for d in dirs:
+                (dst / rel / d).mkdir(exist_ok = True)
+            for f in files:
+                self.__clone(r / f, dst / rel / f, immutable = bool(rel.parts) and rel.parts[0] == 'data')
+
+    def __clone(self, src: Path, dst: Path, immutable: bool) -> None:
+        self.files += 1
+        if src.is_symlink():
+            os.symlink(os.readlink(src), dst)
+            return
+        if self.reflink is not False:
+            try:
+                _reflink(src, dst)
+                self.reflink = True
+                return
+            except OSError as e:
+                if e.errno not in (errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.EBADF):
+                    raise
+                dst.unlink(missing_ok = True)
+                self.reflink = False
+        if immutable and self.hardlink is not False:
+            try:
+                os.link(src, dst)
+                self.hardlink = True
+                return
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                    raise
+                self.hardlink = False
+        shutil.copy2(src, dst)
+
+    def method(self) -> str:
+        return 'reflink' if self.reflink else 'hardlink+copy' if self.hardlink else 'copy'
+
+class SnapshotCache:
+    def __init__(self, logger: logging.Logger, cache_dir: Path = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.__logger = logger
+        self.__dir = cache_dir
+        self.__max_bytes = max_bytes
+        self.__dir.mkdir(parents = True, exist_ok = True)
+
+    # Restore and eviction take this lock (shared and exclusive, respectively)
+    def __lock(self, op: int):
+        f = open(self.__dir / 'lock', 'a+')
+        fcntl.flock(f, op)
+        return f
+
+    def __entry(self, key: str) -> Path:
+        return self.__dir / key
+
+    # Restores the entry's workdirs into `workdirs` (one per node, in the order of the key's envs).
+    # Returns False if there's no such entry.
+    def restore(self, key: str, workdirs: Sequence[Path]) -> bool:
+        with self.__lock(fcntl.LOCK_SH):
+            e = self.__entry(key)
+            meta_path = e / 'meta.json'
+            if not meta_path.exists():
+                return False
+            meta = json.loads(meta_path.read_text())
+            if meta['nodes'] != len(workdirs):
+                return False
+            start = time.monotonic()
+            c = _Cloner()
+            for i, w in enumerate(workdirs):
+                if w.exists():
+                    shutil.rmtree(w)
+                c.clone_tree(e / 'nodes' / str(i), w)
+            meta['last_used'] = time.time()
+            tmp = e / f'meta.json.{os.getpid()}.tmp'
+            tmp.write_text(json.dumps(meta))
+            tmp.replace(meta_path)
+        self.__logger.info(f'Snapshot {key} restored ({c.files} files, {c.method()}) in {time.monotonic() - start:.1f}s')
+        return True
+
+    # Stores `workdirs` (of stopped nodes) as the entry for `key`, then evicts old entries if needed
+    def capture(self, key: str, workdirs: Sequence[Path]) -> None:
+        e = self.__entry(key)
+        if (e / 'meta.json').exists():
+            return
+        start = time.monotonic()
+        tmp = self.__dir / f'.tmp-{key}-{os.getpid()}'
+        c = _Cloner()
+        for i, w in enumerate(workdirs):
+            c.clone_tree(w, tmp / 'nodes' / str(i))
+        size = _tree_size(tmp)
+        (tmp / 'meta.json').write_text(json.dumps({
+            'nodes': len(workdirs), 'size': size, 'created': time.time(), 'last_used': time.time()}))
+        try:
+            tmp.rename(e)
+        except OSError:
+            # Another run captured the same snapshot in the meantime
+            shutil.rmtree(tmp)
+            return
+        self.__logger.info(f'Snapshot {key} captured ({size / 2**20:.0f}MB, {c.method()}) in {time.monotonic() - start:.1f}s')
+        self.evict()
+
+    def entries(self) -> List[dict]:
+        res = []
+        for e in self.__dir.iterdir():
+            meta_path = e / 'meta.json'
+            if e.name.startswith('.') or not meta_path.exists():
+                continue
+            try:
+                res.append(dict(json.loads(meta_path.read_text()), key = e.name))
+            except (OSError, ValueError):
+                continue
+        return res
+
+    # Removes the least recently used entries until the total size is within the limit
+    def evict(self) -> None:
+        with self.__lock(fcntl.LOCK_EX):
+            es = sorted(self.entries(), key = lambda m: m['last_used'])
+            total = sum(m['size'] for m in es)
+            while es and total > self.__max_bytes:
+                m = es.pop(0)
+                self.__logger.info(f"Evicting snapshot {m['key']} ({m['size'] / 2**20:.0f}MB)")
+                shutil.rmtree(self.__entry(m['key']))
+                total -= m['size']
+
+    def clear(self) -> None:
+        with self.__lock(fcntl.LOCK_EX):
+            for m in self.entries():
+                shutil.rmtree(self.__entry(m['key']))
+
+# Boots a cluster of nodes which haven't been started yet, restoring their workdirs from the cache if possible.
+# On a cache miss, the cluster is booted from scratch, stopped, captured into the cache and started again.
+# `envs` and `workdirs` describe `nodes` (in the same order). Returns whether the snapshot was restored.
+def boot_cluster_cached(
+        logger: logging.Logger, run_path: Path, nodes: Sequence[Node], envs: Sequence[LocalNodeEnv],
+        workdirs: Sequence[Path], cache: SnapshotCache, fingerprint: str, join_concurrency: Optional[int] = 1) -> bool:
+    assert len(nodes) == len(envs) == len(workdirs)
+    key = cache_key(fingerprint, envs)
+    if cache.restore(key, workdirs):
+        # The nodes are already members of the cluster: they may all start at the same time
+        boot_cluster(logger, run_path, nodes, join_concurrency = None)
+        return True
+
+    logger.info(f'Snapshot {key} not cached, booting cluster {nodes[0].ip()} from scratch')
+    boot_cluster(logger, run_path, nodes, join_concurrency)
+    logger.info(f'Stopping cluster {nodes[0].ip()} to capture its snapshot...')
+    # The seed last, so that the other nodes don't have to wait for it on shutdown
+    with ThreadPoolExecutor(max_workers = max(1, len(nodes) - 1)) as ex:
+        list(ex.map(lambda n: n.stop(), nodes[1:]))
+    nodes[0].stop()
+    cache.capture(key, workdirs)
+    boot_cluster(logger, run_path, nodes, join_concurrency = None)
+    return False
@@ -0,0 +1,113 @@
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from dataclasses import dataclass
+import datetime
+import calendar
+import sqlite3
+import os
+
+from lib.session_daemon import execute
+
+# Persistent index of CDC streams: stream ID -> the generations containing it, with the token of the stream
+# (the first 8 bytes of its ID, the token of the vnode the stream belongs to).
+# The generations are read from `system_distributed.cdc_streams` of the indexed cluster. Updating the index
+# only fetches the streams of generations which it doesn't contain yet, and forgets generations which
+# are not in the cluster anymore (e.g. a new cluster was started with the same address).
+# Lookups of many stream IDs at once (e.g. all IDs found in the replicator's log) are answered in one query.
+
+DEFAULT_INDEX_DIR = Path(os.environ.get('SCYLLA_TEST_STREAM_INDEX_DIR',
+    Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'scylla-test' / 'streams'))
+
+# SQLite's default limit of parameters per statement is 999
+_BATCH = 500
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+# Generation timestamps are naive UTC datetimes (as returned by the driver) with millisecond precision
+def _to_ms(t: datetime.datetime) -> int:
+    return calendar.timegm(t.utctimetuple()) * 1000 + t.microsecond // 1000
+
+def _from_ms(ms: int) -> datetime.datetime:
+    return _EPOCH + datetime.timedelta(milliseconds = ms)
+
+def stream_token(sid: bytes) -> int:
+    return int.from_bytes(sid[:8], 'big', signed = True)
+
+# Accepts '0x813a...' and '813a...'
+def parse_stream_id(s: str) -> bytes:
+    return bytes.fromhex(s[2:] if s.startswith('0x') else s)
+
+@dataclass(frozen=True)
+class Generation:
+    time: datetime.datetime
+    streams: int
+
+@dataclass(frozen=True)
+class StreamLocation:
+    stream_id: bytes
+    generation: datetime.datetime
+    token: int
+
+class StreamIndex:
+    # The index of the cluster reachable at `host` (by default in `DEFAULT_INDEX_DIR/<host>.db`)
+    def __init__(self, host: str, path: Optional[Path] = None):
+        self.__host = host
+        if path is None:
+            DEFAULT_INDEX_DIR.mkdir(parents = True, exist_ok = True)
+            path = DEFAULT_INDEX_DIR / f'{host}.db'
+        self.__db = sqlite3.connect(path)
+        self.__db.executescript('''
+            create table if not exists generations (time integer primary key, streams integer);
+            create table if not exists streams (
+                stream_id blob, generation integer, token integer, primary key (stream_id, generation)) without rowid;
+            create index if not exists streams_generation on streams (generation);
+        ''')
+
+    def close(self) -> None:
+        self.__db.close()
+
+    def __enter__(self) -> 'StreamIndex':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    # Fetches the streams of new generations and forgets generations which don't exist anymore;
+    # returns the number of new generations
+    def update(self) -> int:
+        current = {_to_ms(r[0]): r[0] for r in execute([self.__host],
+            'SELECT time FROM system_distributed.cdc_streams', consistency = 'QUORUM').rows}
+        known = {t for t, in self.__db.execute('select time from generations')}
+        with self.__db:
+            for t in known - current.keys():
+                self.__db.execute('delete from streams where generation = ?', (t,))
+                self.__db.execute('delete from generations where time = ?', (t,))
+            new = sorted(current.keys() - known)
+            for t in new:
+                rows = execute([self.__host], 'SELECT streams FROM system_distributed.cdc_streams WHERE time = ?',
+                        [current[t]], consistency = 'QUORUM').rows
+                sids = set(rows[0][0] or []) if rows else set()
+                self.__db.executemany('insert or ignore into streams values (?, ?, ?)',
+                        ((bytes(s), t, stream_token(s)) for s in sids))
+                self.__db.execute('insert into generations values (?, ?)', (t, len(sids)))
+        return len(new)
+
+    def generations(self) -> List[Generation]:
+        return [Generation(_from_ms(t), n) for t, n in self.__db.execute('select time, streams from generations order by time')]
+
+    # Generations (oldest first) containing each of the given streams; streams of no generation are omitted
+    def lookup(self, sids: Iterable[bytes]) -> Dict[bytes, List[StreamLocation]]:
+        res: Dict[bytes, List[StreamLocation]] = {}
+        ids = list(dict.fromkeys(sids))
+        for i in range(0, len(ids), _BATCH):
+            batch = ids[i:i + _BATCH]
+            for sid, gen, token in self.__db.execute(
+                    'select stream_id, generation, token from streams where stream_id in ({}) order by generation'.format(
+                        ', '.join('?' * len(batch))), batch):
+                res.setdefault(sid, []).append(StreamLocation(sid, _from_ms(gen), token))
+        return res
+
+    # Streams of the generation, ordered by token
+    def streams(self, generation: datetime.datetime) -> List[Tuple[bytes, int]]:
+        return list(self.__db.execute('select stream_id, token from streams where generation = ? order by token',
+                (_to_ms(generation),)))
@@ -0,0 +1,291 @@
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, TextIO, Tuple
+from dataclasses import dataclass, field, asdict
+import threading
+import asyncio
+import random
+import string
+import json
+import time
+
+from cassandra.cluster import Cluster, Session, ExecutionProfile, EXEC_PROFILE_DEFAULT # type: ignore
+from cassandra import policies # type: ignore
+
+from lib.histogram import Histogram
+
+# Native workload generator: runs prepared statements asynchronously on a single asyncio event loop,
+# with a fixed number of concurrent requests and optionally a target rate.
+# The workload covers the shapes of the `cql/` scenarios and of the cassandra-stress profile:
+# simple inserts/updates/deletes, collection appends/removals/overwrites, UDTs and tuples.
+# Optionally, a fraction of the operations (`read_ratio`) are reads of single rows or clustering slices.
+
+UDT_NAME = 'stress_udt'
+
+# Table name -> column definitions
+TABLES: Dict[str, str] = {
+    # the same as in cdc_replication_profile.yaml
+    'table1': '(pk int, ck int, v text, PRIMARY KEY (pk, ck))',
+    'simple': '(pk int, ck int, v1 int, v2 text, PRIMARY KEY (pk, ck))',
+    'collections': '(pk int, ck int, l list<int>, s set<int>, m map<int, int>, PRIMARY KEY (pk, ck))',
+    'udts': f'(pk int, ck int, fu frozen<{UDT_NAME}>, nu {UDT_NAME}, t tuple<int, text>, PRIMARY KEY (pk, ck))',
+}
+
+@dataclass(frozen=True)
+class StressConfig:
+    nodes: List[str]
+    keyspace: str = 'ks1'
+    tables: List[str] = field(default_factory=lambda: list(TABLES.keys()))
+    # Seconds
+    duration: float = 60
+    # Target number of operations per second (in total); None: as many as `concurrency` allows
+    rate: Optional[float] = None
+    # Number of requests in flight
+    concurrency: int = 16
+    replication_factor: int = 3
+    # CDC options of the created tables
+    cdc: str = "{'enabled': true}"
+    partitions: int = 10000
+    rows_per_partition: int = 5000
+    # Seconds between interval reports
+    interval: float = 5
+    seed: Optional[int] = None
+    # Fraction of operations which are reads (0: writes only)
+    read_ratio: float = 0
+
+@dataclass(frozen=True)
+class Operation:
+    name: str
+    table: str
+    # Statement with `{ks}` in place of the keyspace name
+    cql: str
+    weight: int
+    # Bind values, given a random generator and the config
+    args: Callable[[random.Random, StressConfig], Tuple[Any, ...]]
+    read: bool = False
+
+def _key(r: random.Random, cfg: StressConfig) -> Tuple[int, int]:
+    return (r.randint(1, cfg.partitions), r.randint(1, cfg.rows_per_partition))
+
+def _text(r: random.Random) -> str:
+    return ''.join(r.choices(string.ascii_letters, k = r.randint(1, 5)))
+
+def _ints(r: random.Random) -> List[int]:
+    return [r.randint(0, 100) for _ in range(r.randint(1, 3))]
+
+def _udt(r: random.Random) -> Tuple[int, int, str]:
+    return (r.randint(0, 1000), r.randint(0, 1000), _text(r))
+
+OPERATIONS: List[Operation] = [
+    Operation('update', 'table1', 'UPDATE {ks}.table1 SET v = ? WHERE pk = ? AND ck = ?', 4,
+        lambda r, c: (_text(r),) + _key(r, c)),
+
+    Operation('insert', 'simple', 'INSERT INTO {ks}.simple (pk, ck, v1, v2) VALUES (?, ?, ?, ?)', 4,
+        lambda r, c: _key(r, c) + (r.randint(0, 1000), _text(r))),
+    Operation('update', 'simple', 'UPDATE {ks}.simple SET v1 = ? WHERE pk = ? AND ck = ?', 4,
+        lambda r, c: (r.randint(0, 1000),) + _key(r, c)),
+    Operation('row_delete', 'simple', 'DELETE FROM {ks}.simple WHERE pk = ? AND ck = ?', 1,
+        lambda r, c: _key(r, c)),
+    Operation('range_delete', 'simple', 'DELETE FROM {ks}.simple WHERE pk = ? AND ck > ? AND ck < ?', 1,
+        lambda r, c: _key(r, c)[:1] + tuple(sorted(_key(r, c)[1] for _ in range(2)))),
+    Operation('partition_delete', 'simple', 'DELETE FROM {ks}.simple WHERE pk = ?', 1,
+        lambda r, c: _key(r, c)[:1]),
+
+    Operation('list_append', 'collections', 'UPDATE {ks}.collections SET l = l + ? WHERE pk = ? AND ck = ?', 2,
+        lambda r, c: (_ints(r),) + _key(r, c)),
+    Operation('list_overwrite', 'collections', 'UPDATE {ks}.collections SET l = ? WHERE pk = ? AND ck = ?', 1,
+        lambda r, c: (_ints(r),) + _key(r, c)),
+    Operation('list_remove', 'collections', 'UPDATE {ks}.collections SET l = l - ? WHERE pk = ? AND ck = ?', 1,
+        lambda r, c: (_ints(r),) + _key(r, c)),
+    Operation('set_add', 'collections', 'UPDATE {ks}.collections SET s = s + ? WHERE pk = ? AND ck = ?', 2,
+        lambda r, c: (set(_ints(r)),) + _key(r, c)),
+    Operation('set_remove', 'collections', 'UPDATE {ks}.collections SET s = s - ? WHERE pk = ? AND ck = ?', 1,
+        lambda r, c: (set(_ints(r)),) + _key(r, c)),
+    Operation('set_overwrite', 'collections', 'UPDATE {ks}.collections SET s = ? WHERE pk = ? AND ck = ?', 1,
+        lambda r, c: (set(_ints(r)),) + _key(r, c)),
+    Operation('map_put', 'collections', 'UPDATE {ks}.collections SET m = m + ? WHERE pk = ? AND ck = ?', 2,
+        lambda r, c: ({k: r.randint(0, 100) for k in _ints(r)},) + _key(r, c)),
+    Operation('map_remove', 'collections', 'UPDATE {ks}.collections SET m = m - ? WHERE pk = ? AND ck = ?', 1,
+        lambda r, c: (set(_ints(r)),) + _key(r, c)),
+    Operation('map_overwrite', 'collections', 'UPDATE {ks}.collections SET m = ? WHERE pk = ? AND ck = ?', 1,
+        lambda r, c: ({k: r.randint(0, 100) for k in _ints(r)},) + _key(r, c)),
+
+    Operation('insert', 'udts', 'INSERT INTO {ks}.udts (pk, ck, fu, t) VALUES (?, ?, ?, ?)', 2,
+        lambda r, c: _key(r, c) + (_udt(r), (r.randint(0, 1000), _text(r)))),
+    Operation('field_update', 'udts', 'UPDATE {ks}.udts SET nu.b = ? WHERE pk = ? AND ck = ?', 2,
+        lambda r, c: (r.randint(0, 1000),) + _key(r, c)),
+    Operation('overwrite', 'udts', 'UPDATE {ks}.udts SET nu = ? WHERE pk = ? AND ck = ?', 1,
+        lambda r, c: (_udt(r),) + _key(r, c)),
+
+    Operation('read', 'table1', 'SELECT v FROM {ks}.table1 WHERE pk = ? AND ck = ?', 4,
+        lambda r, c: _key(r, c), read = True),
+    Operation('read', 'simple', 'SELECT v1, v2 FROM {ks}.simple WHERE pk = ? AND ck = ?', 4,
+        lambda r, c: _key(r, c), read = True),
+    Operation('slice', 'simple', 'SELECT ck, v1, v2 FROM {ks}.simple WHERE pk = ? AND ck >= ? LIMIT 10', 1,
+        lambda r, c: _key(r, c), read = True),
+    Operation('read', 'collections', 'SELECT l, s, m FROM {ks}.collections WHERE pk = ? AND ck = ?', 2,
+        lambda r, c: _key(r, c), read = True),
+    Operation('read', 'udts', 'SELECT fu, nu, t FROM {ks}.udts WHERE pk = ? AND ck = ?', 2,
+        lambda r, c: _key(r, c), read = True),
+]
+
+def op_name(op: Operation) -> str:
+    return f'{op.table}.{op.name}'
+
+# The operations on `cfg.tables`: reads if `read_ratio` > 0 and writes if it's < 1.
+# Raises `ValueError` if the tables have no operations of a kind the ratio asks for.
+def select_operations(cfg: StressConfig) -> List[Operation]:
+    if not 0 <= cfg.read_ratio <= 1:
+        raise ValueError(f'read_ratio must be between 0 and 1, not {cfg.read_ratio}')
+    ops = [op for op in OPERATIONS if op.table in cfg.tables]
+    if cfg.read_ratio > 0 and not any(op.read for op in ops):
+        raise ValueError(f'read_ratio is {cfg.read_ratio}, but there are no reads of {", ".join(cfg.tables)}')
+    if cfg.read_ratio < 1 and not any(not op.read for op in ops):
+        raise ValueError(f'read_ratio is {cfg.read_ratio}, but there are no writes to {", ".join(cfg.tables)}')
+    return [op for op in ops if (not op.read or cfg.read_ratio > 0) and (op.read or cfg.read_ratio < 1)]
+
+# Weights of the operations such that reads make up `read_ratio` of them
+def _weights(ops: List[Operation], read_ratio: float) -> List[float]:
+    reads = sum(op.weight for op in ops if op.read)
+    writes = sum(op.weight for op in ops if not op.read)
+    return [op.weight * (read_ratio / reads if op.read else (1 - read_ratio) / writes) for op in ops]
+
+def create_schema(session: Session, cfg: StressConfig) -> None:
+    session.execute(f"CREATE KEYSPACE IF NOT EXISTS {cfg.keyspace} WITH replication ="
+                    f" {{'class': 'SimpleStrategy', 'replication_factor': {cfg.replication_factor}}}")
+    session.execute(f'CREATE TYPE IF NOT EXISTS {cfg.keyspace}.{UDT_NAME} (a int, b int, c text)')
+    for t in cfg.tables:
+        session.execute(f'CREATE TABLE IF NOT EXISTS {cfg.keyspace}.{t} {TABLES[t]} WITH cdc = {cfg.cdc}')
+
+# Wraps the driver's future in an asyncio future (the driver completes requests on its own threads)
+def _execute(loop: asyncio.AbstractEventLoop, session: Session, stmt: Any, args: Tuple[Any, ...]) -> asyncio.Future:
+    f = loop.create_future()
+    def done(res):
+        if not f.done():
+            f.set_result(res)
+    def failed(e):
+        if not f.done():
+            f.set_exception(e)
+    rf = session.execute_async(stmt, args)
+    rf.add_callbacks(lambda res: loop.call_soon_threadsafe(done, res),
+                     lambda e: loop.call_soon_threadsafe(failed, e))
+    return f
+
+@dataclass
+class StressResult:
+    ops: int = 0
+    errors: int = 0
+    duration: float = 0
+    # Operation name -> latencies in microseconds
+    latencies: Dict[str, Histogram] = field(default_factory=dict)
+    # Exception type name -> count
+    error_types: Dict[str, int] = field(default_factory=dict)
+
+# `tag` is 'interval' for interval reports and 'total' for the summary of the run
+def format_interval(ts: float, elapsed: float, length: float, h: Histogram, errors: int, tag: str = 'interval') -> str:
+    ms = lambda us: us / 1000
+    return ('[{}] ts={:.3f} elapsed={:.1f} ops={} rate={:.1f} errors={} mean_ms={:.3f} p50_ms={:.3f}'
+            ' p95_ms={:.3f} p99_ms={:.3f} p999_ms={:.3f} max_ms={:.3f}').format(
+        tag, ts, elapsed, h.count, h.count / length if length > 0 else 0, errors, ms(h.mean()),
+        ms(h.percentile(50)), ms(h.percentile(95)), ms(h.percentile(99)), ms(h.percentile(99.9)), ms(h.max or 0))
+
+async def _run(session: Session, cfg: StressConfig, ops: List[Tuple[Operation, Any]],
+        out: TextIO, intervals: List[dict], stop: Optional[threading.Event]) -> StressResult:
+    loop = asyncio.get_running_loop()
+    rng = random.Random(cfg.seed)
+    weights = _weights([op for op, _ in ops], cfg.read_ratio)
+    stopped = lambda: stop is not None and stop.is_set()
+    res = StressResult(latencies = {op_name(op): Histogram() for op, _ in ops})
+    interval_hist = Histogram()
+    interval_errors = 0
+
+    start = loop.time()
+    end = start + cfg.duration
+    next_slot = start
+
+    async def worker() -> None:
+        nonlocal next_slot, interval_errors
+        while True:
+            if cfg.rate:
+                # Latency is measured from the time the operation was scheduled to start,
+                # so that stalls of the cluster are not hidden by the workers waiting for responses
+                scheduled = next_slot
+                next_slot += 1 / cfg.rate
+                if scheduled >= end or stopped():
+                    return
+                delay = scheduled - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            else:
+                scheduled = loop.time()
+                if scheduled >= end or stopped():
+                    return
+            op, stmt = rng.choices(ops, weights)[0]
+            try:
+                await _execute(loop, session, stmt, op.args(rng, cfg))
+            except Exception as e:
+                res.errors += 1
+                interval_errors += 1
+                name = type(e).__name__
+                res.error_types[name] = res.error_types.get(name, 0) + 1
+                if res.error_types[name] <= 3:
+                    print(f'Error in {op_name(op)}: {e}', file = out, flush = True)
+                continue
+            us = int((loop.time() - scheduled) * 1e6)
+            res.latencies[op_name(op)].record(us)
+            interval_hist.record(us)
+            res.ops += 1
+
+    async def reporter() -> None:
+        nonlocal interval_hist, interval_errors
+        last = start
+        while True:
+            await asyncio.sleep(max(0, min(last + cfg.interval, end) - loop.time()))
+            now = loop.time()
+            h, errors = interval_hist, interval_errors
+            interval_hist, interval_errors = Histogram(), 0
+            print(format_interval(time.time(), now - start, now - last, h, errors), file = out, flush = True)
+            intervals.append({'ts': time.time(), 'elapsed': now - start, 'errors': errors, 'latencies': h.to_dict()})
+            last = now
+            if now >= end or stopped():
+                return
+
+    rep = asyncio.create_task(reporter())
+    await asyncio.gather(*(worker() for _ in range(cfg.concurrency)))
+    await rep
+    res.duration = loop.time() - start
+    return res
+
+# Creates the schema and runs the workload. Interval reports are printed to `out`.
+# If `hist_path` is given, latency histograms (in microseconds) of the whole run per operation
+# and of every interval are saved there as JSON.
+# Setting `stop` (e.g. from another thread) ends the workload before `cfg.duration` passes.
+def run_stress(cfg: StressConfig, out: TextIO, hist_path: Optional[Path] = None,
+        stop: Optional[threading.Event] = None) -> StressResult:
+    selected = select_operations(cfg)
+    profile = ExecutionProfile(load_balancing_policy = policies.TokenAwarePolicy(policies.DCAwareRoundRobinPolicy()))
+    with Cluster(cfg.nodes, protocol_version = 4, execution_profiles = {EXEC_PROFILE_DEFAULT: profile}) as c:
+        session = c.connect()
+        create_schema(session, cfg)
+        ops = [(op, session.prepare(op.cql.format(ks = cfg.keyspace))) for op in selected]
+        intervals: List[dict] = []
+        res = asyncio.run(_run(session, cfg, ops, out, intervals, stop))
+
+    total = Histogram()
+    for h in res.latencies.values():
+        total.merge(h)
+    print(format_interval(time.time(), res.duration, res.duration, total, res.errors, 'total'), file = out, flush = True)
+    for name, h in sorted(res.latencies.items()):
+        print('[op] {} ops={} mean_ms={:.3f} p99_ms={:.3f}'.format(name, h.count, h.mean() / 1000, h.percentile(99) / 1000),
+                file = out, flush = True)
+    if res.error_types:
+        print(f'[errors] {res.error_types}', file = out, flush = True)
+
+    if hist_path:
+        with open(hist_path, 'w') as f:
+            json.dump({
+                'config': asdict(cfg),
+                'unit': 'us',
+                'total': {name: h.to_dict() for name, h in res.latencies.items()},
+                'intervals': intervals,
+            }, f)
+    return res
@@ -1,118 +1,87 @@
 from pathlib import Path
-from typing import Final, List, Union, IO, Any, Optional, Tuple
+from typing import Final, List, Union, Optional, Tuple
 from os import PathLike
-from threading import Thread
-from queue import Queue
 import logging
 import resource
 import subprocess
-import re
 import signal
 
-from lib.node import Node
+from lib.node import Node, AsyncNode, StartupFailed
+from lib.readiness import Readiness, DEFAULT_START_TIMEOUT, wait_ready, wait_ready_async
+from lib.common import find_startup_failure, wait_until_async
 from lib.node_config import NodeConfig, RunOpts
 from lib.local_node import LocalNode
+from lib.log_capture import LogCapture, LogCaptureConfig
 
 def set_max_soft_fd_limit() -> None:
     (_, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
     resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
 
 # TODO error handling...
-class SubprocessNode(Node):
+class SubprocessNode(Node, AsyncNode):
     def __init__(self,
             logger: logging.Logger,
             base_path: Path, # TODO define meaning of base_path
             binary_path: Path,
             cfg: NodeConfig,
-            opts: RunOpts):
+            opts: RunOpts,
+            log_capture: LogCaptureConfig = LogCaptureConfig()):
         self.__node: Final[LocalNode] = LocalNode(base_path, cfg)
         self.__logger: Final[logging.Logger] = logger
         self.__opts: RunOpts = opts
         self.__binary_path: Path = binary_path
         self.__log_file: Final[Path] = self.__node.path / 'scyllalog'
-        self.__process: Optional[Tuple[subprocess.Popen, Thread]] = None
+        self.__log_capture: LogCaptureConfig = log_capture
+        self.__process: Optional[Tuple[subprocess.Popen, LogCapture]] = None
 
-    def start(self) -> None:
-        assert not self.__process
-        # TODO do some locking to protect from concurrent executions?
-
-        args: List[Union[str, PathLike]] = [
-            self.__binary_path,
-
-            '--workdir', 'workdir',
-            '--smp', f'{self.__opts.smp}',
-        ]
-
-        if self.__opts.developer_mode:
-            args.append('--developer-mode=yes')
-        if self.__opts.skip_gossip_wait:
-            args.extend(['--skip-wait-for-gossip-to-settle', '0'])
-        if self.__opts.overprovisioned:
-            args.append('--overprovisioned')
-        if self.__opts.stall_notify_ms:
-            args.extend(['--blocked-reactor-notify-ms', f'{self.__opts.stall_notify_ms}'])
-
-        p = subprocess.Popen(args,
-                stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                universal_newlines=True, bufsize=1,
-                cwd=self.__node.path,
-                preexec_fn=set_max_soft_fd_limit)
-
-        def readline_thread(stdout: IO[Any], log_file: Path, q: Queue[()]):
-            with open(log_file, 'a') as f:
-                with stdout as pipe:
-                    for l in iter(pipe.readline, ''):
-                        f.write(l)
-                        print(l, end='')
-                        ms = re.match(r".*Scylla.*initialization completed.*", l)
-                        if ms:
-                            q.put(())
-                            break
-                    for l in iter(pipe.readline, ''):
-                        f.write(l)
-                        print(l, end='')
-
-        assert p.stdout
-        q: Queue[()] = Queue()
-        t = Thread(target=readline_thread, args=[p.stdout, self.__log_file, q], daemon=True)
-        t.start()
-
-        # wait for initialization to complete TODO: timeout?
+    def start(self, wait_for: Readiness = Readiness.CQL_SERVING, timeout: Optional[float] = DEFAULT_START_TIMEOUT) -> None:
+        p = self.__spawn()
         self.__log(f'Waiting for node {self.ip()} to start...')
-        q.get()
+        if not wait_ready(self.get_node_config(), wait_for, timeout, alive = lambda: p.poll() is None):
+            self.__reap()
+            self.__startup_failed(p)
+        self.__log(f'Node {self.ip()} initialized.')
 
+    async def astart(self, wait_for: Readiness = Readiness.CQL_SERVING, timeout: Optional[float] = DEFAULT_START_TIMEOUT) -> None:
+        p = self.__spawn()
+        self.__log(f'Waiting for node {self.ip()} to start...')
+        if not await wait_ready_async(self.get_node_config(), wait_for, timeout, alive = lambda: p.poll() is None):
+            await self.__exited()
+            self.__reap()
+            self.__startup_failed(p)
         self.__log(f'Node {self.ip()} initialized.')
-        self.__process = (p, t)
 
     def stop(self) -> None:
         if not self.__process:
             return
-
         self.__log(f'Killing node {self.ip()} with SIGTERM...')
-        (p, t) = self.__process
-        p.terminate()
+        self.__process[0].terminate()
         # TODO probably need hard kill after timeout; also specify this in the interface
         # or simply make `stop` take timeout?
-        t.join()
-        assert p.stdout
-        p.stdout.close()
-        p.wait()
+        self.__reap()
 
-        self.__process = None
+    async def astop(self) -> None:
+        if not self.__process:
+            return
+        self.__log(f'Killing node {self.ip()} with SIGTERM...')
+        self.__process[0].terminate()
+        await self.__exited()
+        self.__reap()
 
     def hard_stop(self) -> None:
         if not self.__process:
             return
+        self.__log(f'Killing node {self.ip()} with SIGKILL...')
+        self.__process[0].kill()
+        self.__reap()
 
+    async def ahard_stop(self) -> None:
+        if not self.__process:
+            return
         self.__log(f'Killing node {self.ip()} with SIGKILL...')
-        # TODO: copypasta
-        (p, t) = self.__process
-        p.kill()
-        t.join()
-        assert p.stdout
-        p.stdout.close()
-        p.wait()
-        self.__process = None
+        self.__process[0].kill()
+        await self.__exited()
+        self.__reap()
 
     def pause(self) -> None:
         if not self.__process:
@@ -122,6 +91,9 @@ class SubprocessNode(Node):
         (p, _) = self.__process
         p.send_signal(signal.SIGSTOP)
 
+    async def apause(self) -> None:
+        self.pause()
+
     def unpause(self) -> None:
         if not self.__process:
             return
@@ -130,6 +102,61 @@ class SubprocessNode(Node):
         (p, _) = self.__process
         p.send_signal(signal.SIGCONT)
 
+    async def aunpause(self) -> None:
+        self.unpause()
+
+    def __spawn(self) -> subprocess.Popen:
+        assert not self.__process
+        # TODO do some locking to protect from concurrent executions?
+
+        args: List[Union[str, PathLike]] = [
+            self.__binary_path,
+
+            '--workdir', 'workdir',
+            '--smp', f'{self.__opts.smp}',
+        ]
+
+        if self.__opts.cpuset:
+            args.extend(['--cpuset', self.__opts.cpuset])
+        if self.__opts.memory:
+            args.extend(['--memory', self.__opts.memory])
+        if self.__opts.developer_mode:
+            args.append('--developer-mode=yes')
+        if self.__opts.skip_gossip_wait:
+            args.extend(['--skip-wait-for-gossip-to-settle', '0'])
+        if self.__opts.overprovisioned:
+            args.append('--overprovisioned')
+        if self.__opts.stall_notify_ms:
+            args.extend(['--blocked-reactor-notify-ms', f'{self.__opts.stall_notify_ms}'])
+
+        c = LogCapture(self.__logger, self.__log_file, self.__log_capture)
+        p = subprocess.Popen(args,
+                **c.popen_args(),
+                cwd=self.__node.path,
+                preexec_fn=set_max_soft_fd_limit)
+        c.attach(p)
+        # Assign before waiting so that the node can be stopped if it doesn't become ready in time
+        self.__process = (p, c)
+        return p
+
+    # Waits (without blocking the event loop) until the process exits and its output is consumed
+    async def __exited(self) -> None:
+        assert self.__process
+        (p, c) = self.__process
+        await wait_until_async(lambda: p.poll() is not None and not c.capturing(), None, f'node {self.ip()} to exit')
+
+    # Waits until the process exits and cleans up after it
+    def __reap(self) -> None:
+        assert self.__process
+        (p, c) = self.__process
+        p.wait()
+        c.close()
+        self.__process = None
+
+    def __startup_failed(self, p: subprocess.Popen) -> None:
+        failure = find_startup_failure(self.__log_file) or f'process exited with code {p.returncode}'
+        raise StartupFailed(f'Node {self.ip()} failed to start: {failure}')
+
     def ip(self) -> str:
         return self.__node.get_node_config().ip_addr
 
@@ -1,5 +1,5 @@
 from pathlib import Path
-from typing import Final
+from typing import Final, Optional
 import libtmux # type: ignore
 import time
 import os
@@ -7,16 +7,19 @@ import signal
 import logging
 from dataclasses import replace
 
-from lib.common import wait_for_init_path, is_running, write_executable_script
+from lib.common import wait_until, wait_until_async, find_startup_failure, is_running, write_executable_script
 from lib.node_config import RunOpts, ClusterConfig, NodeConfig
 from lib.local_node import LocalNodeEnv, LocalNode
-from lib.node import Node
+from lib.node import Node, AsyncNode, StartupFailed
+from lib.readiness import Readiness, DEFAULT_START_TIMEOUT, wait_ready, wait_ready_async
 
 def mk_run_script(opts: RunOpts, scylla_path: Path) -> str:
     return """#!/bin/bash
 set -m
 ({path} \\
     --smp {smp} \\
+    {cpuset} \\
+    {memory} \\
     --developer-mode={developer_mode} \\
     {overprovisioned} \\
     {skip_gossip_wait} \\
@@ -26,6 +29,8 @@ set -m
 """.format(
         path = scylla_path,
         smp = opts.smp,
+        cpuset = '--cpuset {}'.format(opts.cpuset) if opts.cpuset else '',
+        memory = '--memory {}'.format(opts.memory) if opts.memory else '',
         developer_mode = opts.developer_mode, # TODO fix
         skip_gossip_wait = '--skip-wait-for-gossip-to-settle 0' if opts.skip_gossip_wait else '',
         overprovisioned = '--overprovisioned' if opts.overprovisioned else '',
@@ -42,7 +47,7 @@ def mk_hard_kill_script() -> str:
 kill -9 $(cat scylla.pid)
 """
 
-class TmuxNode(Node):
+class TmuxNode(Node, AsyncNode):
     # invariant: `self.window: Final[libtmux.Window]` has a single pane with initially bash running, with 'path' as cwd
 
     # Create a directory for the node with configuration and run script,
@@ -64,35 +69,52 @@ class TmuxNode(Node):
         self.__window.panes[0].send_keys('ulimit -Sn $(ulimit -Hn)')
         self.__window.panes[0].send_keys('ulimit -Sn')
 
-    # Start node and wait for initialization.
+    # Start node and wait until it reaches the `wait_for` readiness level.
     # Assumes that the node is not running.
-    def start(self) -> None:
-        self.__window.panes[0].send_keys('./run.sh')
-        log_file = self.__node.path / 'scyllalog'
-        self.__log(f'Waiting for node {self.__name} to start...')
-        while not log_file.is_file():
-            time.sleep(1)
-        wait_for_init_path(log_file)
+    # Raises `StartupFailed` if Scylla exits before that; the node can then be started again.
+    def start(self, wait_for: Readiness = Readiness.CQL_SERVING, timeout: Optional[float] = DEFAULT_START_TIMEOUT) -> None:
+        started = time.monotonic()
+        pid_file = self.__launch()
+        wait_until(lambda: self.__pid_written(pid_file), timeout, f'node {self.__name} to write its PID')
+        pid = self.__pid = int(pid_file.read_text())
+        if not wait_ready(self.__node.get_node_config(), wait_for, self.__remaining(timeout, started),
+                alive = lambda: is_running(pid)):
+            self.__startup_failed()
         self.__log(f'Node {self.__name} started.')
 
-        with open(self.__node.path / 'scylla.pid') as pidfile:
-            self.__pid = int(pidfile.read())
+    async def astart(self, wait_for: Readiness = Readiness.CQL_SERVING, timeout: Optional[float] = DEFAULT_START_TIMEOUT) -> None:
+        started = time.monotonic()
+        pid_file = self.__launch()
+        await wait_until_async(lambda: self.__pid_written(pid_file), timeout, f'node {self.__name} to write its PID')
+        pid = self.__pid = int(pid_file.read_text())
+        if not await wait_ready_async(self.__node.get_node_config(), wait_for, self.__remaining(timeout, started),
+                alive = lambda: is_running(pid)):
+            self.__startup_failed()
+        self.__log(f'Node {self.__name} started.')
 
     def stop(self) -> None:
-        self.__log(f'Killing node {self.__name} with SIGTERM...')
-        os.kill(self.__pid, signal.SIGTERM)
-        while is_running(self.__pid):
-            time.sleep(1)
+        self.__kill(signal.SIGTERM)
+        pid = self.__pid
+        wait_until(lambda: not is_running(pid), None, f'node {self.__name} to stop')
+
+    async def astop(self) -> None:
+        self.__kill(signal.SIGTERM)
+        pid = self.__pid
+        await wait_until_async(lambda: not is_running(pid), None, f'node {self.__name} to stop')
 
     def restart(self) -> None:
         self.stop()
         self.start()
 
     def hard_stop(self) -> None:
-        self.__log(f'Killing node {self.__name} with SIGKILL...')
-        os.kill(self.__pid, signal.SIGKILL)
-        while is_running(self.__pid):
-            time.sleep(1)
+        self.__kill(signal.SIGKILL)
+        pid = self.__pid
+        wait_until(lambda: not is_running(pid), None, f'node {self.__name} to stop')
+
+    async def ahard_stop(self) -> None:
+        self.__kill(signal.SIGKILL)
+        pid = self.__pid
+        await wait_until_async(lambda: not is_running(pid), None, f'node {self.__name} to stop')
 
     def hard_restart(self) -> None:
         self.hard_stop()
@@ -101,9 +123,40 @@ class TmuxNode(Node):
     def pause(self) -> None:
         os.kill(self.__pid, signal.SIGSTOP)
 
+    async def apause(self) -> None:
+        self.pause()
+
     def unpause(self) -> None:
         os.kill(self.__pid, signal.SIGCONT)
 
+    async def aunpause(self) -> None:
+        self.unpause()
+
+    # Runs run.sh in the node's window; returns the file to which the PID of the server will be written
+    def __launch(self) -> Path:
+        pid_file = self.__node.path / 'scylla.pid'
+        # Don't pick up the PID of a previous run
+        pid_file.unlink(missing_ok = True)
+        self.__window.panes[0].send_keys('./run.sh')
+        self.__log(f'Waiting for node {self.__name} to start...')
+        return pid_file
+
+    @staticmethod
+    def __pid_written(pid_file: Path) -> bool:
+        return pid_file.is_file() and pid_file.read_text().strip() != ''
+
+    @staticmethod
+    def __remaining(timeout: Optional[float], started: float) -> Optional[float]:
+        return None if timeout is None else max(0, timeout - (time.monotonic() - started))
+
+    def __startup_failed(self) -> None:
+        failure = find_startup_failure(self.__node.path / 'scyllalog') or 'process exited'
+        raise StartupFailed(f'Node {self.__name} failed to start: {failure}')
+
+    def __kill(self, sig: signal.Signals) -> None:
+        self.__log(f'Killing node {self.__name} with {sig.name}...')
+        os.kill(self.__pid, sig)
+
     def ip(self) -> str:
         return self.__node.get_node_config().ip_addr
 
@@ -0,0 +1,20 @@
+from typing import List, Tuple
+
+# Murmur3Partitioner tokens. No partition key hashes to MIN_TOKEN,
+# so the ring is covered by the range (MIN_TOKEN, MAX_TOKEN].
+MIN_TOKEN: int = -2**63
+MAX_TOKEN: int = 2**63 - 1
+
+# A token range (start, end]: start exclusive, end inclusive
+TokenRange = Tuple[int, int]
+
+# Splits (start, end] into at most `n` contiguous ranges of roughly equal width
+def split_range(r: TokenRange, n: int) -> List[TokenRange]:
+    (start, end) = r
+    assert start < end and n > 0
+    n = min(n, end - start)
+    bounds = [start + (end - start) * i // n for i in range(n)] + [end]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def ring_ranges(n: int) -> List[TokenRange]:
+    return split_range((MIN_TOKEN, MAX_TOKEN), n)
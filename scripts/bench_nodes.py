@@ -0,0 +1,244 @@
+from pathlib import Path
+from typing import Callable, Dict, List, Sequence
+from dataclasses import replace
+import datetime
+import argparse
+import libtmux # type: ignore
+import json
+import time
+import sys
+import logging
+
+from lib.node_config import RunOpts, ClusterConfig
+from lib.local_node import mk_cluster_env
+from lib.addresses import lease_addresses
+from lib.tmux_node import TmuxNode
+from lib.subprocess_node import SubprocessNode
+from lib.log_capture import LogCaptureConfig, MODES as LOG_CAPTURE_MODES
+from lib.node import Node
+from lib.readiness import Readiness, node_endpoints, current_readiness
+from lib.common import wait_until
+from lib.bootstrap import boot_cluster, scylla_version
+
+# Benchmarks the lifecycle operations of the `Node` implementations: boots a small cluster with each
+# implementation and repeatedly runs every operation of the `Node` protocol on its nodes, measuring
+# how long each call takes until the node is back in the expected state.
+# The results (latency distributions per implementation and operation) are saved as JSON and,
+# if a baseline file is given, compared against it; regressions make the script exit with code 2.
+#
+# e.g. python3 -m scripts.bench_nodes --scylla-path path/to/scylla --iterations 5 --baseline bench_baseline.json
+
+IMPLS = ['tmux', 'subprocess']
+OPS = ['start', 'stop', 'restart', 'hard_restart', 'pause', 'unpause']
+
+def wait_cql(n: Node, timeout: float) -> None:
+    ep = node_endpoints(n.get_node_config())
+    wait_until(lambda: current_readiness(ep) == Readiness.CQL_SERVING, timeout, f'node {n.ip()} to serve CQL')
+
+def wait_unresponsive(n: Node, timeout: float) -> None:
+    ep = node_endpoints(n.get_node_config())
+    wait_until(lambda: current_readiness(ep) is None, timeout, f'node {n.ip()} to stop responding')
+
+def create_nodes(logger: logging.Logger, impl: str, run_path: Path, sess: libtmux.Session, scylla_path: Path,
+        net: str, num_nodes: int, opts: RunOpts, cluster_cfg: ClusterConfig,
+        log_capture: LogCaptureConfig = LogCaptureConfig()) -> Sequence[Node]:
+    envs = mk_cluster_env(1, num_nodes, opts, cluster_cfg, net)
+    if impl == 'tmux':
+        return [TmuxNode(logger, run_path / e.cfg.ip_addr, e, sess, scylla_path) for e in envs]
+    return [SubprocessNode(logger, run_path / e.cfg.ip_addr, scylla_path, e.cfg, e.opts, log_capture) for e in envs]
+
+# Runs `op` on `n` and returns how long it took (seconds)
+def measure(op: str, n: Node, timeout: float) -> float:
+    # `pause` and `unpause` return immediately; what matters is when the node reacts
+    def pause() -> None:
+        n.pause()
+        wait_unresponsive(n, timeout)
+
+    def unpause() -> None:
+        n.unpause()
+        wait_cql(n, timeout)
+
+    actions: Dict[str, Callable[[], None]] = {
+        'start': n.start,
+        'stop': n.stop,
+        'restart': n.restart,
+        'hard_restart': n.hard_restart,
+        'pause': pause,
+        'unpause': unpause,
+    }
+    start = time.monotonic()
+    actions[op]()
+    return time.monotonic() - start
+
+def stats(samples: List[float]) -> Dict[str, float]:
+    s = sorted(samples)
+    pct = lambda p: s[min(len(s) - 1, int(len(s) * p / 100))]
+    return {'n': len(s), 'min': s[0], 'mean': sum(s) / len(s), 'p50': pct(50), 'p90': pct(90), 'max': s[-1]}
+
+def bench_impl(logger: logging.Logger, impl: str, run_path: Path, sess: libtmux.Session, scylla_path: Path,
+        net: str, num_nodes: int, iterations: int, ops: Sequence[str], timeout: float,
+        opts: RunOpts, cluster_cfg: ClusterConfig,
+        log_capture: LogCaptureConfig = LogCaptureConfig()) -> Dict[str, Dict[str, float]]:
+    nodes = create_nodes(logger, impl, run_path / impl, sess, scylla_path, net, num_nodes, opts, cluster_cfg, log_capture)
+    samples: Dict[str, List[float]] = {op: [] for op in ['boot'] + list(ops)}
+    start = time.monotonic()
+    boot_cluster(logger, run_path / impl, nodes)
+    samples['boot'].append(time.monotonic() - start)
+    running = {n.ip(): True for n in nodes}
+    paused = {n.ip(): False for n in nodes}
+    try:
+        for i in range(iterations):
+            # Rotate through the nodes so that no single node's state dominates the results
+            n = nodes[i % len(nodes)]
+            for op in ops:
+                # Bring the node to the state the operation expects: stopped for `start`,
+                # paused for `unpause`, running and not paused for the rest
+                if paused[n.ip()] and op != 'unpause':
+                    n.unpause()
+                    paused[n.ip()] = False
+                if op == 'start' and running[n.ip()]:
+                    n.stop()
+                    running[n.ip()] = False
+                if op != 'start' and not running[n.ip()]:
+                    n.start()
+                    running[n.ip()] = True
+                if op == 'unpause' and not paused[n.ip()]:
+                    n.pause()
+                    wait_unresponsive(n, timeout)
+                    paused[n.ip()] = True
+
+                d = measure(op, n, timeout)
+                samples[op].append(d)
+                logger.info(f'{impl} {op} {n.ip()}: {d:.3f}s')
+                running[n.ip()] = op != 'stop'
+                paused[n.ip()] = op == 'pause'
+    finally:
+        for n in nodes:
+            if paused[n.ip()]:
+                n.unpause()
+            if running[n.ip()]:
+                n.stop()
+    return {op: stats(s) for op, s in samples.items() if s}
+
+# Returns descriptions of the operations whose p50 got slower than `threshold` times the baseline's
+# (and by more than `min_delta` seconds, so that noise in very fast operations isn't reported)
+def regressions(results: dict, baseline: dict, threshold: float, min_delta: float) -> List[str]:
+    res = []
+    for impl, ops in results['results'].items():
+        for op, st in ops.items():
+            b = baseline['results'].get(impl, {}).get(op)
+            if not b:
+                continue
+            if st['p50'] > b['p50'] * threshold and st['p50'] - b['p50'] > min_delta:
+                res.append(f"{impl} {op}: p50 {st['p50']:.3f}s vs {b['p50']:.3f}s in the baseline")
+    return res
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scylla-path', type=Path, required=True)
+    parser.add_argument('--impls', nargs='+', choices=IMPLS, default=IMPLS)
+    parser.add_argument('--ops', nargs='+', choices=OPS, default=OPS)
+    parser.add_argument('--num-nodes', type=int, default=1)
+    parser.add_argument('--num-shards', type=int, default=1)
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--ring-delay-ms', type=int, default=3000)
+    parser.add_argument('--timeout', type=float, default=600, help='timeout of a single operation (seconds)')
+    parser.add_argument('--output', type=Path, help='where to save the results (default: bench.json in the run directory)')
+    parser.add_argument('--baseline', type=Path, help='results of a previous run to compare against')
+    parser.add_argument('--save-baseline', default=False, action='store_true',
+            help='overwrite the baseline file with the results of this run')
+    parser.add_argument('--threshold', type=float, default=1.2,
+            help='report operations whose p50 latency is this many times slower than in the baseline')
+    parser.add_argument('--min-delta', type=float, default=0.5,
+            help='ignore p50 differences smaller than this many seconds')
+    parser.add_argument('--log-capture', choices=LOG_CAPTURE_MODES, default=LogCaptureConfig.mode,
+            help='how subprocess nodes\' output is written to their logs (see lib/log_capture.py)')
+    parser.add_argument('--no-log-echo', default=False, action='store_true',
+            help='don\'t copy subprocess nodes\' output to stdout')
+    parser.add_argument('--log-max-mb', type=int,
+            help='rotate subprocess nodes\' logs (and compress the rotated parts) when they grow over this size')
+    args = parser.parse_args()
+
+    if args.num_nodes < 1 or args.num_shards < 1 or args.iterations < 1 or args.ring_delay_ms < 1:
+        print('num-nodes, num-shards, iterations and ring-delay-ms must be positive')
+        exit(1)
+    if args.threshold < 1:
+        print('threshold must be at least 1')
+        exit(1)
+    if args.log_max_mb is not None and args.log_max_mb < 1:
+        print('log-max-mb must be positive')
+        exit(1)
+    if args.save_baseline and not args.baseline:
+        print('--save-baseline requires --baseline')
+        exit(1)
+
+    scylla_path: Path = args.scylla_path.resolve()
+    run_id: str = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    run_path = Path.cwd() / 'runs' / f'bench-{run_id}'
+    run_path.mkdir(parents=True)
+
+    logging.basicConfig(
+        level = logging.INFO,
+        format = "%(asctime)s [%(levelname)s] %(message)s",
+        handlers = [
+            logging.FileHandler(run_path / 'run.log'),
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+    logger = logging.getLogger()
+
+    serv = libtmux.Server()
+    sess = serv.new_session(session_name = f'scylla-bench-{run_id}', start_directory = run_path)
+    logger.info(f'tmux session name: scylla-bench-{run_id}')
+
+    opts = replace(RunOpts(), developer_mode = True, overprovisioned = True, smp = args.num_shards)
+    cluster_cfg = ClusterConfig(ring_delay_ms = args.ring_delay_ms, first_node_skip_gossip_settle = True)
+    log_capture = LogCaptureConfig(mode = args.log_capture, echo = not args.no_log_echo,
+            max_bytes = args.log_max_mb * 2**20 if args.log_max_mb else None)
+
+    version = scylla_version(scylla_path)
+    results = {
+        'scylla_path': str(scylla_path),
+        'scylla_version': '.'.join(map(str, version)) if version else None,
+        'num_nodes': args.num_nodes,
+        'num_shards': args.num_shards,
+        'iterations': args.iterations,
+        'log_capture': args.log_capture,
+        'started_at': time.time(),
+        'results': {},
+    }
+    lease = lease_addresses(str(run_path))
+    logger.info(f'Addresses: {lease}')
+    # The implementations run one after another on the same addresses
+    for impl in args.impls:
+        logger.info(f'Benchmarking {impl} nodes...')
+        results['results'][impl] = bench_impl(logger, impl, run_path, sess, scylla_path, lease.net, args.num_nodes,
+                args.iterations, args.ops, args.timeout, opts, cluster_cfg, log_capture)
+
+    output: Path = args.output or run_path / 'bench.json'
+    with open(output, 'w') as f:
+        json.dump(results, f, indent = 1)
+    logger.info(f'Results saved to {output}')
+
+    for impl, ops in results['results'].items():
+        for op, st in ops.items():
+            logger.info('{:10} {:12} n={} min={:.3f}s p50={:.3f}s p90={:.3f}s max={:.3f}s'.format(
+                impl, op, st['n'], st['min'], st['p50'], st['p90'], st['max']))
+
+    regressed: List[str] = []
+    if args.baseline and args.baseline.exists():
+        with open(args.baseline) as f:
+            regressed = regressions(results, json.load(f), args.threshold, args.min_delta)
+        for r in regressed:
+            logger.error(f'Regression: {r}')
+        if not regressed:
+            logger.info(f'No regressions compared to {args.baseline}')
+    elif args.baseline:
+        logger.info(f'Baseline {args.baseline} does not exist yet')
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent = 1)
+        logger.info(f'Baseline saved to {args.baseline}')
+
+    exit(2 if regressed else 0)
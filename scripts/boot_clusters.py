@@ -11,22 +11,34 @@ import sys
 import logging
 
 from lib.node_config import RunOpts, ClusterConfig
-from lib.local_node import mk_cluster_env
+from lib.local_node import LocalNodeEnv, mk_cluster_env
+from lib.host_resources import plan_run_resources
+from lib.snapshot_cache import SnapshotCache, boot_cluster_cached, scylla_fingerprint
+from lib.addresses import AddressLease, lease_addresses
 from lib.tmux_node import TmuxNode
 from lib.node import Node
+from lib.bootstrap import boot_cluster, max_concurrent_joins
 
 def create_cluster(
         logger: logging.Logger,
         run_path: Path, sess: libtmux.Session, scylla_path: Path,
-        ip_start: int, num_nodes: int, opts: RunOpts, cluster_cfg: ClusterConfig) -> Sequence[Node]:
-    envs = mk_cluster_env(ip_start, num_nodes, opts, cluster_cfg)
-    nodes = [TmuxNode(logger, run_path / e.cfg.ip_addr, e, sess, scylla_path) for e in envs]
-    return nodes
+        ip_start: int, num_nodes: int, opts: RunOpts, cluster_cfg: ClusterConfig, net: str = '127.0.0') -> Sequence[Node]:
+    return create_nodes(logger, run_path, sess, scylla_path, mk_cluster_env(ip_start, num_nodes, opts, cluster_cfg, net))
 
-def boot(nodes: Sequence[Node]) -> Thread:
+def create_nodes(
+        logger: logging.Logger,
+        run_path: Path, sess: libtmux.Session, scylla_path: Path, envs: Sequence[LocalNodeEnv]) -> Sequence[Node]:
+    return [TmuxNode(logger, run_path / e.cfg.ip_addr, e, sess, scylla_path) for e in envs]
+
+# If `cache` is given, `envs` must describe `nodes` and the workdirs are restored from (or captured into) the cache
+def boot(logger: logging.Logger, run_path: Path, nodes: Sequence[Node], join_concurrency: Optional[int],
+        cache: Optional[SnapshotCache] = None, envs: Sequence[LocalNodeEnv] = [], fingerprint: str = '') -> Thread:
     def start():
-        for n in nodes:
-            n.start()
+        if cache:
+            boot_cluster_cached(logger, run_path, nodes, envs, [run_path / e.cfg.ip_addr / 'workdir' for e in envs],
+                    cache, fingerprint, join_concurrency)
+        else:
+            boot_cluster(logger, run_path, nodes, join_concurrency)
     start_thread = Thread(target=start)
     start_thread.start()
     return start_thread
@@ -46,11 +58,23 @@ class TestConfig:
     start_clusters: bool = True
     extra_opts: str = ''
     extra_cfg: dict = field(default_factory=dict)
+    # How many nodes may join a cluster at the same time; None: detect from the Scylla version
+    join_concurrency: Optional[int] = None
+    # Assign disjoint CPUs and memory budgets to the nodes (see lib/host_resources.py):
+    # 'strict' fails if the host doesn't have enough, 'warn' shares CPUs then, 'off' doesn't assign any
+    resource_plan: str = 'warn'
+    # Restore the workdirs of booted clusters from this cache (see lib/snapshot_cache.py); None: boot from scratch
+    snapshot_cache: Optional[SnapshotCache] = None
 
-def boot_clusters(cfg: TestConfig):
+# Returns the lease of the clusters' addresses; it's held as long as the returned object is referenced
+# (or until the process exits), and the addresses are not leased again while the nodes are running anyway
+def boot_clusters(cfg: TestConfig) -> AddressLease:
     if any(n <= 0 for n in cfg.num_nodes):
         print('Cluster sizes must be positive')
         exit(1)
+    if sum(cfg.num_nodes) > 254:
+        print('At most 254 nodes in total are supported')
+        exit(1)
     if cfg.num_shards <= 0:
         print('Number of shards must be positive')
         exit(1)
@@ -60,6 +84,12 @@ def boot_clusters(cfg: TestConfig):
     if cfg.ring_delay_ms < 1:
         print('ring-delay-ms must be positive')
         exit(1)
+    if cfg.join_concurrency is not None and cfg.join_concurrency < 1:
+        print('join-concurrency must be positive')
+        exit(1)
+    if cfg.resource_plan not in ('strict', 'warn', 'off'):
+        print("resource_plan must be 'strict', 'warn' or 'off'")
+        exit(1)
 
     cfg.run_path.mkdir(parents=True)
     logging.basicConfig(
@@ -93,12 +123,26 @@ def boot_clusters(cfg: TestConfig):
         extra = cfg.extra_cfg
     )
 
+    lease = lease_addresses(str(cfg.run_path))
+    logger.info(f'Addresses: {lease}')
+
     ip_starts = itertools.accumulate([1] + cfg.num_nodes, operator.add)
     logger.info('Creating {} clusters...'.format(len(cfg.num_nodes)))
-    cs = [create_cluster(logger, cfg.run_path, cfg.sess, cfg.scylla_path, ip_start, num, opts, cluster_cfg)
-            for ip_start, num in zip(ip_starts, cfg.num_nodes)]
+    envs = [mk_cluster_env(ip_start, num, opts, cluster_cfg, lease.net) for ip_start, num in zip(ip_starts, cfg.num_nodes)]
+    if cfg.resource_plan != 'off':
+        planned = iter(plan_run_resources(logger, cfg.run_path, lease, [e for es in envs for e in es],
+                allow_oversubscription = cfg.resource_plan == 'warn'))
+        envs = [[next(planned) for _ in es] for es in envs]
+    cs = [create_nodes(logger, cfg.run_path, cfg.sess, cfg.scylla_path, es) for es in envs]
 
     if cfg.start_clusters:
-        ts = [boot(c) for c in cs]
+        join_concurrency = cfg.join_concurrency
+        if join_concurrency is None:
+            join_concurrency = max_concurrent_joins(cfg.scylla_path, cfg.experimental)
+        logger.info(f'Join concurrency: {join_concurrency if join_concurrency else "unlimited"}')
+        fingerprint = scylla_fingerprint(cfg.scylla_path) if cfg.snapshot_cache else ''
+        ts = [boot(logger, cfg.run_path, c, join_concurrency, cfg.snapshot_cache, es, fingerprint) for c, es in zip(cs, envs)]
         logger.info('Waiting for clusters to boot...')
         for t in ts: t.join()
+
+    return lease
@@ -0,0 +1,35 @@
+from pathlib import Path
+import argparse
+import logging
+import sys
+
+from lib.cdc_export import ExportConfig, export_cdc_log, format_summary
+from lib.stream_index import StreamIndex
+
+# Exports the CDC log of a table to a columnar file with per-stream and per-generation statistics
+# (see lib/cdc_export.py), e.g.
+# python3 -m scripts.cdc_export --address 127.0.0.10 --keyspace ks1 --table table1 --out runs/latest/cdc_export
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--address', required=True)
+    parser.add_argument('--keyspace', required=True)
+    parser.add_argument('--table', required=True, help='the base table (not the CDC log table)')
+    parser.add_argument('--out', type=Path, required=True, help='directory for cdc_log.col and cdc_export.json')
+    parser.add_argument('--workers', type=int, default=ExportConfig.workers)
+    parser.add_argument('--splits', type=int, default=ExportConfig.splits)
+    parser.add_argument('--page-size', type=int, default=ExportConfig.page_size)
+    args = parser.parse_args()
+
+    if args.workers < 1 or args.splits < 1 or args.page_size < 1:
+        print('workers, splits and page-size must be positive')
+        exit(1)
+
+    logging.basicConfig(level = logging.INFO, format = "%(asctime)s [%(levelname)s] %(message)s",
+            handlers = [logging.StreamHandler(sys.stderr)])
+    with StreamIndex(args.address) as idx:
+        idx.update()
+        gens = [g.time for g in idx.generations()]
+    summary = export_cdc_log(logging.getLogger(), ExportConfig(
+        address = args.address, keyspace = args.keyspace, table = args.table, out = args.out,
+        workers = args.workers, splits = args.splits, page_size = args.page_size), gens)
+    print(format_summary(summary))
@@ -0,0 +1,49 @@
+from typing import Dict, List
+import argparse
+import logging
+import sys
+
+from lib.consistency import CheckConfig, check_consistency, format_report
+
+# Compares the contents of tables on two clusters, e.g.
+# python3 -m scripts.check --master-address 127.0.0.10 --replica-address 127.0.0.20 ks1.table1
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--master-address', required=True)
+    parser.add_argument('--replica-address', required=True)
+    parser.add_argument('--no-writetime', default=False, action='store_true')
+    parser.add_argument('--workers', type=int, default=CheckConfig.workers)
+    parser.add_argument('--splits', type=int, default=CheckConfig.splits)
+    parser.add_argument('--leaf-rows', type=int, default=CheckConfig.leaf_rows)
+    parser.add_argument('tables', nargs='+', help='tables to compare, in keyspace.table format')
+    args = parser.parse_args()
+
+    if args.workers < 1 or args.splits < 1 or args.leaf_rows < 1:
+        print('workers, splits and leaf-rows must be positive')
+        exit(1)
+    if any('.' not in t for t in args.tables):
+        print('Tables must be given in keyspace.table format')
+        exit(1)
+
+    logging.basicConfig(
+        level = logging.INFO,
+        format = "%(asctime)s [%(levelname)s] %(message)s",
+        handlers = [logging.StreamHandler(sys.stdout)]
+    )
+    logger = logging.getLogger()
+
+    by_ks: Dict[str, List[str]] = {}
+    for t in args.tables:
+        ks, tb = t.split('.', 1)
+        by_ks.setdefault(ks, []).append(tb)
+
+    ok = True
+    for ks, tbs in by_ks.items():
+        results = check_consistency(logger, CheckConfig(
+            master_address = args.master_address, replica_address = args.replica_address,
+            keyspace = ks, tables = tbs, no_writetime = args.no_writetime,
+            workers = args.workers, splits = args.splits, leaf_rows = args.leaf_rows))
+        print(format_report(ks, results))
+        ok = ok and all(not r.divergences for r in results)
+
+    exit(0 if ok else 1)
@@ -0,0 +1,51 @@
+from dataclasses import asdict
+from pathlib import Path
+import argparse
+import json
+import sys
+
+from cassandra.metadata import protect_name # type: ignore
+
+from lib.cql_scenarios import KEYSPACE, load_scenarios, run_scenarios
+from lib.sessions import SessionPool
+
+# Runs the CQL scenarios (every file of `--dir` is a scenario; its statements run in order and the scenarios
+# run concurrently over one driver session) in the keyspace ks1, which is created first, e.g.
+# python3 -m scripts.cql --nodes 127.0.0.10 --repeat 5
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', nargs='+', required=True)
+    parser.add_argument('--dir', type=Path, default=Path('cql'))
+    parser.add_argument('--scenarios', nargs='+', help='names of the scenarios to run (default: all files of --dir)')
+    parser.add_argument('--rf', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=1,
+            help='how many times to run the statements of every scenario; schema statements run once')
+    parser.add_argument('--report', type=Path, help='where to save the results (JSON)')
+    args = parser.parse_args()
+
+    if args.repeat < 1 or args.rf < 1:
+        print('repeat and rf must be positive')
+        exit(1)
+
+    scenarios = load_scenarios(args.dir)
+    if args.scenarios:
+        unknown = set(args.scenarios) - {s.name for s in scenarios}
+        if unknown:
+            print(f'No such scenarios in {args.dir}: {", ".join(sorted(unknown))}')
+            exit(1)
+        scenarios = [s for s in scenarios if s.name in args.scenarios]
+
+    with SessionPool() as pool:
+        session = pool.session(args.nodes)
+        session.execute(f"CREATE KEYSPACE IF NOT EXISTS {protect_name(KEYSPACE)} WITH replication ="
+                        f" {{'class': 'SimpleStrategy', 'replication_factor': '{args.rf}'}} AND durable_writes = true")
+        results = run_scenarios(session, scenarios, sys.stdout, args.repeat)
+
+    errors = sum(len(r.errors) for r in results)
+    print('{} scenarios, {} statements, {} errors, slowest {:.3f}s'.format(
+        len(results), sum(r.executed for r in results), errors, max((r.duration for r in results), default = 0)))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'repeat': args.repeat, 'scenarios': [asdict(r) for r in results]}, f, indent = 1)
+
+    exit(1 if errors else 0)
@@ -0,0 +1,39 @@
+from pathlib import Path
+import argparse
+import time
+import json
+import sys
+
+from lib.dashboard import format_snapshot
+
+# Shows the live state of a run (see lib/dashboard.py), refreshed whenever the harness writes a snapshot, e.g.
+# python3 -m scripts.dashboard runs/latest
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('run_path', type=Path)
+    parser.add_argument('--interval', type=float, default=1, help='seconds between checks for a new snapshot')
+    args = parser.parse_args()
+
+    if args.interval <= 0:
+        print('interval must be positive')
+        exit(1)
+
+    path: Path = args.run_path / 'dashboard.jsonl'
+    print(f'Waiting for {path}...')
+    while not path.exists():
+        time.sleep(args.interval)
+
+    try:
+        with open(path) as f:
+            buf = ''
+            while True:
+                # Only the last complete line matters
+                buf += f.read()
+                lines = buf.split('\n')
+                buf = lines[-1]
+                if len(lines) > 1 and lines[-2]:
+                    sys.stdout.write('\x1b[H\x1b[2J' + format_snapshot(json.loads(lines[-2])) + '\n')
+                    sys.stdout.flush()
+                time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
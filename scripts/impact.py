@@ -0,0 +1,37 @@
+from pathlib import Path
+import argparse
+import json
+import sys
+
+from lib.impact import save_run_impact, aggregate, format_aggregate
+from lib.log_index import format_time
+
+# Reports how the faults and bootstraps of runs affected the workload (see lib/impact.py), per run and
+# aggregated across all the given runs, e.g.
+# python3 -m scripts.impact runs/2023-01-01_12-00-00 runs/2023-01-01_13-00-00
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('run_paths', type=Path, nargs='+')
+    parser.add_argument('--events', default=False, action='store_true', help='print the impact of every event')
+    parser.add_argument('--json', default=False, action='store_true', help='print the aggregate as JSON')
+    args = parser.parse_args()
+
+    impacts = []
+    for run_path in args.run_paths:
+        if not run_path.is_dir():
+            print(f'{run_path} does not exist')
+            exit(1)
+        rs = save_run_impact(run_path)
+        print(f'{run_path}: {len(rs)} events', file=sys.stderr)
+        if args.events:
+            for i in rs:
+                print('{} {:<12} {:<15} drop {:.0%}, p99 {:.1f}ms -> {:.1f}ms, recovered {}'.format(
+                    format_time(i.started_at), i.kind, i.node, i.throughput_drop, i.baseline_p99_ms, i.max_p99_ms,
+                    f'after {i.recovery_s:.1f}s' if i.recovery_s is not None else 'never'))
+        impacts.extend(rs)
+
+    agg = aggregate(impacts)
+    if args.json:
+        print(json.dumps(agg, indent = 1))
+    else:
+        print(format_aggregate(agg))
@@ -0,0 +1,70 @@
+from pathlib import Path
+import argparse
+import time
+import sys
+
+from lib.log_index import LogIndex, LEVELS, INDEX_FILE, parse_log_time
+
+# Queries the logs of all nodes and tools of a run (indexing them first, see lib/log_index.py), e.g.
+# python3 -m scripts.logs runs/latest query --level warn --node 127.0.0.10 --grep 'gossip'
+# python3 -m scripts.logs runs/latest timeline --at '2023-01-01 12:00:05' --before 2 --after 10
+
+def parse_time(s: str) -> float:
+    try:
+        return float(s)
+    except ValueError:
+        pass
+    try:
+        return parse_log_time(s)
+    except ValueError:
+        print(f"Wrong time '{s}': use 'YYYY-MM-DD HH:MM:SS[.mmm]' (local time) or seconds since the epoch")
+        exit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('run_path', type=Path)
+    parser.add_argument('--no-update', default=False, action='store_true',
+            help='don\'t index lines added to the logs since the last update')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    sub.add_parser('index', help='only update the index')
+    for name in ['query', 'timeline']:
+        p = sub.add_parser(name)
+        p.add_argument('--node', nargs='+', default=[], help='nodes\' IPs or tools (e.g. replicator, stressor)')
+        p.add_argument('--level', type=str.upper, choices=LEVELS, help='the minimum level')
+        p.add_argument('--logger', nargs='+', default=[], help='Scylla loggers, e.g. storage_service')
+        p.add_argument('--grep', help='a regex searched for in the messages')
+        p.add_argument('--limit', type=int)
+        if name == 'query':
+            p.add_argument('--since', type=parse_time)
+            p.add_argument('--until', type=parse_time)
+        else:
+            p.add_argument('--at', type=parse_time, required=True)
+            p.add_argument('--before', type=float, default=5, help='seconds before --at')
+            p.add_argument('--after', type=float, default=5, help='seconds after --at')
+    args = parser.parse_args()
+
+    if not args.run_path.is_dir():
+        print(f'{args.run_path} does not exist')
+        exit(1)
+    if args.cmd == 'timeline' and (args.before < 0 or args.after < 0):
+        print('before and after must be non-negative')
+        exit(1)
+
+    with LogIndex(args.run_path) as idx:
+        if not args.no_update or args.cmd == 'index':
+            start = time.monotonic()
+            n = idx.update()
+            print(f'Indexed {n} new lines into {args.run_path / INDEX_FILE} in {time.monotonic() - start:.1f}s',
+                    file=sys.stderr)
+        if args.cmd == 'index':
+            exit(0)
+        filters = dict(nodes = args.node, level = args.level, loggers = args.logger, grep = args.grep, limit = args.limit)
+        if args.cmd == 'query':
+            entries = idx.query(since = args.since, until = args.until, **filters)
+        else:
+            entries = idx.timeline(args.at, args.before, args.after, **filters)
+        try:
+            for e in entries:
+                print(e.format())
+        except BrokenPipeError:
+            pass
@@ -0,0 +1,30 @@
+from pathlib import Path
+import argparse
+import math
+import sys
+
+from lib.columnar import TS, read_columns
+from lib.metrics import summarize, format_summary
+
+# Summarizes (or dumps as CSV) the metrics collected during a run, e.g.
+# python3 -m scripts.metrics runs/latest
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('run_path', type=Path)
+    parser.add_argument('--csv', default=False, action='store_true', help='print all samples as CSV')
+    args = parser.parse_args()
+
+    path: Path = args.run_path / 'metrics.col'
+    if not path.exists():
+        print(f'{path} does not exist')
+        exit(1)
+
+    cols = read_columns(path)
+    if args.csv:
+        names = [TS] + sorted(c for c in cols if c != TS)
+        print(','.join(names))
+        for i in range(len(cols[TS])):
+            print(','.join('' if math.isnan(cols[c][i]) else repr(cols[c][i]) for c in names))
+    else:
+        print(format_summary(summarize(cols)))
+    sys.stdout.flush()
@@ -15,18 +15,32 @@ import os
 import signal
 import argparse
 import random
-import queue
 import itertools
 import logging
 import sys
 
-from cassandra.cluster import Cluster, ExecutionProfile, EXEC_PROFILE_DEFAULT # type: ignore
-from cassandra import policies # type: ignore
-
 from lib.node_config import RunOpts, ClusterConfig
 from lib.tmux_node import TmuxNode
 from lib.local_node import mk_cluster_env
+from lib.addresses import lease_addresses
+from lib.host_resources import Oversubscribed, plan_run_resources
+from lib.snapshot_cache import SnapshotCache, DEFAULT_CACHE_DIR, boot_cluster_cached, scylla_fingerprint
+from lib.local_node import LocalNodeEnv
 from lib.node import Node
+from lib.aio import EventLoopThread
+from lib.nemesis import NemesisEngine, KINDS as NEMESIS_KINDS, DEFAULT_SPECS as NEMESIS_SPECS
+from lib.phases import PhaseTimer
+from lib.conditions import wait_for_cdc_generation, wait_for_schema, wait_for_replicated_data
+from lib.consistency import CheckConfig, check_consistency, format_report
+from lib.online_verifier import OnlineVerifier, VerifierConfig
+from lib.convergence import ConvergenceMonitor, ConvergenceTimeout
+from lib.bootstrap import boot_cluster, start_node, record_boot_timing, max_concurrent_joins
+from lib.stressor import TABLES as NATIVE_STRESSOR_TABLES
+from lib.metrics import MetricsScraper
+from lib.log_index import LogIndexer
+from lib.impact import save_run_impact, aggregate, format_aggregate
+from lib.sessions import SessionPool
+from lib.dashboard import Dashboard
 
 def cdc_opts(mode: str):
     if mode == 'preimage':
@@ -35,125 +49,98 @@ def cdc_opts(mode: str):
         return "{'enabled': true, 'postimage': true}"
     return "{'enabled': true}"
 
-class PauseNemesis:
-    def __init__(self, logger: logging.Logger, n: Node):
-        self.logger = logger
-        self.n = n
-        self.q: Optional[queue.Queue] = None
-        self.t: Optional[Thread] = None
-
-    def log(self, *args, **kwargs) -> None:
-        self.logger.info(*args, **kwargs)
-
-    def _nemesis_thread(self, q: queue.Queue) -> None:
-        while True:
-            time.sleep(5)
-            if not q.empty():
-                break
-            self.log('Nemesis: pausing {}'.format(self.n.ip()))
-            self.n.pause()
-            time.sleep(3 + random.randrange(0,2))
-            if not q.empty():
-                break
-            self.log('Nemesis: unpausing {}'.format(self.n.ip()))
-            self.n.unpause()
-        self.log('Nemesis: asked to finish, unpausing {}'.format(self.n.ip()))
-        self.n.unpause()
-
-    def start(self) -> None:
-        if self.t:
-            return
-
-        self.q = queue.Queue()
-        self.t = Thread(target=PauseNemesis._nemesis_thread, args=[self, self.q])
-        self.t.start()
-
-    def stop(self) -> None:
-        if not self.t:
-            return
-
-        assert self.q
-        self.q.put(None)
-        self.t.join()
-        self.q = None
-        self.t = None
-
-class RestartNemesis:
-    def __init__(self, logger: logging.Logger, ns: Sequence[Node], hard: bool):
-        self.logger = logger
-        self.ns = ns
-        self.hard = hard
-        self.q: Optional[queue.Queue] = None
-        self.t: Optional[Thread] = None
-
-    def log(self, *args, **kwargs) -> None:
-        self.logger.info(*args, **kwargs)
-
-    def _nemesis_thread(self, q: queue.Queue) -> None:
-        while True:
-            time.sleep(8 + random.randrange(0, 5))
-            if not q.empty():
-                break
-            n = random.choice(self.ns)
-            self.log('Nemesis: {}restarting {}'.format('hard ' if self.hard else '', n.ip()))
-            if self.hard:
-                n.hard_restart()
-            else:
-                n.restart()
-        self.log('Restart Nemesis: asked to finish')
-
-    def start(self) -> None:
-        if self.t:
-            return
-
-        self.q = queue.Queue()
-        self.t = Thread(target=RestartNemesis._nemesis_thread, args=[self, self.q])
-        self.t.start()
-
-    def stop(self) -> None:
-        if not self.t:
-            return
-
-        assert self.q
-        self.q.put(None)
-        self.t.join()
-        self.q = None
-        self.t = None
-
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--scylla-path', type=Path, required=True)
     parser.add_argument('--replicator-path', type=Path, required=True)
-    parser.add_argument('--migrate-path', type=Path, required=True)
+    parser.add_argument('--migrate-path', type=Path,
+            help='compare tables using scylla-migrate instead of the built-in checker')
+    parser.add_argument('--check-workers', type=int, default=CheckConfig.workers,
+            help='number of processes used by the built-in consistency checker')
     parser.add_argument('--gemini', default=False, action='store_true')
     parser.add_argument('--gemini-seed', type=int)
     parser.add_argument('--gemini-concurrency', type=int, default=5)
     parser.add_argument('--cql', default=False, action='store_true')
-    parser.add_argument('--cqlsh-path', type=Path)
+    parser.add_argument('--cql-repeat', type=int, default=1,
+            help='how many times to run the statements of every cql/ scenario')
+    parser.add_argument('--native-stressor', default=False, action='store_true',
+            help='use the built-in asyncio workload generator (scripts/stress.py) as the stressor')
+    parser.add_argument('--stressor-rate', type=float,
+            help='target operations per second of the native stressor (default: unlimited)')
+    parser.add_argument('--stressor-concurrency', type=int, default=16,
+            help='requests in flight of the native stressor')
     parser.add_argument('--single', default=False, action='store_true')
     parser.add_argument('--mode', default='delta', choices=['delta','preimage','postimage'])
     parser.add_argument('--no-bootstrap-node', default=False, action='store_true')
     parser.add_argument('--duration', type=int, default=60)
-    parser.add_argument('--with-pauses', default=False, action='store_true')
-    parser.add_argument('--with-restarts', default=False, action='store_true')
+    parser.add_argument('--with-pauses', default=False, action='store_true', help='same as --nemesis pause')
+    parser.add_argument('--with-restarts', default=False, action='store_true', help='same as --nemesis hard_restart')
+    parser.add_argument('--nemesis', nargs='+', choices=NEMESIS_KINDS, default=[],
+            help='faults injected into the master nodes during the workload, concurrently (see lib/nemesis.py)')
+    parser.add_argument('--nemesis-seed', type=int, help='seed of the nemeses\' schedule (default: random)')
     parser.add_argument('--ring_delay_ms', type=int, default=3000)
     parser.add_argument('--enable-rbo', default=False, action='store_true')
+    parser.add_argument('--convergence-timeout', type=int, default=600,
+            help='how long to wait for the replicator to catch up after the stressor finishes (seconds)')
+    parser.add_argument('--phase-timeout', type=int, default=300,
+            help='how long to wait for each condition (CDC generation, schema, replicator start) between test phases (seconds)')
+    parser.add_argument('--online-verify', default=False, action='store_true',
+            help='sample recent changes during the run and check that they reach the replica')
+    parser.add_argument('--online-verify-grace', type=float, default=VerifierConfig.grace,
+            help='how long the replicator gets to apply a sampled change before the replica is checked (seconds)')
+    parser.add_argument('--online-verify-rate', type=float, default=VerifierConfig.max_checks_per_s,
+            help='maximum number of online checks per second')
+    parser.add_argument('--online-verify-fail-fast', default=False, action='store_true',
+            help='stop the stressor and fail as soon as the online verifier detects divergence')
+    parser.add_argument('--metrics-interval', type=float, default=5,
+            help='seconds between scrapes of the nodes\' Prometheus metrics; 0 disables scraping')
+    parser.add_argument('--log-index-interval', type=float, default=30,
+            help='seconds between updates of the index of the run\'s logs (see scripts/logs.py); 0 disables indexing')
+    parser.add_argument('--resource-plan', default='warn', choices=['strict', 'warn', 'off'],
+            help='assign disjoint CPU sets and memory budgets to the nodes; when the host doesn\'t have enough,'
+                 ' \'strict\' fails and \'warn\' lets nodes share CPUs')
+    parser.add_argument('--reserve-cpus', type=int, default=1,
+            help='CPUs not given to nodes (left for the stressor, the replicator and the harness)')
+    parser.add_argument('--no-snapshot-cache', default=False, action='store_true',
+            help='always boot the clusters from scratch instead of restoring cached workdirs of booted clusters')
+    parser.add_argument('--snapshot-cache-dir', type=Path, default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--snapshot-cache-size', type=float, default=20,
+            help='the least recently used snapshots are evicted when the cache grows over this many GB')
+    parser.add_argument('--join-concurrency', type=int,
+            help='how many nodes may join a cluster at the same time (default: detect from the Scylla version)')
     args = parser.parse_args()
 
     scylla_path: Path = args.scylla_path.resolve()
     replicator_path: Path = args.replicator_path.resolve()
-    migrate_path: Path = args.migrate_path.resolve()
+    migrate_path: Optional[Path] = args.migrate_path.resolve() if args.migrate_path else None
+    check_workers: int = args.check_workers
+    online_verify: bool = args.online_verify or args.online_verify_fail_fast
+    online_verify_grace: float = args.online_verify_grace
+    online_verify_rate: float = args.online_verify_rate
+    online_verify_fail_fast: bool = args.online_verify_fail_fast
     use_gemini: bool = args.gemini
     use_cql: bool = args.cql
-    if use_cql:
-        cqlsh_path: Path = args.cqlsh_path.resolve()
+    use_native: bool = args.native_stressor
+    stressor_rate: Optional[float] = args.stressor_rate
+    stressor_concurrency: int = args.stressor_concurrency
+    cql_repeat: int = args.cql_repeat
     bootstrap_node: bool = not args.no_bootstrap_node
     duration: int = args.duration
-    with_pauses: bool = args.with_pauses
-    with_restarts: bool = args.with_restarts
+    nemesis_kinds: List[str] = list(dict.fromkeys(args.nemesis
+            + (['pause'] if args.with_pauses else []) + (['hard_restart'] if args.with_restarts else [])))
+    nemesis_seed: int = args.nemesis_seed if args.nemesis_seed is not None else random.randint(1, 2**31)
     gemini_concurrency: int = args.gemini_concurrency
     ring_delay_ms: int = args.ring_delay_ms
     enable_rbo : bool = args.enable_rbo
+    join_concurrency: Optional[int] = args.join_concurrency
+    convergence_timeout: int = args.convergence_timeout
+    phase_timeout: int = args.phase_timeout
+    metrics_interval: float = args.metrics_interval
+    log_index_interval: float = args.log_index_interval
+    resource_plan: str = args.resource_plan
+    use_snapshot_cache: bool = not args.no_snapshot_cache
+    snapshot_cache_size: float = args.snapshot_cache_size
+    reserve_cpus: int = args.reserve_cpus
 
     gemini_seed: int = args.gemini_seed
     if gemini_seed is None:
@@ -170,12 +157,48 @@ if __name__ == "__main__":
     if ring_delay_ms < 1:
         print('ring_delay_ms must be positive')
         exit(1)
+    if join_concurrency is not None and join_concurrency < 1:
+        print('join_concurrency must be positive')
+        exit(1)
+    if convergence_timeout < 1:
+        print('convergence_timeout must be positive')
+        exit(1)
+    if phase_timeout < 1:
+        print('phase_timeout must be positive')
+        exit(1)
+    if snapshot_cache_size <= 0:
+        print('snapshot_cache_size must be positive')
+        exit(1)
+    if reserve_cpus < 0:
+        print('reserve_cpus must be non-negative')
+        exit(1)
+    if metrics_interval < 0:
+        print('metrics_interval must be non-negative')
+        exit(1)
+    if log_index_interval < 0:
+        print('log_index_interval must be non-negative')
+        exit(1)
+    if check_workers < 1:
+        print('check_workers must be positive')
+        exit(1)
+    if sum([use_gemini, use_cql, use_native]) > 1:
+        print('Choose at most one of --gemini, --cql and --native-stressor')
+        exit(1)
+    if stressor_concurrency < 1 or (stressor_rate is not None and stressor_rate <= 0):
+        print('stressor_concurrency and stressor_rate must be positive')
+        exit(1)
+    if cql_repeat < 1:
+        print('cql_repeat must be positive')
+        exit(1)
+    if online_verify_grace <= 0 or online_verify_rate <= 0:
+        print('online_verify_grace and online_verify_rate must be positive')
+        exit(1)
 
     num_master_nodes = 1 if args.single else 3
     mode = args.mode
 
-    if mode != 'delta' and not use_gemini and not use_cql:
-        print('preimage/postimage supported with gemini only')
+    if mode != 'delta' and not use_gemini and not use_cql and not use_native:
+        print('preimage/postimage supported with gemini, cql and the native stressor only')
         exit(1)
 
     cluster_cfg = ClusterConfig(
@@ -186,9 +209,15 @@ if __name__ == "__main__":
         }
     )
 
+    runs_path = Path.cwd() / 'runs'
+
+    # Held until the process exits; the addresses are not leased again while the nodes are running anyway
+    lease = lease_addresses(str(runs_path))
     run_id: str = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    # Runs started in the same second have different leases
+    if lease.index:
+        run_id += f'_{lease.index}'
 
-    runs_path = Path.cwd() / 'runs'
     run_path = runs_path / run_id
     run_path.mkdir(parents=True)
 
@@ -210,128 +239,195 @@ if __name__ == "__main__":
     logger.info(f"""
     scylla: {scylla_path}
     replicator: {replicator_path}
-    migrate: {migrate_path}
+    migrate: {migrate_path if migrate_path else '(built-in checker)'}
     use_gemini: {use_gemini}
-    use_cql: {use_cql}
+    use_cql: {use_cql}{f' (repeat {cql_repeat})' if use_cql else ''}
+    use_native_stressor: {use_native}
     bootstrap_node: {bootstrap_node}
     duration: {duration}
-    pauses: {with_pauses}
-    restrats: {with_restarts}
+    nemeses: {', '.join(nemesis_kinds) if nemesis_kinds else 'none'}{f' (seed {nemesis_seed})' if nemesis_kinds else ''}
     ring_delay_ms: {ring_delay_ms}"""
     f"{gemini_log}"
     f"""
+    addresses: {lease}
     run ID: {run_id}""")
 
     latest_run_path = runs_path / 'latest'
-    latest_run_path.unlink(missing_ok = True)
-    latest_run_path.symlink_to(run_path, target_is_directory = True)
+    # Replace atomically: other runs may be doing the same
+    tmp_link = runs_path / f'.latest-{run_id}'
+    tmp_link.symlink_to(run_path, target_is_directory = True)
+    tmp_link.replace(latest_run_path)
 
     serv = libtmux.Server()
     session_name = f'scylla-test-{run_id}'
     tmux_sess = serv.new_session(session_name = session_name, start_directory = run_path)
 
     master_envs = mk_cluster_env(start = 10, num_nodes = int(bootstrap_node) + num_master_nodes,
-            opts = replace(RunOpts(), developer_mode = True, overprovisioned = True), cluster_cfg = cluster_cfg)
-    master_nodes: Sequence[Node] = [TmuxNode(logger, run_path / e.cfg.ip_addr, e, tmux_sess, scylla_path) for e in master_envs]
+            opts = replace(RunOpts(), developer_mode = True, overprovisioned = True), cluster_cfg = cluster_cfg,
+            net = lease.net)
+    replica_envs = mk_cluster_env(start = 20, num_nodes = 1,
+            opts = replace(RunOpts(), developer_mode = True, overprovisioned = True), cluster_cfg = cluster_cfg,
+            net = lease.net)
+
+    if resource_plan != 'off':
+        try:
+            planned = plan_run_resources(logger, run_path, lease, master_envs + replica_envs,
+                    allow_oversubscription = resource_plan == 'warn', reserve_cpus = reserve_cpus)
+        except Oversubscribed as e:
+            logger.error(f'Not enough resources for the nodes: {e}. Use --resource-plan warn to share CPUs.')
+            exit(1)
+        master_envs, replica_envs = planned[:len(master_envs)], planned[len(master_envs):]
+
+    master_nodes: Sequence[TmuxNode] = [TmuxNode(logger, run_path / e.cfg.ip_addr, e, tmux_sess, scylla_path) for e in master_envs]
 
     new_node = None
     if bootstrap_node:
         new_node = master_nodes[-1]
         master_nodes = master_nodes[:-1]
 
-    nemeses: Optional[Union[List[PauseNemesis], List[RestartNemesis]]] = None
-    # FIXME: make them composable
-    if with_pauses:
-        nemeses = [PauseNemesis(logger, n) for n in master_nodes]
-    if with_restarts:
-        nemeses = [RestartNemesis(logger, master_nodes, True)]
+    nemesis_loop = EventLoopThread()
+    nemeses: Optional[NemesisEngine] = None
+    if nemesis_kinds:
+        nemeses = NemesisEngine(logger, run_path, nemesis_loop, master_nodes,
+                [NEMESIS_SPECS[k] for k in nemesis_kinds], nemesis_seed)
 
-    replica_envs = mk_cluster_env(start = 20, num_nodes = 1,
-            opts = replace(RunOpts(), developer_mode = True, overprovisioned = True), cluster_cfg = cluster_cfg)
     replica_nodes: Sequence[Node] = [TmuxNode(logger, run_path / e.cfg.ip_addr, e, tmux_sess, scylla_path) for e in replica_envs]
 
     logger.info(f'tmux session name: {session_name}')
 
-    def start_cluster(nodes: Sequence[Node]):
-        for n in nodes:
-            n.start()
-    start_master = Thread(target=start_cluster, args=[master_nodes])
-    start_replica = Thread(target=start_cluster, args=[replica_nodes])
-    start_master.start()
-    start_replica.start()
-    start_master.join()
-    start_replica.join()
+    if join_concurrency is None:
+        join_concurrency = max_concurrent_joins(scylla_path, cluster_cfg.experimental)
+    logger.info(f'Join concurrency: {join_concurrency if join_concurrency else "unlimited"}')
+
+    phases = PhaseTimer(logger, run_path)
+
+    cache = SnapshotCache(logger, args.snapshot_cache_dir, int(snapshot_cache_size * 2**30)) if use_snapshot_cache else None
+    fingerprint = scylla_fingerprint(scylla_path, args.snapshot_cache_dir) if cache else ''
+
+    def start_cluster(nodes: Sequence[Node], envs: Sequence[LocalNodeEnv]):
+        if cache:
+            boot_cluster_cached(logger, run_path, nodes, envs, [run_path / e.cfg.ip_addr / 'workdir' for e in envs],
+                    cache, fingerprint, join_concurrency)
+        else:
+            boot_cluster(logger, run_path, nodes, join_concurrency)
+    with phases.phase('boot clusters'):
+        start_master = Thread(target=start_cluster, args=[master_nodes, master_envs[:len(master_nodes)]])
+        start_replica = Thread(target=start_cluster, args=[replica_nodes, replica_envs])
+        start_master.start()
+        start_replica.start()
+        start_master.join()
+        start_replica.join()
 
     #Hardcoded in gemini:
     KS_NAME = 'ks1'
     TABLE_NAMES = ['table1']
 
+    if use_native:
+        TABLE_NAMES = list(NATIVE_STRESSOR_TABLES.keys())
     if use_cql:
         TABLE_NAMES = [os.path.splitext(f)[0] for f in os.listdir('./cql/') if os.path.isfile(os.path.join('./cql/', f))]
     
-    profile = ExecutionProfile(load_balancing_policy = policies.TokenAwarePolicy(policies.DCAwareRoundRobinPolicy()))
-    cm = Cluster([n.ip() for n in master_nodes], protocol_version = 4, execution_profiles={EXEC_PROFILE_DEFAULT: profile})
-    cr = Cluster([n.ip() for n in replica_nodes], protocol_version = 4, execution_profiles={EXEC_PROFILE_DEFAULT: profile})
-
-    w = tmux_sess.windows[0]
-    w.split_window(start_directory = run_path, attach = False)
-    w.split_window(start_directory = run_path, attach = False)
-    w.select_layout('even-vertical')
-    w.panes[0].send_keys('tail -F stressor.log -n +1')
-    w.panes[1].send_keys('tail -F replicator.log -n +1')
-    w.panes[2].send_keys('tail -F migrate.log -n +1')
-
-    logger.info('Waiting for the latest CDC generation to start...')
-    time.sleep(15)
-
+    # One session per cluster, shared by all phases
+    pool = SessionPool(control_connection_timeout = 20)
+    master_ips = [n.ip() for n in master_nodes]
+    replica_ips = [n.ip() for n in replica_nodes]
+
+    # The dashboard shows the snapshots written by `Dashboard` below
+    tmux_sess.windows[0].panes[0].send_keys(f'PYTHONPATH={Path.cwd()} {sys.executable} -m scripts.dashboard .')
+    check_log_name = 'migrate.log' if migrate_path else 'check.log'
+
+    converged = True
+    diverged_early = False
+    # Mismatches confirmed by the online verifier
+    online_mismatches = 0
+    online_verifier_crashed = False
     with ExitStack() as stack:
+        # Closed last
+        stack.enter_context(pool)
+
+        logger.info('Waiting for the latest CDC generation to start...')
+        with phases.phase('wait for CDC generation'):
+            gen = wait_for_cdc_generation(pool.session(master_ips), phase_timeout)
+        logger.info(f'Latest CDC generation: {gen}')
+
+        metrics: Optional[MetricsScraper] = None
+        if metrics_interval > 0:
+            # The new node is included too: it's simply not scraped until it boots
+            metrics = MetricsScraper(logger, run_path,
+                    {'master': list(master_nodes) + ([new_node] if new_node else []), 'replica': replica_nodes},
+                    metrics_interval)
+            metrics.start()
+            stack.callback(metrics.stop)
+
+        dashboard = Dashboard(logger, run_path,
+                {'master': list(master_nodes) + ([new_node] if new_node else []), 'replica': replica_nodes},
+                metrics, nemeses)
+        dashboard.start()
+        stack.callback(dashboard.stop)
+
+        if log_index_interval > 0:
+            # Stopped after the logs below are closed, so that the final update includes all of them
+            indexer = LogIndexer(logger, run_path, log_index_interval)
+            indexer.start()
+            stack.callback(indexer.stop)
+
         stressor_log = stack.enter_context(open(run_path / 'stressor.log', 'w'))
         repl_log = stack.enter_context(open(run_path / 'replicator.log', 'w'))
-        migrate_log = stack.enter_context(open(run_path / 'migrate.log', 'w'))
+        check_log = stack.enter_context(open(run_path / check_log_name, 'w'))
 
         logger.info('Starting stressor')
-        if use_gemini:
-            stressor_proc = stack.enter_context(subprocess.Popen([
-                'gemini',
-                '--duration', '{}s'.format(duration), '--warmup', '0',
-                '-c', '{}'.format(gemini_concurrency),
-                '-m', 'write',
-                '--non-interactive',
-                '--cql-features', 'basic',
-                '--max-mutation-retries', '100', '--max-mutation-retries-backoff', '100ms',
-                '--replication-strategy', f"{{'class': 'SimpleStrategy', 'replication_factor': '{num_master_nodes}'}}",
-                '--table-options', "cdc = {}".format(cdc_opts(mode)),
-                '--test-cluster={}'.format(master_nodes[0].ip()),
-                '--seed', str(gemini_seed),
-                '--verbose',
-                '--level', 'info',
-                '--use-server-timestamps',
-                '--test-host-selection-policy', 'token-aware'
-            ], stdout=stressor_log, stderr=subprocess.STDOUT))
-        elif use_cql:
-            stressor_proc = stack.enter_context(subprocess.Popen([
-                './run_cqlsh.sh',
-                cqlsh_path,
-                master_nodes[0].ip()
-            ], stdout=stressor_log, stderr=subprocess.STDOUT))
-        else:
-            prof_file = 'cdc_replication_profile_single.yaml' if args.single else 'cdc_replication_profile.yaml'
-            stressor_proc = stack.enter_context(subprocess.Popen([
-                'cassandra-stress',
-                "user no-warmup profile={} ops(update=1) cl=QUORUM duration={}s".format(prof_file, duration),
-                "-port jmx=6868", "-mode cql3", "native", "-rate threads=1", "-log level=verbose interval=5", "-errors retries=999 ignore",
-                "-node {}".format(master_nodes[0].ip())],
-                stdout=stressor_log, stderr=subprocess.STDOUT))
-
-        logger.info('Letting stressor run for a while...')
-        # Sleep long enough for stressor to create the keyspace
-        time.sleep(10)
-
-        logger.info('Fetching schema definitions from master cluster.')
-        cm.control_connection_timeout = 20
-        with cm.connect() as _:
-            cm.refresh_schema_metadata(max_schema_agreement_wait=10)
-            ks = cm.metadata.keyspaces[KS_NAME]
+        with phases.phase('start stressor'):
+            if use_gemini:
+                stressor_proc = stack.enter_context(subprocess.Popen([
+                    'gemini',
+                    '--duration', '{}s'.format(duration), '--warmup', '0',
+                    '-c', '{}'.format(gemini_concurrency),
+                    '-m', 'write',
+                    '--non-interactive',
+                    '--cql-features', 'basic',
+                    '--max-mutation-retries', '100', '--max-mutation-retries-backoff', '100ms',
+                    '--replication-strategy', f"{{'class': 'SimpleStrategy', 'replication_factor': '{num_master_nodes}'}}",
+                    '--table-options', "cdc = {}".format(cdc_opts(mode)),
+                    '--test-cluster={}'.format(master_nodes[0].ip()),
+                    '--seed', str(gemini_seed),
+                    '--verbose',
+                    '--level', 'info',
+                    '--use-server-timestamps',
+                    '--test-host-selection-policy', 'token-aware'
+                ], stdout=stressor_log, stderr=subprocess.STDOUT))
+            elif use_cql:
+                stressor_proc = stack.enter_context(subprocess.Popen([
+                    sys.executable, '-m', 'scripts.cql',
+                    '--nodes', *[n.ip() for n in master_nodes],
+                    '--repeat', str(cql_repeat),
+                    '--report', str(run_path / 'cql_scenarios.json')
+                ], stdout=stressor_log, stderr=subprocess.STDOUT))
+            elif use_native:
+                stressor_proc = stack.enter_context(subprocess.Popen([
+                    sys.executable, '-m', 'scripts.stress',
+                    '--nodes', *[n.ip() for n in master_nodes],
+                    '--keyspace', KS_NAME,
+                    '--duration', str(duration),
+                    '--concurrency', str(stressor_concurrency),
+                    '--rf', str(num_master_nodes),
+                    '--cdc', cdc_opts(mode),
+                    '--hist-file', str(run_path / 'stressor_hist.json')
+                ] + (['--rate', str(stressor_rate)] if stressor_rate else []),
+                    stdout=stressor_log, stderr=subprocess.STDOUT))
+            else:
+                prof_file = 'cdc_replication_profile_single.yaml' if args.single else 'cdc_replication_profile.yaml'
+                stressor_proc = stack.enter_context(subprocess.Popen([
+                    'cassandra-stress',
+                    "user no-warmup profile={} ops(update=1) cl=QUORUM duration={}s".format(prof_file, duration),
+                    "-port jmx=6868", "-mode cql3", "native", "-rate threads=1", "-log level=verbose interval=5", "-errors retries=999 ignore",
+                    "-node {}".format(master_nodes[0].ip())],
+                    stdout=stressor_log, stderr=subprocess.STDOUT))
+
+        logger.info('Waiting for stressor to create the schema...')
+        with phases.phase('wait for schema'):
+            wait_for_schema(pool.cluster(master_ips), KS_NAME, TABLE_NAMES, phase_timeout)
+            logger.info('Fetching schema definitions from master cluster.')
+            ks = pool.cluster(master_ips).metadata.keyspaces[KS_NAME]
             ut_ddls = [t[1].as_cql_query() for t in ks.user_types.items()]
             table_ddls = []
             for name, table in ks.tables.items():
@@ -344,18 +440,14 @@ if __name__ == "__main__":
         logger.info('User types:\n{}'.format('\n'.join(ut_ddls)))
         logger.info('Table definitions:\n{}'.format('\n'.join(table_ddls)))
 
-        logger.info('Letting stressor run for a while...')
-        time.sleep(5)
-
         logger.info('Creating schema on replica cluster.')
-        with cr.connect() as sess:
+        with phases.phase('create replica schema'):
+            sess = pool.session(replica_ips)
             sess.execute(f"create keyspace if not exists {KS_NAME}"
                           " with replication = {'class': 'SimpleStrategy', 'replication_factor': 1}")
             for stmt in ut_ddls + table_ddls:
                 sess.execute(stmt)
-
-        logger.info('Letting stressor run for a while...')
-        time.sleep(5)
+            wait_for_schema(pool.cluster(replica_ips), KS_NAME, TABLE_NAMES, phase_timeout)
 
         logger.info('Starting replicator')
         repl_proc = stack.enter_context(subprocess.Popen([
@@ -364,60 +456,117 @@ if __name__ == "__main__":
             '-m', mode],
             stdout=repl_log, stderr=subprocess.STDOUT))
 
+        dashboard.watch_lag(ConvergenceMonitor(logger, pool.session(master_ips), pool.session(replica_ips),
+                KS_NAME, TABLE_NAMES))
+
         if nemeses:
             logger.info('Starting nemeses')
-            for n in nemeses:
-                n.start()
-
-        logger.info('Letting stressor run for a while...')
-        time.sleep(15)
+            nemeses.start()
+
+        logger.info('Waiting for the replicator to start applying changes...')
+        with phases.phase('wait for replicator'):
+            try:
+                wait_for_replicated_data(pool.session(replica_ips), KS_NAME, TABLE_NAMES, repl_proc, phase_timeout)
+            except TimeoutError as e:
+                logger.warning(f'{e}; continuing anyway')
+
+        verifier: Optional[OnlineVerifier] = None
+        if online_verify:
+            logger.info('Starting online verifier')
+            verifier = OnlineVerifier(logger, run_path,
+                    pool.session(master_ips), pool.session(replica_ips), KS_NAME, TABLE_NAMES,
+                    VerifierConfig(grace = online_verify_grace, max_checks_per_s = online_verify_rate))
+            verifier.start()
 
         if new_node:
             if nemeses:
                 logger.info('Stopping nemeses before bootstrapping a node')
-                for n in nemeses:
-                    n.stop()
+                nemeses.stop()
 
             logger.info('Bootstrapping new node')
-            new_node.start()
+            with phases.phase('bootstrap node'):
+                record_boot_timing(run_path, start_node(logger, new_node, max_attempts = 3, concurrent = False))
 
             if nemeses:
                 logger.info('Restarting nemeses after bootstrapping a node')
-                for n in nemeses:
-                    n.start()
+                nemeses.start()
 
         logger.info('Waiting for stressor to finish...')
-        stressor_proc.wait()
+        with phases.phase('workload'):
+            if verifier and online_verify_fail_fast:
+                while stressor_proc.poll() is None:
+                    if verifier.diverged.wait(1):
+                        logger.error('Online verifier detected divergence, stopping stressor')
+                        stressor_proc.terminate()
+                        stressor_proc.wait()
+                        diverged_early = True
+            else:
+                stressor_proc.wait()
         logger.info(f'Stressor return code: {stressor_proc.returncode}')
 
-        logger.info('Letting replicator run for a while (90s)...')
-        time.sleep(90)
+        if verifier:
+            verifier.stop()
+            online_mismatches = len(verifier.mismatches)
+            online_verifier_crashed = verifier.crashed
+            if online_mismatches:
+                logger.error(f'Online verifier confirmed {online_mismatches} mismatches (see online_verifier.jsonl)')
+
+        if diverged_early:
+            logger.info('Skipping convergence wait: divergence already detected')
+        else:
+            logger.info(f'Waiting for the replicator to catch up (timeout: {convergence_timeout}s)...')
+            with phases.phase('wait for convergence'):
+                try:
+                    ConvergenceMonitor(logger, pool.session(master_ips), pool.session(replica_ips), KS_NAME, TABLE_NAMES).wait(convergence_timeout)
+                except ConvergenceTimeout as e:
+                    logger.error(f'Replicator did not catch up in {convergence_timeout}s, lag report:\n{e.report}')
+                    converged = False
 
         if nemeses:
             logger.info('Stopping nemeses')
-            for n in nemeses:
-                n.stop()
+            nemeses.stop()
+            nemesis_loop.stop()
 
         #logger.info('Letting replicator run for a while (240s)...')
         #time.sleep(240)
 
         logger.info('Waiting for replicator to finish...')
-        repl_proc.send_signal(signal.SIGINT)
-        repl_proc.wait()
+        with phases.phase('stop replicator'):
+            repl_proc.send_signal(signal.SIGINT)
+            repl_proc.wait()
         logger.info(f'Replicator return code: {repl_proc.returncode}')
 
-        logger.info('Comparing table contents using scylla-migrate...')
-        migrate_res = subprocess.run(
-            '{} check --master-address {} --replica-address {}'
-            ' --ignore-schema-difference {} {}'.format(
-                migrate_path, master_nodes[0].ip(), replica_nodes[0].ip(),
-                '--no-writetime' if mode == 'postimage' else '',
-                ' '.join(map(lambda e: e[0] + '.' + e[1], zip(itertools.repeat(KS_NAME), TABLE_NAMES)))),
-            shell = True, stdout = migrate_log, stderr = subprocess.STDOUT)
-        logger.info(f'Migrate return code: {migrate_res.returncode}')
-
-    with open(run_path / 'migrate.log', 'r') as f:
-        ok = 'Consistency check OK.\n' in (line for line in f)
+        if metrics:
+            metrics.stop()
+
+        if diverged_early:
+            logger.info('Skipping table comparison: divergence already detected')
+        elif not converged:
+            logger.info('Skipping table comparison: the replica did not converge')
+        elif migrate_path:
+            logger.info('Comparing table contents using scylla-migrate...')
+            with phases.phase('compare tables'):
+                migrate_res = subprocess.run(
+                    '{} check --master-address {} --replica-address {}'
+                    ' --ignore-schema-difference {} {}'.format(
+                        migrate_path, master_nodes[0].ip(), replica_nodes[0].ip(),
+                        '--no-writetime' if mode == 'postimage' else '',
+                        ' '.join(map(lambda e: e[0] + '.' + e[1], zip(itertools.repeat(KS_NAME), TABLE_NAMES)))),
+                    shell = True, stdout = check_log, stderr = subprocess.STDOUT)
+            logger.info(f'Migrate return code: {migrate_res.returncode}')
+        else:
+            logger.info('Comparing table contents...')
+            with phases.phase('compare tables'):
+                check_results = check_consistency(logger, CheckConfig(
+                    master_address = master_nodes[0].ip(), replica_address = replica_nodes[0].ip(),
+                    keyspace = KS_NAME, tables = TABLE_NAMES, no_writetime = mode == 'postimage',
+                    workers = check_workers))
+            report = format_report(KS_NAME, check_results)
+            check_log.write(report + '\n')
+            logger.info('Comparison result:\n{}'.format(format_report(KS_NAME, check_results, max_partitions = 10)))
+
+    with open(run_path / check_log_name, 'r') as f:
+        ok = converged and not diverged_early and not online_mismatches and not online_verifier_crashed and 'Consistency check OK.\n' in (line for line in f)
 
     if mode == 'preimage':
         with open(run_path / 'replicator.log', 'r') as f:
@@ -428,4 +577,10 @@ if __name__ == "__main__":
     else:
         logger.info('Inconsistency detected')
 
+    logger.info(f'Phase durations:\n{phases.summary()}')
+
+    if nemeses or new_node:
+        impacts = save_run_impact(run_path)
+        logger.info(f'Impact of {len(impacts)} events on the workload (see impact.json):\n{format_aggregate(aggregate(impacts))}')
+
     logger.info(f'tmux session name: {session_name}')
@@ -0,0 +1,39 @@
+from pathlib import Path
+import argparse
+import logging
+import sys
+
+from lib.session_daemon import DEFAULT_SOCKET, SessionDaemon, ping, stop
+
+# Keeps driver sessions warm for the snippets and other short-lived tools (see lib/session_daemon.py), e.g.
+# python3 -m scripts.sessiond &
+# python3 snippets/which_gen.py 127.0.0.10 0x813aaaaaaaaaaaab70ed0d48264a3cad
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--socket', type=Path, default=DEFAULT_SOCKET)
+    parser.add_argument('--idle-timeout', type=float, default=3600,
+            help='exit after this many seconds without requests; 0: never')
+    parser.add_argument('--status', default=False, action='store_true', help='only check whether a daemon is running')
+    parser.add_argument('--stop', default=False, action='store_true', help='stop the running daemon')
+    args = parser.parse_args()
+
+    if args.idle_timeout < 0:
+        print('idle-timeout must be non-negative')
+        exit(1)
+
+    if args.status or args.stop:
+        running = stop(args.socket) if args.stop else ping(args.socket)
+        if not running:
+            print(f'No daemon is listening on {args.socket}')
+        else:
+            print(f'{"Stopped the daemon" if args.stop else "A daemon is"} listening on {args.socket}')
+        exit(0 if running else 1)
+
+    logging.basicConfig(level = logging.INFO, format = "%(asctime)s [%(levelname)s] %(message)s",
+            handlers = [logging.StreamHandler(sys.stderr)])
+    try:
+        daemon = SessionDaemon(logging.getLogger(), args.socket, args.idle_timeout or None)
+    except RuntimeError as e:
+        print(e)
+        exit(1)
+    daemon.run()
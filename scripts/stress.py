@@ -0,0 +1,52 @@
+from pathlib import Path
+import argparse
+import sys
+
+from lib.stressor import TABLES, StressConfig, run_stress, select_operations
+
+# Runs the native workload generator, e.g.
+# python3 -m scripts.stress --nodes 127.0.0.10 127.0.0.11 --duration 60 --rate 2000
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', nargs='+', required=True)
+    parser.add_argument('--keyspace', default=StressConfig.keyspace)
+    parser.add_argument('--tables', nargs='+', choices=list(TABLES.keys()), default=list(TABLES.keys()))
+    parser.add_argument('--duration', type=float, default=StressConfig.duration, help='seconds')
+    parser.add_argument('--rate', type=float, help='target operations per second; unlimited if not given')
+    parser.add_argument('--concurrency', type=int, default=StressConfig.concurrency)
+    parser.add_argument('--rf', type=int, default=StressConfig.replication_factor)
+    parser.add_argument('--cdc', default=StressConfig.cdc, help='CDC options of the created tables')
+    parser.add_argument('--partitions', type=int, default=StressConfig.partitions)
+    parser.add_argument('--rows-per-partition', type=int, default=StressConfig.rows_per_partition)
+    parser.add_argument('--interval', type=float, default=StressConfig.interval, help='seconds between reports')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--read-ratio', type=float, default=StressConfig.read_ratio,
+            help='fraction of operations which are reads (0: writes only)')
+    parser.add_argument('--hist-file', type=Path, help='where to save latency histograms (JSON)')
+    args = parser.parse_args()
+
+    if args.duration <= 0 or args.interval <= 0 or (args.rate is not None and args.rate <= 0):
+        print('duration, interval and rate must be positive')
+        exit(1)
+    if args.concurrency < 1 or args.rf < 1 or args.partitions < 1 or args.rows_per_partition < 1:
+        print('concurrency, rf, partitions and rows-per-partition must be positive')
+        exit(1)
+    if not 0 <= args.read_ratio <= 1:
+        print('read-ratio must be between 0 and 1')
+        exit(1)
+
+    cfg = StressConfig(
+        nodes = args.nodes, keyspace = args.keyspace, tables = args.tables,
+        duration = args.duration, rate = args.rate, concurrency = args.concurrency,
+        replication_factor = args.rf, cdc = args.cdc,
+        partitions = args.partitions, rows_per_partition = args.rows_per_partition,
+        interval = args.interval, seed = args.seed, read_ratio = args.read_ratio)
+    try:
+        select_operations(cfg)
+    except ValueError as e:
+        print(e)
+        exit(1)
+
+    res = run_stress(cfg, sys.stdout, args.hist_file)
+
+    exit(0 if res.ops > 0 else 1)
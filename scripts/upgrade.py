@@ -1,7 +1,7 @@
 from pathlib import Path
 from typing import Optional, List, Dict, Sequence
-from threading import Thread
-from dataclasses import dataclass, field, replace
+from threading import Thread, Event
+from dataclasses import dataclass, field, replace, asdict
 import argparse
 import itertools
 import operator
@@ -9,20 +9,35 @@ import libtmux # type: ignore
 import os
 import sys
 import random
+import json
+import time
 import logging
 
 from lib.node_config import RunOpts, ClusterConfig
-from lib.local_node import mk_cluster_env
+from lib.local_node import LocalNodeEnv, mk_cluster_env
+from lib.host_resources import plan_run_resources
+from lib.snapshot_cache import SnapshotCache, boot_cluster_cached, scylla_fingerprint
+from lib.bootstrap import boot_cluster
+from lib.addresses import AddressLease, lease_addresses
 from lib.tmux_node import TmuxNode
 from lib.node import Node
+from lib.rolling_upgrade import GATES, rolling_upgrade
+from lib.stressor import StressConfig, run_stress, select_operations
+from lib.impact import save_upgrade_impact, format_upgrade_impact
+
+# The stressor runs until the upgrade finishes; this only bounds it if the harness doesn't stop it
+WORKLOAD_MAX_DURATION = 7 * 24 * 3600
 
 def create_cluster(
         logger: logging.Logger,
         run_path: Path, sess: libtmux.Session, scylla_path: Path,
-        ip_start: int, num_nodes: int, opts: RunOpts, cluster_cfg: ClusterConfig) -> Sequence[Node]:
-    envs = mk_cluster_env(ip_start, num_nodes, opts, cluster_cfg)
-    nodes = [TmuxNode(logger, run_path / e.cfg.ip_addr, e, sess, scylla_path) for e in envs]
-    return nodes
+        ip_start: int, num_nodes: int, opts: RunOpts, cluster_cfg: ClusterConfig, net: str = '127.0.0') -> Sequence[Node]:
+    return create_nodes(logger, run_path, sess, scylla_path, mk_cluster_env(ip_start, num_nodes, opts, cluster_cfg, net))
+
+def create_nodes(
+        logger: logging.Logger,
+        run_path: Path, sess: libtmux.Session, scylla_path: Path, envs: Sequence[LocalNodeEnv]) -> Sequence[Node]:
+    return [TmuxNode(logger, run_path / e.cfg.ip_addr, e, sess, scylla_path) for e in envs]
 
 @dataclass(frozen=True)
 class TestConfig:
@@ -41,8 +56,50 @@ class TestConfig:
     experimental_1: List[str]
     experimental_2: List[str]
     extra_opts: str = ''
+    # Assign disjoint CPUs and memory budgets to the nodes (see lib/host_resources.py):
+    # 'strict' fails if the host doesn't have enough, 'warn' shares CPUs then, 'off' doesn't assign any
+    resource_plan: str = 'warn'
+    # Restore the workdirs of the booted cluster from this cache (see lib/snapshot_cache.py); None: boot from scratch
+    snapshot_cache: Optional[SnapshotCache] = None
+    # How many nodes are upgraded at the same time
+    parallelism: int = 1
+    # Checks between upgrade steps (see lib/rolling_upgrade.py)
+    gates: List[str] = field(default_factory=lambda: list(GATES))
+    gate_timeout: float = 300
+    # Run the native stressor (lib/stressor.py) during the whole upgrade and analyze its throughput and latency
+    # per upgrade step and upgraded node (see lib/impact.py)
+    workload: bool = False
+    # Operations per second; None: as many as `workload_concurrency` allows
+    workload_rate: Optional[float] = 1000
+    # Fraction of the operations which are reads
+    workload_read_ratio: float = 0.5
+    workload_concurrency: int = 16
+    # Seconds of load before the first step (the baseline) and after the last one
+    workload_warmup: float = 60
+    workload_cooldown: float = 60
+
+# Returns the lease of the cluster's addresses; it's held as long as the returned object is referenced
+# (or until the process exits), and the addresses are not leased again while the nodes are running anyway
+def upgrade_test(cfg: TestConfig) -> AddressLease:
+    if cfg.parallelism < 1 or cfg.parallelism > cfg.num_nodes:
+        print('parallelism must be between 1 and the number of nodes')
+        exit(1)
+    if set(cfg.gates) - set(GATES):
+        print(f'Unknown gates: {set(cfg.gates) - set(GATES)}; choose from {GATES}')
+        exit(1)
+    if cfg.gate_timeout <= 0:
+        print('gate_timeout must be positive')
+        exit(1)
+    if (cfg.workload_rate is not None and cfg.workload_rate <= 0) or cfg.workload_concurrency < 1:
+        print('workload_rate and workload_concurrency must be positive')
+        exit(1)
+    if not 0 <= cfg.workload_read_ratio <= 1:
+        print('workload_read_ratio must be between 0 and 1')
+        exit(1)
+    if cfg.workload_warmup < 0 or cfg.workload_cooldown < 0:
+        print('workload_warmup and workload_cooldown must be non-negative')
+        exit(1)
 
-def upgrade_test(cfg: TestConfig) -> None:
     cfg.run_path.mkdir(parents=True)
     logging.basicConfig(
         level = logging.INFO,
@@ -76,16 +133,25 @@ config: {cfg}
         }
     )
 
+    lease = lease_addresses(str(cfg.run_path))
+    logger.info(f'Addresses: {lease}')
+
     ip_start = 1
     logger.info('Creating cluster...')
-    c = create_cluster(logger, cfg.run_path, cfg.sess, cfg.scylla_path_1, ip_start, cfg.num_nodes, opts, cluster_cfg)
+    envs = mk_cluster_env(ip_start, cfg.num_nodes, opts, cluster_cfg, lease.net)
+    if cfg.resource_plan != 'off':
+        envs = plan_run_resources(logger, cfg.run_path, lease, envs, allow_oversubscription = cfg.resource_plan == 'warn')
+    c = create_nodes(logger, cfg.run_path, cfg.sess, cfg.scylla_path_1, envs)
 
     if cfg.interactive:
         input('Press Enter to boot the cluster')
 
     logger.info('Waiting for the cluster to boot...')
-    for n in c:
-        n.start()
+    if cfg.snapshot_cache:
+        boot_cluster_cached(logger, cfg.run_path, c, envs, [cfg.run_path / e.cfg.ip_addr / 'workdir' for e in envs],
+                cfg.snapshot_cache, scylla_fingerprint(cfg.scylla_path_1))
+    else:
+        boot_cluster(logger, cfg.run_path, c)
 
     node_map: Dict[int, str] = {i: c[i].ip() for i in range(len(c))}
     logger.info(f'Node map: {node_map}')
@@ -119,15 +185,11 @@ config: {cfg}
 
     assert ord and set(ord) == set(node_map.keys())
 
-    for i in ord:
-        n = c[i]
-
+    def before_step(step: int, ns: Sequence[Node]) -> None:
         if cfg.interactive:
-            inp = input(f'Press Enter to upgrade node {n.ip()}.')
-
-        logger.info(f'Stopping node {n.ip()}...')
-        n.stop()
+            input(f'Press Enter to upgrade {"node" if len(ns) == 1 else "nodes"} {", ".join(n.ip() for n in ns)}.')
 
+    def upgrade(n: Node) -> None:
         logger.info(f'Resetting Scylla binary path for node {n.ip()} to {cfg.scylla_path_2}.')
         n.reset_scylla_binary(cfg.scylla_path_2)
 
@@ -135,9 +197,47 @@ config: {cfg}
             logger.info(f'Resetting experimental setting from {cfg.experimental_1} to {cfg.experimental_2}')
             n.reset_node_config(replace(n.get_node_config(), experimental = cfg.experimental_2))
 
-        logger.info(f'Restarting node {n.ip()}...')
-        n.start()
-
-        logger.info(f'Node {n.ip()} upgraded.')
+    stop_workload = Event()
+    stressor: Optional[Thread] = None
+    if cfg.workload:
+        stress_cfg = StressConfig(
+            nodes = [n.ip() for n in c],
+            duration = WORKLOAD_MAX_DURATION,
+            rate = cfg.workload_rate,
+            concurrency = cfg.workload_concurrency,
+            replication_factor = min(3, cfg.num_nodes),
+            # CDC may not be enabled in the old version
+            cdc = "{'enabled': false}",
+            read_ratio = cfg.workload_read_ratio,
+        )
+        # Fails here rather than in the workload's thread
+        select_operations(stress_cfg)
+        logger.info(f'Starting the workload: {stress_cfg}')
+        stressor_log = open(cfg.run_path / 'stressor.log', 'w')
+        stressor = Thread(target = run_stress,
+                args = (stress_cfg, stressor_log, cfg.run_path / 'stressor_hist.json', stop_workload))
+        stressor.start()
+        time.sleep(cfg.workload_warmup)
+        if not stressor.is_alive():
+            logger.error('The workload stopped before the upgrade started')
+            exit(1)
+
+    try:
+        report = rolling_upgrade(logger, cfg.run_path, c, ord, upgrade, cfg.parallelism, cfg.gates, cfg.gate_timeout,
+                before_step)
+        if stressor:
+            time.sleep(cfg.workload_cooldown)
+    finally:
+        if stressor:
+            logger.info('Stopping the workload...')
+            stop_workload.set()
+            stressor.join()
+            stressor_log.close()
+    with open(cfg.run_path / 'upgrade_summary.json', 'w') as f:
+        json.dump(asdict(report), f, indent = 1)
+    logger.info(f'Upgrade summary:\n{report.summary()}')
+    if stressor:
+        logger.info(f'Workload during the upgrade:\n{format_upgrade_impact(save_upgrade_impact(cfg.run_path))}')
 
     logger.info(f'Upgrade finished.')
+    return lease
@@ -1,12 +1,47 @@
+from pathlib import Path
+import argparse
+import datetime
 import sys
-from cassandra import ConsistencyLevel # type: ignore
-from cassandra.query import SimpleStatement # type: ignore
-from cassandra.cluster import Cluster # type: ignore
 
-ip = str(sys.argv[1])
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from cassandra.metadata import protect_name # type: ignore
+from lib.cdc import cdc_log_table, timeuuid_to_micros
+from lib.session_daemon import execute_many
+from lib.stream_index import StreamIndex
 
-c = Cluster([ip])
-s = c.connect()
+# Gives the greatest `cdc$time` in the CDC log of a table without scanning the log: the streams
+# of the newest generations (from the local stream index, see lib/stream_index.py) are queried concurrently
+# for their newest row, e.g.
+# python3 snippets/latest_cdc_time.py 127.0.0.10 --keyspace ks --table tb --per-stream
 
-res = s.execute(SimpleStatement('select "cdc$time" from ks.tb_scylla_cdc_log', consistency_level=ConsistencyLevel.QUORUM))
-print(max(res))
+parser = argparse.ArgumentParser()
+parser.add_argument('ip')
+parser.add_argument('--keyspace', default='ks')
+parser.add_argument('--table', default='tb', help='the base table (not the CDC log table)')
+parser.add_argument('--generations', type=int, default=2, help='query streams of this many newest generations')
+parser.add_argument('--concurrency', type=int, default=64)
+parser.add_argument('--per-stream', default=False, action='store_true', help='print the newest cdc$time of every stream')
+args = parser.parse_args()
+
+if args.generations < 1 or args.concurrency < 1:
+    print('generations and concurrency must be positive')
+    exit(1)
+
+with StreamIndex(args.ip) as idx:
+    idx.update()
+    gens = idx.generations()[-args.generations:]
+    sids = list(dict.fromkeys(sid for g in gens for sid, _ in idx.streams(g.time)))
+
+log = f'{protect_name(args.keyspace)}.{protect_name(cdc_log_table(args.table))}'
+res = execute_many([args.ip], f'SELECT "cdc$time" FROM {log} WHERE "cdc$stream_id" = ? ORDER BY "cdc$time" DESC LIMIT 1',
+        [(sid,) for sid in sids], consistency='QUORUM', concurrency=args.concurrency)
+latest = {sid: rows.rows[0][0] for sid, rows in zip(sids, res) if rows.rows}
+
+fmt = lambda u: datetime.datetime.utcfromtimestamp(timeuuid_to_micros(u) / 1e6).strftime('%Y-%m-%d %H:%M:%S.%f')
+if args.per_stream:
+    for sid, u in sorted(latest.items(), key=lambda e: timeuuid_to_micros(e[1]), reverse=True):
+        print(sid.hex(), u, fmt(u))
+print(f'{len(latest)} of {len(sids)} streams of {len(gens)} generations have changes')
+if latest:
+    sid, u = max(latest.items(), key=lambda e: timeuuid_to_micros(e[1]))
+    print(u, fmt(u), 'in stream', sid.hex())
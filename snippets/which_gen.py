@@ -1,25 +1,42 @@
 #!/usr/bin/python3
 
+from pathlib import Path
+import argparse
 import sys
-from cassandra import ConsistencyLevel # type: ignore
-from cassandra.query import SimpleStatement # type: ignore
-from cassandra.cluster import Cluster # type: ignore
+import re
 
-ip = str(sys.argv[1])
-sid = str(sys.argv[2])
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from lib.stream_index import StreamIndex, parse_stream_id
 
-if sid.startswith('0x'):
-    sid = sid[2:]
+# Prints the CDC generations and the ones which contain the given streams, using a local index
+# of the cluster's streams (lib/stream_index.py) which is updated with new generations first, e.g.
+# python3 snippets/which_gen.py 127.0.0.10 0x813aaaaaaaaaaaab70ed0d48264a3cad
+# python3 snippets/which_gen.py 127.0.0.10 --from-log runs/latest/replicator.log
 
-c = Cluster([ip])
-s = c.connect()
+STREAM_ID_RE = re.compile(r'\b(?:0x)?([0-9a-fA-F]{32})\b')
 
-res = s.execute(SimpleStatement('select * from system_distributed.cdc_streams', consistency_level=ConsistencyLevel.QUORUM))
-res = sorted(res, key=lambda r: r[0])
-for r in res:
-    print(r[0], len(r[2]))
+parser = argparse.ArgumentParser()
+parser.add_argument('ip')
+parser.add_argument('stream_ids', nargs='*')
+parser.add_argument('--from-log', type=Path, help='look up every stream ID found in this file')
+parser.add_argument('--no-update', default=False, action='store_true', help='don\'t look for new generations')
+args = parser.parse_args()
 
-for r in res:
-    if sid in (s.hex() for s in r[2]):
-        print(sid, 'is in', r[0])
-        break
+sids = [parse_stream_id(s) for s in args.stream_ids]
+if args.from_log:
+    with open(args.from_log, errors='replace') as f:
+        sids.extend(bytes.fromhex(m) for l in f for m in STREAM_ID_RE.findall(l))
+
+with StreamIndex(args.ip) as idx:
+    if not args.no_update:
+        idx.update()
+    for g in idx.generations():
+        print(g.time, g.streams)
+
+    found = idx.lookup(sids)
+    for sid in dict.fromkeys(sids):
+        locs = found.get(sid)
+        if not locs:
+            print(sid.hex(), 'is in no generation')
+        else:
+            print(sid.hex(), 'is in', ', '.join(str(l.generation) for l in locs), f'(token {locs[0].token})')